@@ -2,38 +2,65 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button
 from matplotlib.widgets import Slider, RadioButtons
-from scipy.signal import convolve2d
-from skimage.restoration import wiener, unsupervised_wiener, richardson_lucy
-from numpy.fft import rfft2, irfft2
-from scipy.ndimage import binary_dilation
-from skimage.draw import disk
 import matplotlib.gridspec as gridspec
+from microscopy_tools.cache import ResultCache
+from microscopy_tools.convolution import make_convolver
+from microscopy_tools.deconvolution import METHODS, PREVIEW_METHODS, iterate_pipeline
+from microscopy_tools.profiling import add_report, timer
+from microscopy_tools.rasterise import PointRenderer
+from microscopy_tools.rendering import Renderer
+from microscopy_tools.scheduler import LatestJobScheduler
+from microscopy_tools.varying_psf import PSFGrid, VaryingPSFConvolver
+from microscopy_tools.workspace import Workspace, normalize
 
 class InteractiveImageProcessor:
-    def __init__(self,ax_drawing,ax_original,ax_psf,ax_noise,ax_blurred,ax_deconvolved,btn,s_pointsize,s_spread,s_noise,s_balance, point_size=5, image_size=(100, 100)):
+    def __init__(self,ax_drawing,ax_original,ax_psf,ax_noise,ax_blurred,ax_deconvolved,btn,s_pointsize,s_spread,s_noise,s_balance,s_aberration,s_photons, point_size=5, image_size=(100, 100), convolver='fft', precision=None):
         self.ax = ax_drawing
+        self.btn = btn
+        self.s_pointsize, self.s_spread, self.s_noise, self.s_balance = s_pointsize, s_spread, s_noise, s_balance
+        self.s_aberration, self.s_photons = s_aberration, s_photons
+        self.precision = precision
+        self.convolver = make_convolver(convolver, precision=precision)  # 'fft' or 'direct', float32 by default
+        self.workspace = Workspace(precision)  # Display buffers reused by every result
+        # Results of earlier parameters, e.g. when switching back to a method or slider value
+        self.cache = ResultCache()
+        add_report(self.cache.report)  # For tuning the cache budget (MICROSCOPY_CACHE_MB), with MICROSCOPY_PROFILE=1
         self.image_size = image_size
         self.point_size = point_size
-        self.image = np.zeros(image_size)  # Create an empty image
+        self.renderer = PointRenderer(image_size, kernel='disk', radius=point_size, precision=precision)
+        self.image = self.renderer.image  # Updated in place by the renderer, image[y, x] with y upwards
         self.points = []
         self.cid = ax_drawing.figure.canvas.mpl_connect('button_press_event', self)
         self.scatter = ax_drawing.scatter([], [], s=100)  # Visual representation of points
+        self.display = Renderer(ax_drawing.figure)
+        self.display.add_artist(self.scatter)
         self.plot_created = False
         self.plot_figure = []
 
+        # Deconvolution runs on a worker thread, only the latest slider value is computed
+        self.scheduler = LatestJobScheduler(ax_drawing.figure.canvas)
+        self.needs_full_quality = False
+        ax_drawing.figure.canvas.mpl_connect('button_release_event', self.on_release)
+
         s_pointsize.on_changed(self.update_image_based_on_radius)  
         # Call update function on slider value change
-        s_spread.on_changed(self.process_image)
-        s_balance.on_changed(self.process_image)
-        s_noise.on_changed(self.process_image)
+        s_spread.on_changed(self.preview_image)
+        s_balance.on_changed(self.preview_image)
+        s_noise.on_changed(self.preview_image)
+        s_aberration.on_changed(self.preview_image)
+        s_photons.on_changed(self.preview_image)
         btn.on_clicked(self.process_image)
 
-        # Display initial images
-        self.img_original = ax_original.imshow(self.image, cmap='gray')
-        self.img_psf = ax_psf.imshow(self.image, cmap='gray')  # Placeholder for PSF
-        self.img_noise = ax_noise.imshow(self.image, cmap='gray')  # Placeholder for Noise
-        self.img_blurred = ax_blurred.imshow(self.image, cmap='gray')  # Placeholder for Blurred and Noisy Image
-        self.img_deconvolved = ax_deconvolved.imshow(self.image, cmap='gray')  # Placeholder for Deconvolved Image
+        # Display initial images, created once and updated in place
+        self.img_original = self.display.image(ax_original, self.image, origin='lower')
+        self.img_psf = self.display.image(ax_psf, self.image, origin='lower')  # Placeholder for PSF
+        self.img_noise = self.display.image(ax_noise, self.image, origin='lower')  # Placeholder for Noise
+        self.img_blurred = self.display.image(ax_blurred, self.image, origin='lower')  # Placeholder for Blurred and Noisy Image
+        self.img_deconvolved = self.display.image(ax_deconvolved, self.image, origin='lower')  # Placeholder for Deconvolved Image
+        # Iteration count of the iterative method, updated while it converges
+        self.iteration_text = ax_deconvolved.text(0.03, 0.95, '', transform=ax_deconvolved.transAxes,
+                                                  color='yellow', fontsize=8, va='top')
+        self.display.add_artist(self.iteration_text)
 
 
     def __call__(self, event):
@@ -41,129 +68,149 @@ class InteractiveImageProcessor:
             return
         x, y = int(event.xdata), int(event.ydata)
         self.points.append((x, y))
-        print(len(self.points))
-        self.update_image_based_on_radius(s_pointsize.val)
+        if self.renderer.radius != self.s_pointsize.val:
+            self.update_image_based_on_radius(self.s_pointsize.val)
+        else:
+            # Only the new point is drawn into the existing image
+            self.renderer.stamp(x, y)
+            self.update_plot()
 
     def update_image_based_on_radius(self, val):
-        # Clear image
-        self.image.fill(0)
-        # Update image with new radius for each point
-        for x, y in self.points:
-            rr, cc = disk((y, x), radius=val, shape=self.image.shape)
-            self.image[rr, cc] = 1
-        self.image = np.flipud(self.image)
+        # Redraw all points with the new radius
+        self.renderer.rebuild(self.points, val)
         self.update_plot()
 
     def update_plot(self):
         self.scatter.set_offsets(self.points)
-        self.scatter.set_sizes([np.pi * s_pointsize.val**2] * len(self.points))
-        self.ax.figure.canvas.draw_idle()
-
-        self.img_original = ax_original.imshow(self.image,cmap='gray')
+        self.scatter.set_sizes([np.pi * self.s_pointsize.val**2] * len(self.points))
+        self.img_original.update(self.image)
+        self.display.refresh(self.scatter, self.img_original)
         self.process_image([])
 
-    def process_image(self, event):
-
-        print('processing image')
-
-        spread = s_spread.val
-        balance = s_balance.val
-        noise = s_noise.val
-        method = btn.value_selected
-
-        x = np.linspace(-10, 10, 100)
-        y = np.linspace(-10, 10, 100)
-        x, y = np.meshgrid(x, y)
-        psf = np.exp(-(x**2 + y**2) / spread)
-        psf /= psf.sum()  # Normalize PSF so that it sums to 1
-        blurred = convolve2d(self.image, psf, mode='same')
-        noise_component = noise * np.random.normal(size=blurred.shape)
-        noisy_blurred = blurred + noise_component
-        if method == 'Wiener':
-            deconvolved = wiener(noisy_blurred, psf, balance)
-        elif method == 'Inverse':
-            f_psf = rfft2(psf, s=noisy_blurred.shape)
-            f_blurred = rfft2(self.image)*f_psf
-            f_noise = rfft2(noise_component)
-            with np.errstate(divide='ignore', invalid='ignore'):
-                f_deconvolved =  f_blurred / f_psf + f_noise / f_psf
-            deconvolved = irfft2(f_deconvolved)
-        elif method == 'Iterative':
-            deconvolved = richardson_lucy(noisy_blurred,psf)
-        elif method == 'Unsupervised Wiener':
-            deconvolved, chains = unsupervised_wiener(noisy_blurred,psf)
-
-        # Normalize each image for better visibility
-        psf_normalized = (psf - np.min(psf)) / (np.max(psf) - np.min(psf))
-        noise_component_normalized = (noise_component - np.min(noisy_blurred)) / (np.max(noisy_blurred) - np.min(noisy_blurred))
-        noisy_blurred_normalized = (noisy_blurred - np.min(noisy_blurred)) / (np.max(noisy_blurred) - np.min(noisy_blurred))
-        deconvolved_normalized = (deconvolved - np.min(deconvolved)) / (np.max(deconvolved) - np.min(deconvolved))
-
-        # self.img_psf.set_data(psf_normalized)
-        # self.img_noise.set_data(noise_component_normalized)  # For noise, normalization might not be needed as we visualize the raw noise pattern
-        # self.img_blurred.set_data(noisy_blurred_normalized)
-        # self.img_deconvolved.set_data(deconvolved_normalized)
-        self.img_psf = ax_psf.imshow(psf_normalized, cmap='gray')  # Placeholder for PSF
-        self.img_noise = ax_noise.imshow(noise_component_normalized, cmap='gray')  # Placeholder for Noise
-        self.img_blurred = ax_blurred.imshow(noisy_blurred_normalized, cmap='gray')  # Placeholder for Blurred and Noisy Image
-        self.img_deconvolved = ax_deconvolved.imshow(deconvolved_normalized, cmap='gray')  # Placeholder for Deconvolved Image
-        fig.canvas.draw_idle()
-
-        plt.show()
-
-
-# Setup the figure and axes
-# Setup the figure and axes
-fig = plt.figure()
-gs = gridspec.GridSpec(5, 3, height_ratios=[0.1, 0.1, 0.5, 1, 1])  # Define the grid layout
-ax_drawing = fig.add_subplot(gs[0:3, 0])
-ax_drawing.set_title('Click to add fluorophores')
-ax_drawing.set_aspect('equal')
-ax_drawing.set_xticks([])
-ax_drawing.set_yticks([])
-ax_drawing.set_xlim(0,99)
-ax_drawing.set_ylim(0,99)
-ax_original = fig.add_subplot(gs[3, 0])
-ax_original.set_title('Object')
-ax_original.set_xticks([])
-ax_original.set_yticks([])
-ax_psf = fig.add_subplot(gs[3, 1])
-ax_psf.set_title('Point spread function')
-ax_psf.set_xticks([])
-ax_psf.set_yticks([])
-ax_noise = fig.add_subplot(gs[3, 2])
-ax_noise.set_title('Noise')
-ax_noise.set_xticks([])
-ax_noise.set_yticks([])
-ax_blurred = fig.add_subplot(gs[4, 0])
-ax_blurred.set_title('Image')
-ax_blurred.set_xticks([])
-ax_blurred.set_yticks([])
-ax_deconvolved = fig.add_subplot(gs[4, 2])
-ax_deconvolved.set_title('Deconvolved image')
-ax_deconvolved.set_xticks([])
-ax_deconvolved.set_yticks([])
-ax_button = fig.add_subplot(gs[4, 1])
-ax_button.set_title('Deconvolution method')
-ax_button.axis('off')
-ax_slider_pointsize = fig.add_subplot(gs[0, 1])
-ax_slider_spread = fig.add_subplot(gs[0, 2])
-ax_slider_noise = fig.add_subplot(gs[1, 1])
-ax_slider_balance = fig.add_subplot(gs[1, 2])
-
-# Initial parameters
-initial_spread = 20
-initial_balance = 0.1
-initial_noise = 0.005
-
-btn = RadioButtons(ax_button, ('Wiener', 'Unsupervised Wiener', 'Inverse', 'Iterative'))
-
-s_pointsize = Slider(ax_slider_pointsize, 'Object size', 1, 20, valinit=5, valstep=1)
-s_spread = Slider(ax_slider_spread, 'PSF spread', 5, 50, valinit=initial_spread)
-s_noise = Slider(ax_slider_noise, 'Noise level', 0, 0.01, valinit=initial_noise)
-s_balance = Slider(ax_slider_balance, 'Wiener balance', 0, 0.5, valinit=initial_balance)
-
-processor = InteractiveImageProcessor(ax_drawing,ax_original,ax_psf,ax_noise,ax_blurred,ax_deconvolved,btn,s_pointsize,s_spread,s_noise,s_balance)
-
-plt.tight_layout()
-plt.show()
+    def preview_image(self, val):
+        # While a slider is dragged the slow methods only show a quick preview
+        if self.btn.value_selected in PREVIEW_METHODS:
+            self.needs_full_quality = True
+            self.process_image(val, preview=True, dragging=True)
+        else:
+            self.process_image(val, dragging=True)
+
+    def on_release(self, event):
+        # Full quality result once the slider is released
+        if self.needs_full_quality:
+            self.process_image(event)
+
+    def process_image(self, event, preview=False, dragging=False):
+        if not preview:
+            self.needs_full_quality = False
+        spread = self.s_spread.val
+        balance = self.s_balance.val
+        noise = self.s_noise.val
+        photons = self.s_photons.val or None  # Shot noise off at 0
+        method = self.btn.value_selected
+        # A field-dependent PSF is convolved and deconvolved tile by tile
+        aberration = self.s_aberration.val
+        if aberration > 0:
+            convolver = VaryingPSFConvolver(precision=self.precision, aberration=aberration)
+        else:
+            convolver = self.convolver
+
+        # PSF and its transform are cached per spread, so noise/balance changes reuse them.
+        # The noise is seeded: its pattern stays the same and the noise level only rescales it.
+        # The object is copied because new points are drawn into it while the worker runs.
+        # The iterative method posts its estimate every few iterations.
+        # Results of superseded jobs are dropped, except while a slider is dragged.
+        self.scheduler.submit(iterate_pipeline, self.image.copy(), spread, noise, balance, method,
+                              convolver=convolver, preview=preview, photons=photons, cache=self.cache, on_result=self.show_result,
+                              show_stale=dragging)
+
+    def show_result(self, result):
+        acquisition, deconvolved, state = result
+        psf, blurred, noise_component, noisy_blurred = acquisition
+        if isinstance(psf, PSFGrid):
+            psf = psf.montage()  # The PSFs of all tiles
+
+        # Normalize each image for better visibility, into the reused display buffers
+        with timer('normalise'):
+            buffer = self.workspace.buffer
+            psf_normalized = normalize(psf, out=buffer('psf', psf.shape))
+            low, high = np.min(noisy_blurred), np.max(noisy_blurred)
+            noise_component_normalized = normalize(noise_component, out=buffer('noise', noise_component.shape), low=low, high=high)
+            noisy_blurred_normalized = normalize(noisy_blurred, out=buffer('noisy_blurred', noisy_blurred.shape), low=low, high=high)
+            deconvolved_normalized = normalize(deconvolved, out=buffer('deconvolved', deconvolved.shape))
+
+        self.img_psf.update(psf_normalized)
+        self.img_noise.update(noise_component_normalized)  # For noise, normalization might not be needed as we visualize the raw noise pattern
+        self.img_blurred.update(noisy_blurred_normalized)
+        self.img_deconvolved.update(deconvolved_normalized)
+        if state is None:
+            self.iteration_text.set_text('')
+        else:
+            self.iteration_text.set_text(f"iteration {state.iteration}" + (' (converged)' if state.converged else ''))
+        self.display.refresh(self.img_psf, self.img_noise, self.img_blurred, self.img_deconvolved, self.iteration_text)
+
+
+def main():
+    # Setup the figure and axes
+    fig = plt.figure()
+    gs = gridspec.GridSpec(6, 3, height_ratios=[0.1, 0.1, 0.1, 0.4, 1, 1])  # Define the grid layout
+    ax_drawing = fig.add_subplot(gs[0:4, 0])
+    ax_drawing.set_title('Click to add fluorophores')
+    ax_drawing.set_aspect('equal')
+    ax_drawing.set_xticks([])
+    ax_drawing.set_yticks([])
+    ax_drawing.set_xlim(0,99)
+    ax_drawing.set_ylim(0,99)
+    ax_original = fig.add_subplot(gs[4, 0])
+    ax_original.set_title('Object')
+    ax_original.set_xticks([])
+    ax_original.set_yticks([])
+    ax_psf = fig.add_subplot(gs[4, 1])
+    ax_psf.set_title('Point spread function')
+    ax_psf.set_xticks([])
+    ax_psf.set_yticks([])
+    ax_noise = fig.add_subplot(gs[4, 2])
+    ax_noise.set_title('Noise')
+    ax_noise.set_xticks([])
+    ax_noise.set_yticks([])
+    ax_blurred = fig.add_subplot(gs[5, 0])
+    ax_blurred.set_title('Image')
+    ax_blurred.set_xticks([])
+    ax_blurred.set_yticks([])
+    ax_deconvolved = fig.add_subplot(gs[5, 2])
+    ax_deconvolved.set_title('Deconvolved image')
+    ax_deconvolved.set_xticks([])
+    ax_deconvolved.set_yticks([])
+    ax_button = fig.add_subplot(gs[5, 1])
+    ax_button.set_title('Deconvolution method')
+    ax_button.axis('off')
+    ax_slider_pointsize = fig.add_subplot(gs[0, 1])
+    ax_slider_spread = fig.add_subplot(gs[0, 2])
+    ax_slider_noise = fig.add_subplot(gs[1, 1])
+    ax_slider_balance = fig.add_subplot(gs[1, 2])
+    ax_slider_aberration = fig.add_subplot(gs[2, 1])
+    ax_slider_photons = fig.add_subplot(gs[2, 2])
+
+    # Initial parameters
+    initial_spread = 20
+    initial_balance = 0.1
+    initial_noise = 0.005
+
+    btn = RadioButtons(ax_button, METHODS)
+
+    s_pointsize = Slider(ax_slider_pointsize, 'Object size', 1, 20, valinit=5, valstep=1)
+    s_spread = Slider(ax_slider_spread, 'PSF spread', 5, 50, valinit=initial_spread)
+    s_noise = Slider(ax_slider_noise, 'Noise level', 0, 0.01, valinit=initial_noise)
+    s_balance = Slider(ax_slider_balance, 'Wiener balance', 0, 0.5, valinit=initial_balance)
+    s_aberration = Slider(ax_slider_aberration, 'Field aberration', 0, 1, valinit=0)
+    s_photons = Slider(ax_slider_photons, 'Peak photons', 0, 1000, valinit=0, valstep=10)
+
+    processor = InteractiveImageProcessor(ax_drawing,ax_original,ax_psf,ax_noise,ax_blurred,ax_deconvolved,btn,s_pointsize,s_spread,s_noise,s_balance,s_aberration,s_photons)
+
+    plt.tight_layout()
+    plt.show()
+    return processor
+
+
+if __name__ == '__main__':
+    main()
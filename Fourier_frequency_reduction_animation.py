@@ -1,142 +1,199 @@
-import numpy as np
 import matplotlib.pyplot as plt
-from skimage.io import imread
-from skimage.color import rgb2gray
-from skimage import color, exposure, transform
-from skimage import exposure
-
+import math
 import os
 
 from matplotlib.widgets import Button, Slider
-
-import tkinter as tk
-from tkinter import filedialog
+from microscopy_tools.fourier import IncrementalLowPassFilter
+from microscopy_tools.loaders import open_image, to_float
+from microscopy_tools.profiling import timer
+from microscopy_tools.rendering import Renderer
+from microscopy_tools.sampling import bin_image
+from microscopy_tools.streaming import FilteredStream, FrameSequence, Player
 
 # Get the directory where the script is located
 script_directory = os.path.dirname(os.path.abspath(__file__))
 
+# Larger images are binned down to this size, keeping the FFTs interactive
+max_image_size = 4096
+
 # Function to load and preprocess the image
 def load_image(filepath):
-    image = imread(filepath)
-    if image.shape[2] == 3:
-        image = rgb2gray(image)
-    image = exposure.rescale_intensity(image, out_range='float64')
-    return image
-
-def visualize_image(image, percentage):
-    global fig, ax, fo, fa, io, ia
-
-    fourier_orig, fourier_masked, image_filtered = process_images(image, percentage)
-
-    io = ax[0].imshow(image, cmap = 'gray')
+    # Greyscale, RGB(A), stacks and multi-channel files: the first plane/channel is used
+    source = open_image(filepath)
+    image = source.plane(0)
+    factor = math.ceil(max(image.shape) / max_image_size)
+    if factor > 1:
+        image = bin_image(image, factor)
+    return to_float(image)
+
+def visualize_image(fig, ax, image, percentage):
+    # Spectrum and frequency distances are computed once per image and reused by the slider
+    lowpass = IncrementalLowPassFilter(image)
+    masked_log_magnitude, image_filtered = lowpass.filter(percentage)
+
+    # The images are created once and updated in place afterwards
+    display = Renderer(fig)
+    io = display.image(ax[0], image)
     ax[0].set_title('Greyscale Image', fontsize = f_size)
-    fo = ax[1].imshow(np.log(abs(fourier_orig)), cmap='gray')
+    fo = display.image(ax[1], lowpass.log_magnitude)
     ax[1].set_title('Original Fourier', fontsize = f_size)
-    fa = ax[2].imshow(np.log(abs(fourier_masked)), cmap='gray')
+    fa = display.image(ax[2], masked_log_magnitude)
     ax[2].set_title('Masked Fourier', fontsize = f_size)
-    ia = ax[3].imshow(abs(image_filtered), cmap='gray')
+    ia = display.image(ax[3], image_filtered)
     ax[3].set_title('Transformed Greyscale Image', fontsize = f_size)
     for i in range(0,4):
         ax[i].set_xticks([])
         ax[i].set_yticks([])
+    return display, lowpass, (io, fo, fa, ia)
 
-def change_image(event):
-    global image, fig, ax, fo, fa, io, ia
-    root = tk.Tk()
-    root.withdraw()  # Hide the main window
-    file_path = filedialog.askopenfilename()
-    if file_path:
-        image = load_image(file_path)
-
-        # Clear the current axes
-        for a in ax:
-            a.clear()
-
-        visualize_image(image, freq_slider.val)
 
-        fig.canvas.draw_idle()
-
-
-# Load the initial image
+# Initial image and parameters
 initial_image_file_name = "fourier_testing_images/wave.jpg"
 initial_image_path = os.path.join(script_directory, initial_image_file_name)
-image = load_image(initial_image_path)
 percentage = 10
 f_size = 15
 
-def mask_circle(image, percentage):
-    """
-    Keep only a circle in the center of the image and make the rest of the image black.
-
-    Parameters:
-    image (numpy array): The input image.
-    percentage (float): The percentage of the radius of the circle compared to the image size.
-
-    Returns:
-    numpy array: The masked image.
-    """
-    # Get the dimensions of the image
-    x, y = image.shape[:2]
-
-    # Calculate the center and radius of the circle
-    center_x, center_y = x // 2, y // 2
-    radius = int(min(center_x, center_y) * (percentage / 100))
-
-    # Create a mask with a circle
-    Y, X = np.ogrid[:x, :y]
-    dist_from_center = np.sqrt((X - center_y)**2 + (Y - center_x)**2)
-    mask = dist_from_center <= radius
-
-    # Create an output image and apply the mask
-    masked_image = np.ones_like(image)
-    masked_image[mask] = image[mask]
-
-    return masked_image
-
-def process_images(image, percentage):
-
-    fourier_orig = np.fft.fftshift(np.fft.fft2(image))
-    fourier_masked = mask_circle(fourier_orig,percentage)
-    image_filtered = np.fft.ifft2(fourier_masked)
-
-    return fourier_orig,fourier_masked,image_filtered
-
-fig, ax = plt.subplots(1,4,figsize=(15,5))
-
-visualize_image(image, percentage)
-
-# adjust the main plot to make room for the sliders
-fig.subplots_adjust(left=0.05)
-
-# Make a horizontal slider to control the frequency.
-axfreq = fig.add_axes([0.02, 0.1, 0.01, 0.8])
-freq_slider = Slider(
-    ax=axfreq,
-    label='Reduction',
-    valmin=0.1,
-    valmax=100,
-    valinit=percentage,
-    orientation="vertical"
-)
-
-# Button to change the image
-axchange = fig.add_axes([0.45, 0.05, 0.1, 0.075])
-change_button = Button(axchange, 'Change Image')
-
-# The function to be called anytime a slider's value changes
-def update(val):
-    
-    fourier_orig,fourier_masked,image_filtered = process_images(image,freq_slider.val)
-    fo.set_data(np.log(abs(fourier_orig)))
-    fa.set_data(np.log(abs(fourier_masked)))
-    ia.set_data(abs(image_filtered))
-    fig.canvas.draw_idle()
-
-
-# register the update function with the slider
-freq_slider.on_changed(update)
-
-# Register the change image function with the button
-change_button.on_clicked(change_image)
-
-plt.show()
+# Target frame rate of the sequence playback, late frames are dropped
+playback_fps = 10
+
+
+def main(image_path=initial_image_path):
+    # Load the initial image
+    image = load_image(image_path)
+
+    fig, ax = plt.subplots(1,4,figsize=(15,5))
+
+    display, lowpass, (io, fo, fa, ia) = visualize_image(fig, ax, image, percentage)
+
+    # adjust the main plot to make room for the sliders
+    fig.subplots_adjust(left=0.05)
+
+    # Make a horizontal slider to control the frequency.
+    axfreq = fig.add_axes([0.02, 0.1, 0.01, 0.8])
+    freq_slider = Slider(
+        ax=axfreq,
+        label='Reduction',
+        valmin=0.1,
+        valmax=100,
+        valinit=percentage,
+        orientation="vertical"
+    )
+
+    # Button to change the image
+    axchange = fig.add_axes([0.45, 0.05, 0.1, 0.075])
+    change_button = Button(axchange, 'Change Image')
+
+    # Button to play a time-lapse, stack or folder of images through the filter
+    axplay = fig.add_axes([0.57, 0.05, 0.1, 0.075])
+    play_button = Button(axplay, 'Play sequence')
+    frame_text = ax[0].text(0.02, 0.98, '', transform=ax[0].transAxes, va='top', color='yellow', fontsize=9)
+    display.add_artist(frame_text)
+    sequence = player = None
+    playback_timer = fig.canvas.new_timer(interval=int(1000 / playback_fps))
+
+    def ask_file():
+        # tkinter is only needed for the file dialog
+        import tkinter as tk
+        from tkinter import filedialog
+
+        root = tk.Tk()
+        root.withdraw()  # Hide the main window
+        return filedialog.askopenfilename()
+
+    def change_image(event):
+        nonlocal lowpass
+        stop_sequence()
+        file_path = ask_file()
+        if file_path:
+            with timer('load'):
+                image = load_image(file_path)
+            with timer('spectrum'):
+                lowpass = IncrementalLowPassFilter(image)
+
+            with timer('lowpass'):
+                masked_log_magnitude, image_filtered = lowpass.filter(freq_slider.val)
+            io.update(image)
+            fo.update(lowpass.log_magnitude)
+            fa.update(masked_log_magnitude)
+            ia.update(image_filtered)
+            display.refresh(io, fo, fa, ia)
+
+    def play_sequence(event):
+        nonlocal sequence, player
+        if player is not None:
+            stop_sequence()
+            return
+        file_path = ask_file()
+        if not file_path:
+            return
+        # Every plane of a stack, or all images of the folder of a single image
+        sequence = FrameSequence(file_path)
+        if len(sequence) == 1:
+            sequence = FrameSequence(os.path.dirname(file_path))
+        player = Player(FilteredStream(sequence, freq_slider.val), playback_fps)
+        play_button.label.set_text('Stop')
+        playback_timer.start()
+
+    def show_frame():
+        nonlocal player
+        frame = player.next_frame()
+        if player.finished:
+            # Loop the sequence
+            dropped = player.dropped
+            player.close()
+            player = Player(FilteredStream(sequence, freq_slider.val), playback_fps)
+            player.dropped = dropped
+        if frame is None:
+            return
+        io.update(frame.image)
+        ia.update(frame.filtered)
+        frame_text.set_text(f'frame {frame.index + 1}/{len(sequence)}, {player.dropped} dropped')
+        display.refresh(io, ia, frame_text)
+
+    def stop_sequence():
+        nonlocal player
+        if player is None:
+            return
+        playback_timer.stop()
+        player.close()
+        player = None
+        play_button.label.set_text('Play sequence')
+        # Back to the still image
+        masked_log_magnitude, image_filtered = lowpass.filter(freq_slider.val)
+        io.update(lowpass.image)
+        fa.update(masked_log_magnitude)
+        ia.update(image_filtered)
+        frame_text.set_text('')
+        display.refresh(io, fa, ia, frame_text)
+
+    playback_timer.add_callback(show_frame)
+
+    # The function to be called anytime a slider's value changes
+    def update(val):
+        if player is not None:
+            # Applies to the frames not filtered yet
+            player.stream.percentage = freq_slider.val
+            return
+
+        # Only the annulus between the old and new cut-off is transformed for small slider steps
+        with timer('lowpass'):
+            masked_log_magnitude, image_filtered = lowpass.filter(freq_slider.val)
+        # Colour limits stay those of the full spectrum and image
+        fa.update(masked_log_magnitude, autoscale=False)
+        ia.update(image_filtered, autoscale=False)
+        display.refresh(fa, ia)
+
+
+    # register the update function with the slider
+    freq_slider.on_changed(update)
+
+    # Register the change image function with the button
+    change_button.on_clicked(change_image)
+    play_button.on_clicked(play_sequence)
+
+    plt.show()
+    return fig, freq_slider, change_button, play_button
+
+
+if __name__ == '__main__':
+    main()
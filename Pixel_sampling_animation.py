@@ -1,126 +1,149 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button
-from matplotlib.widgets import Slider
+from matplotlib.widgets import Slider, RadioButtons
 import matplotlib.gridspec as gridspec
+from microscopy_tools.profiling import timer
+from microscopy_tools.rasterise import PointRenderer
+from microscopy_tools.rendering import Renderer
+from microscopy_tools.sampling import BINNING_MODES, SamplingPyramid, binned_extent
 
 imsize = 500
 
 class InteractiveImageProcessor:
-    def __init__(self, ax_drawing, ax_original, ax_pixelated, slider_size, slider_pix, point_size=5, image_size=(imsize, imsize), gaussian_extent_multiplier=5):
+    def __init__(self, ax_drawing, ax_original, ax_pixelated, slider_size, slider_pix, btn_binning, slider_offset=None, point_size=5, image_size=(imsize, imsize), gaussian_extent_multiplier=5, precision=None):
         self.ax = ax_drawing
         self.image_size = image_size
         self.point_size = point_size
-        self.image = np.zeros(image_size)  # Create an empty image
+        self.gaussian_extent_multiplier = gaussian_extent_multiplier
+        self.renderer = PointRenderer(image_size, kernel='gaussian', radius=slider_size.val,
+                                      extent_multiplier=gaussian_extent_multiplier, precision=precision)
+        self.precision = precision
+        self.pyramid = None  # Binned images of every pixel size, rebuilt when the points change
+        self.image = self.renderer.image  # Updated in place by the renderer, image[y, x] with y upwards
         self.points = []
         self.cid = ax_drawing.figure.canvas.mpl_connect('button_press_event', self)
         self.scatter = ax_drawing.scatter([], [], s=100)  # Visual representation of points
         self.plot_created = False
         self.plot_figure = []
-        self.gaussian_extent_multiplier = gaussian_extent_multiplier
+
+        # Images are created once and updated in place
+        self.display = Renderer(ax_drawing.figure)
+        self.display.add_artist(self.scatter)
+        self.img_original = self.display.image(ax_original, self.image, origin='lower')
+        self.img_pixelated = self.display.image(ax_pixelated, self.image, origin='lower', interpolation='nearest')
+        ax_pixelated.set_autoscale_on(False)  # Keep the limits when the extent of the binned image changes
+        self.nyquist_text = ax_pixelated.text(0.03, 0.95, '', transform=ax_pixelated.transAxes, va='top',
+                                              fontsize=8, color='white')
+        self.display.add_artist(self.nyquist_text)
 
         # Slider for adjusting point radius
         self.radius_slider = slider_size
         self.radius_slider.on_changed(self.update_image_based_on_radius)
         self.pixel_slider = slider_pix
         self.pixel_slider.on_changed(self.update_plot)
+        self.binning_button = btn_binning
+        self.binning_button.on_clicked(self.update_plot)
+        self.offset_slider = slider_offset
+        if slider_offset is not None:
+            self.offset_slider.on_changed(self.update_plot)
 
     def __call__(self, event):
         if event.inaxes != self.ax:
             return
         x, y = int(event.xdata), int(event.ydata)
         self.points.append((x, y))
-        self.update_image_based_on_radius(self.radius_slider.val)
-
-    def gaussian(self, x, y, x0, y0, sigma):
-        return np.exp(-((x - x0)**2 + (y - y0)**2) / (2 * sigma**2))
+        if self.renderer.radius != self.radius_slider.val:
+            self.update_image_based_on_radius(self.radius_slider.val)
+        else:
+            # Only the new point is drawn into the existing image
+            with timer('render'):
+                self.renderer.stamp(x, y)
+            self.pyramid = None
+            self.update_plot([])
 
     def update_image_based_on_radius(self, val):
-        # Clear image
-        self.image.fill(0)
-        # Update image with new radius for each point
-        for x, y in self.points:
-            size = 2 * val * self.gaussian_extent_multiplier + 1
-            x_grid, y_grid = np.meshgrid(np.arange(size), np.arange(size))
-            gaussian = self.gaussian(x_grid, y_grid, val * self.gaussian_extent_multiplier, val * self.gaussian_extent_multiplier, val*2)
-            x_start = max(0, x - val * self.gaussian_extent_multiplier)
-            y_start = max(0, y - val * self.gaussian_extent_multiplier)
-            x_end = min(self.image_size[1], x + val * self.gaussian_extent_multiplier + 1)
-            y_end = min(self.image_size[0], y + val * self.gaussian_extent_multiplier + 1)
-
-            patch_x_start = val * self.gaussian_extent_multiplier - x if x < val * self.gaussian_extent_multiplier else 0
-            patch_y_start = val * self.gaussian_extent_multiplier - y if y < val * self.gaussian_extent_multiplier else 0
-            patch_x_end = size if x + val * self.gaussian_extent_multiplier + 1 <= self.image_size[1] else size - (x + val * self.gaussian_extent_multiplier + 1 - self.image_size[1])
-            patch_y_end = size if y + val * self.gaussian_extent_multiplier + 1 <= self.image_size[0] else size - (y + val * self.gaussian_extent_multiplier + 1 - self.image_size[0])
-
-            self.image[y_start:y_end, x_start:x_end] += gaussian[patch_y_start:patch_y_end, patch_x_start:patch_x_end]
-        
-        self.image = np.flipud(self.image)
+        # Redraw all points with the new radius
+        with timer('render'):
+            self.renderer.rebuild(self.points, val)
+        self.pyramid = None
         self.update_plot([])
 
-    def pixelate_image(self, image, pixel_size):
-        if pixel_size <= 1:
-            return self.image
-        height, width = self.image.shape
-        pixelated = np.zeros_like(self.image)
-        for i in range(0, height, pixel_size):
-            for j in range(0, width, pixel_size):
-                pixel_value = np.mean(image[i:i + pixel_size, j:j + pixel_size])
-                pixelated[i:i + pixel_size, j:j + pixel_size] = pixel_value
-        return pixelated
+    def grid_offset(self, pixel_size):
+        # Phase of the sampling grid as a fraction of the pixel size, in whole pixels of the image
+        if self.offset_slider is None:
+            return 0
+        return int(self.offset_slider.val * pixel_size)
+
+    def pixelate_image(self, pixel_size, offset=0):
+        # All pixel sizes come from one summed-area table, levels already shown are only looked up
+        if self.pyramid is None:
+            with timer('pyramid'):
+                self.pyramid = SamplingPyramid(self.image, max_pixel_size=int(self.pixel_slider.valmax),
+                                               precision=self.precision)
+        return self.pyramid.level(pixel_size, offset, mode=self.binning_button.value_selected)
 
     def update_plot(self,event):
         self.scatter.set_offsets(self.points)
         self.scatter.set_sizes([np.pi * (self.radius_slider.val**2)/10] * len(self.points))
-        self.ax.figure.canvas.draw_idle()
-
-        ax_original.imshow(self.image, cmap='gray')
-        pixelated_image = self.pixelate_image(self.image, int(slider_pix.val))
-        ax_pixelated.imshow(pixelated_image, cmap='gray')
-
-        fig.canvas.draw_idle()
 
+        self.img_original.update(self.image)
+        pixel_size = int(self.pixel_slider.val)
+        offset = self.grid_offset(pixel_size)
+        with timer('bin'):
+            pixelated_image = self.pixelate_image(pixel_size, offset)
+        # Each binned pixel is stretched over pixel_size original pixels by the extent, no upsampled copy
+        self.img_pixelated.update(pixelated_image, extent=binned_extent(pixelated_image.shape, pixel_size, offset))
+        # Spectral energy the pixel size cannot represent
+        self.nyquist_text.set_text(f'{self.pyramid.energy_lost(pixel_size):.1%} above Nyquist')
+
+        self.display.refresh(self.scatter, self.img_original, self.img_pixelated, self.nyquist_text)
+
+
+def main():
+    # Setup the figure and axes
+    fig = plt.figure()
+    gs = gridspec.GridSpec(5, 3, height_ratios=[1, 1, 0.05, 0.05, 0.05], width_ratios=[1, 1, 0.3])  # Define the grid layout
+    ax_drawing = fig.add_subplot(gs[0, :2])
+    ax_original = fig.add_subplot(gs[1, 0])
+    ax_pixelated = fig.add_subplot(gs[1, 1])
+    ax_binning = fig.add_subplot(gs[1, 2])
+    ax_slider_size = fig.add_subplot(gs[2, :2])
+    ax_slider_pix = fig.add_subplot(gs[3, :2])
+    ax_slider_offset = fig.add_subplot(gs[4, :2])
+
+    #plt.subplots_adjust(left=0.25, bottom=0.25)
+    ax_drawing.set_xlim(0, imsize-1)
+    ax_drawing.set_ylim(0, imsize-1)
+    ax_drawing.set_xticks([])
+    ax_drawing.set_yticks([])
+    ax_drawing.set_aspect('equal')
+    ax_drawing.set_title('Add fluorophores by clicking')
+
+    ax_original.set_title('Original image')
+    ax_original.set_xticks([])
+    ax_original.set_yticks([])
+
+    ax_pixelated.set_title('Pixelated image')
+    ax_pixelated.set_xticks([])
+    ax_pixelated.set_yticks([])
+
+    ax_binning.set_title('Binning')
+    ax_binning.axis('off')
+
+    # Slider for adjusting pixel size
+    slider_size = Slider(ax_slider_size, 'Point size', 1, imsize/5, valinit=10, valstep=1)
+    slider_pix = Slider(ax_slider_pix, 'Pixel size', 1, imsize/2, valinit=1, valstep=1)
+    # Shift of the sampling grid in fractions of a pixel
+    slider_offset = Slider(ax_slider_offset, 'Grid offset', 0, 0.95, valinit=0, valstep=0.05)
+    btn_binning = RadioButtons(ax_binning, BINNING_MODES)
+    processor = InteractiveImageProcessor(ax_drawing, ax_original, ax_pixelated, slider_size, slider_pix, btn_binning,
+                                          slider_offset)
+
+    plt.tight_layout()
     plt.show()
+    return processor
+
 
-# Function to find divisors
-def find_divisors(n):
-    divisors = []
-    for i in range(1, int(n ** 0.5) + 1):
-        if n % i == 0:
-            divisors.append(i)
-            if i != n // i:
-                divisors.append(n // i)
-    return sorted(divisors)
-        
-# Setup the figure and axes
-fig = plt.figure()
-gs = gridspec.GridSpec(4, 2, height_ratios=[1, 1, 0.05, 0.05])  # Define the grid layout
-ax_drawing = fig.add_subplot(gs[0, :])
-ax_original = fig.add_subplot(gs[1, 0])
-ax_pixelated = fig.add_subplot(gs[1, 1])
-ax_slider_size = fig.add_subplot(gs[2, :])
-ax_slider_pix = fig.add_subplot(gs[3, :])
-
-#plt.subplots_adjust(left=0.25, bottom=0.25)
-ax_drawing.set_xlim(0, imsize-1)
-ax_drawing.set_ylim(0, imsize-1)
-ax_drawing.set_xticks([])
-ax_drawing.set_yticks([])
-ax_drawing.set_aspect('equal')
-ax_drawing.set_title('Add fluorophores by clicking')
-
-ax_original.set_title('Original image')
-ax_original.set_xticks([])
-ax_original.set_yticks([])
-
-ax_pixelated.set_title('Pixelated image')
-ax_pixelated.set_xticks([])
-ax_pixelated.set_yticks([])
-
-# Slider for adjusting pixel size
-slider_size = Slider(ax_slider_size, 'Point size', 1, imsize/5, valinit=10, valstep=1)
-slider_pix = Slider(ax_slider_pix, 'Pixel size', 1, imsize/2, valinit=1, valstep=find_divisors(imsize))
-processor = InteractiveImageProcessor(ax_drawing, ax_original, ax_pixelated, slider_size, slider_pix)
-
-plt.tight_layout()
-plt.show()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Compare the direct and FFT convolution backends across image sizes.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_convolution --sizes 100 256 512 1024 2048
+"""
+import argparse
+import time
+
+import numpy as np
+
+from microscopy_tools.convolution import DirectConvolver, FFTConvolver, _gaussian_otf
+
+
+def time_call(func, repeats):
+    """Best wall-clock time of ``repeats`` calls, in seconds."""
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 256, 512, 1024, 2048])
+    parser.add_argument('--spread', type=float, default=20)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--max-direct-size', type=int, default=512,
+                        help='skip the direct backend above this size (it takes minutes at 1024^2)')
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    direct = DirectConvolver()
+    fft_backend = FFTConvolver()
+
+    print(f"{'size':>6} {'direct [ms]':>12} {'fft cold [ms]':>14} {'fft cached [ms]':>16} {'speed-up':>9} {'max |diff|':>11}")
+    for size in args.sizes:
+        image = (rng.random((size, size)) > 0.99).astype(float)
+
+        # Cold call includes the PSF transform, later calls hit the cache
+        _gaussian_otf.cache_clear()
+        start = time.perf_counter()
+        fft_backend.convolve(image, args.spread)
+        fft_cold = time.perf_counter() - start
+        fft_cached = time_call(lambda: fft_backend.convolve(image, args.spread), args.repeats)
+
+        if size <= args.max_direct_size:
+            direct_time = time_call(lambda: direct.convolve(image, args.spread), 1)
+            difference = np.abs(direct.convolve(image, args.spread) - fft_backend.convolve(image, args.spread)).max()
+            print(f"{size:>6} {direct_time * 1e3:>12.1f} {fft_cold * 1e3:>14.1f} {fft_cached * 1e3:>16.1f} "
+                  f"{direct_time / fft_cached:>8.0f}x {difference:>11.1e}")
+        else:
+            print(f"{size:>6} {'skipped':>12} {fft_cold * 1e3:>14.1f} {fft_cached * 1e3:>16.1f} {'-':>9} {'-':>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Incremental (annulus) versus full inverse-FFT low-pass reconstruction.
+
+For every image size the cut-off is moved by growing steps from a radius in
+the middle of the spectrum. The table shows the time of the partial inverse
+DFT of the annulus and of the full masked irfft2, and the crossover, i.e. the
+largest number of spectrum rows for which the incremental update still wins.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_lowpass --sizes 512 1024 2048
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy import fft
+
+from microscopy_tools.fourier import IncrementalLowPassFilter
+
+
+def best_time(func, repeats):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048])
+    parser.add_argument('--radii', type=int, nargs='+', default=[2, 8, 32, 128],
+                        help='cut-off radii (in frequency samples) the steps start from')
+    parser.add_argument('--steps', type=int, nargs='+', default=[1, 2, 4, 16])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        lowpass = IncrementalLowPassFilter(rng.random((size, size)))
+        radius2 = (args.radii[-1] + args.steps[-1])**2
+        full = best_time(lambda: fft.irfft2(lowpass.spectrum * (lowpass._distance2 <= radius2),
+                                            s=lowpass.shape, workers=-1), args.repeats)
+        print(f"\n{size}x{size}: full masked irfft2 {full * 1e3:.1f} ms (default max_rows {lowpass.max_rows})")
+        print(f"{'radius':>7} {'step':>5} {'rows':>6} {'coefficients':>13} {'annulus [ms]':>13} {'speed-up':>9}")
+        crossover = 0
+        for radius in args.radii:
+            for step in args.steps:
+                indices = lowpass.annulus(radius**2, (radius + step)**2)
+                rows = len(np.unique(indices // lowpass.spectrum.shape[1]))
+                partial = best_time(lambda: lowpass.partial_inverse(indices), args.repeats)
+                if partial < full:
+                    crossover = max(crossover, rows)
+                print(f"{radius:>7} {step:>5} {rows:>6} {len(indices):>13} {partial * 1e3:>13.2f} {full / partial:>8.1f}x")
+        print(f"crossover: incremental update faster up to ~{crossover} spectrum rows")
+
+
+if __name__ == '__main__':
+    main()
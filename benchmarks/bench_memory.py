@@ -0,0 +1,105 @@
+"""Memory traffic of the steady-state updates of each demo, float64 versus float32.
+
+Every demo update is run once to warm up the caches and workspaces, then
+repeated under tracemalloc (which sees NumPy's array allocations). The table
+shows the time per update, the peak of temporary memory above the baseline
+during one update, and the memory still held by the workspaces.
+
+- deconvolution - one Wiener run of the pipeline plus the normalisation of the four displayed images.
+- sampling - binning for a sweep of pixel sizes (the pixel size slider).
+- fourier - low-pass filtering for a sweep of cut-offs (the cut-off slider).
+
+Run from the repository root:
+
+    python -m benchmarks.bench_memory --sizes 512 2048
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from microscopy_tools.convolution import make_convolver
+from microscopy_tools.deconvolution import run_pipeline
+from microscopy_tools.fourier import IncrementalLowPassFilter
+from microscopy_tools.sampling import bin_image
+from microscopy_tools.workspace import PRECISIONS, Workspace, normalize
+
+
+def deconvolution_demo(image, precision):
+    convolver = make_convolver(precision=precision)
+    workspace = Workspace(precision)
+    rng = np.random.default_rng(0)
+    obj = image.astype(convolver.dtype)
+
+    def update():
+        acquisition, deconvolved = run_pipeline(obj, 20, 0.005, 0.1, 'Wiener', convolver=convolver, rng=rng)
+        low, high = np.min(acquisition.noisy_blurred), np.max(acquisition.noisy_blurred)
+        normalize(acquisition.psf, out=workspace.buffer('psf', acquisition.psf.shape))
+        normalize(acquisition.noise, out=workspace.buffer('noise', image.shape), low=low, high=high)
+        normalize(acquisition.noisy_blurred, out=workspace.buffer('noisy_blurred', image.shape), low=low, high=high)
+        normalize(deconvolved, out=workspace.buffer('deconvolved', image.shape))
+    return [update], workspace
+
+
+def sampling_demo(image, precision):
+    workspace = Workspace(precision)
+    image = image.astype(workspace.dtype)
+    updates = [lambda pixel_size=pixel_size: bin_image(image, pixel_size, workspace=workspace)
+               for pixel_size in (2, 3, 5, 8, 13, 21)]
+    return updates, workspace
+
+
+def fourier_demo(image, precision):
+    lowpass = IncrementalLowPassFilter(image, precision=precision)
+    updates = [lambda percentage=percentage: lowpass.filter(percentage)
+               for percentage in (10, 11, 12, 14, 40, 39, 38, 80)]
+    return updates, lowpass.workspace
+
+
+DEMOS = {
+    'deconvolution': deconvolution_demo,
+    'sampling': sampling_demo,
+    'fourier': fourier_demo,
+}
+
+
+def measure(updates, repeats):
+    """Mean time and largest temporary memory (bytes above the level before the update) per update."""
+    for update in updates:
+        update()  # Warm-up: caches, plans and workspace buffers
+    elapsed, peak = 0.0, 0
+    tracemalloc.start()
+    for _ in range(repeats):
+        for update in updates:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            start = time.perf_counter()
+            update()
+            elapsed += time.perf_counter() - start
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    return elapsed / (repeats * len(updates)), peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 2048])
+    parser.add_argument('--demos', nargs='+', default=list(DEMOS), choices=list(DEMOS))
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    print(f"{'demo':>14} {'size':>6} {'precision':>10} {'time [ms]':>10} {'peak temp [MB]':>15} {'workspace [MB]':>15}")
+    for name in args.demos:
+        for size in args.sizes:
+            image = rng.random((size, size))
+            for precision in PRECISIONS:
+                updates, workspace = DEMOS[name](image, precision)
+                elapsed, peak = measure(updates, args.repeats)
+                print(f"{name:>14} {size:>6} {precision:>10} {elapsed * 1e3:>10.1f} "
+                      f"{peak / 2**20:>15.1f} {workspace.nbytes / 2**20:>15.1f}")
+
+
+if __name__ == '__main__':
+    main()
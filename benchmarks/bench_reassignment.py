@@ -0,0 +1,50 @@
+"""Throughput of the pixel-reassignment simulation in scans per second.
+
+A scan is one complete reconstruction: all detector images of the object are
+simulated (with noise) and reassigned. The table shows scans per second and
+detector images per second for each image size, detector array and number of
+worker threads, to size detector arrays for interactive use.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_reassignment --sizes 256 512 --detectors 1 3 5 7 --workers 1 4
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from microscopy_tools.reassignment import PixelReassignment
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 512])
+    parser.add_argument('--detectors', type=int, nargs='+', default=[1, 3, 5, 7],
+                        help='detector elements along each side of the array')
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument('--sigma', type=float, default=4.0, help='sigma of the excitation and detection PSFs in pixels')
+    parser.add_argument('--duration', type=float, default=1.0, help='seconds spent on each configuration')
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>6} {'array':>6} {'workers':>8} {'scans/s':>9} {'detector images/s':>18}")
+    for size in args.sizes:
+        obj = (rng.random((size, size)) > 0.999).astype(np.float32)
+        for n_detectors in args.detectors:
+            for workers in args.workers:
+                engine = PixelReassignment(args.sigma, n_detectors=n_detectors, pitch=args.sigma / 2, workers=workers)
+                engine.reconstruct(obj, noise=0.01, rng=rng)  # Warm-up
+                scans = 0
+                start = time.perf_counter()
+                while time.perf_counter() - start < args.duration:
+                    engine.reconstruct(obj, noise=0.01, rng=rng)
+                    scans += 1
+                rate = scans / (time.perf_counter() - start)
+                print(f"{size:>6} {f'{n_detectors}x{n_detectors}':>6} {workers:>8} {rate:>9.1f} "
+                      f"{rate * engine.n_elements:>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
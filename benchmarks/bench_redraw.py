@@ -0,0 +1,95 @@
+"""Redraw cost per update: re-calling imshow versus in-place updates with blitting.
+
+The legacy path calls ``ax.imshow`` on every update, as the scripts used to, so
+the number of stacked images and the draw time grow with every interaction.
+The new path updates ``ImagePanel`` artists in place and blits their axes.
+The per-update time is reported at checkpoints along a long session.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_redraw --updates 3000
+"""
+import argparse
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from microscopy_tools.rendering import Renderer
+
+
+def make_figure(n_panels):
+    fig, axes = plt.subplots(1, n_panels, figsize=(3 * n_panels, 3))
+    fig.canvas.draw()
+    return fig, axes
+
+
+def bench_legacy(frames, n_panels, checkpoints, samples):
+    """Time a full redraw at the checkpoints while stacking a new image on every update."""
+    fig, axes = make_figure(n_panels)
+    results = {}
+    for i in range(max(checkpoints) + samples):
+        for ax in axes:
+            ax.imshow(frames[i % len(frames)], cmap='gray')
+        if any(c <= i < c + samples for c in checkpoints):
+            start = time.perf_counter()
+            fig.canvas.draw()
+            results.setdefault(max(c for c in checkpoints if c <= i), []).append(time.perf_counter() - start)
+    n_images = sum(len(ax.images) for ax in axes)
+    plt.close(fig)
+    return {c: np.median(t) for c, t in results.items()}, n_images
+
+
+def bench_blit(frames, n_panels, checkpoints, samples):
+    """Time every in-place update, including the blit of the changed axes."""
+    fig, axes = make_figure(n_panels)
+    display = Renderer(fig)
+    panels = [display.image(ax, frames[0]) for ax in axes]
+    fig.canvas.draw()
+    results = {}
+    for i in range(max(checkpoints) + samples):
+        start = time.perf_counter()
+        for panel in panels:
+            panel.update(frames[i % len(frames)])
+        display.refresh(*panels)
+        elapsed = time.perf_counter() - start
+        for c in checkpoints:
+            if c <= i < c + samples:
+                results.setdefault(c, []).append(elapsed)
+    n_images = sum(len(ax.images) for ax in axes)
+    plt.close(fig)
+    return {c: np.median(t) for c, t in results.items()}, n_images
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=3000, help='length of the simulated session')
+    parser.add_argument('--size', type=int, default=100, help='image size')
+    parser.add_argument('--panels', type=int, default=4, help='number of image axes')
+    parser.add_argument('--samples', type=int, default=20, help='updates timed at every checkpoint')
+    parser.add_argument('--legacy-samples', type=int, default=3,
+                        help='full draws timed at every checkpoint of the legacy path (they take seconds late in the session)')
+    parser.add_argument('--legacy-updates', type=int, default=500,
+                        help='stop the legacy path after this many updates, its draw time grows linearly')
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    frames = rng.random((8, args.size, args.size))
+    checkpoints = sorted({0, args.updates // 10, args.updates // 2, args.updates})
+
+    legacy_checkpoints = [c for c in checkpoints if c <= args.legacy_updates]
+    legacy, legacy_images = bench_legacy(frames, args.panels, legacy_checkpoints, args.legacy_samples)
+    blit, blit_images = bench_blit(frames, args.panels, checkpoints, args.samples)
+
+    print(f"{'update':>8} {'imshow + draw [ms]':>19} {'set_data + blit [ms]':>21}")
+    for c in checkpoints:
+        legacy_time = f"{legacy[c] * 1e3:.2f}" if c in legacy else 'skipped'
+        print(f"{c:>8} {legacy_time:>19} {blit[c] * 1e3:>21.2f}")
+    print(f"AxesImages at the end: imshow {legacy_images} (after {max(legacy_checkpoints)} updates), "
+          f"set_data {blit_images} (after {max(checkpoints)} updates)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Richardson-Lucy: skimage versus the FFT engine, plain versus Biggs-Andrews accelerated.
+
+For each image size a random disk object is blurred and noised as in the
+deconvolution demo. The reference is ``--iterations`` plain iterations. The
+table shows the time of skimage and of the FFT engine for the reference, and
+how many accelerated iterations (and how long) it takes to fit the data as
+well as the reference, i.e. to reach its misfit ||psf * estimate - image||.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_richardson_lucy --sizes 100 256 512
+"""
+import argparse
+import time
+
+import numpy as np
+from skimage.restoration import richardson_lucy as skimage_richardson_lucy
+
+from microscopy_tools.deconvolution import acquire
+from microscopy_tools.rasterise import PointRenderer
+from microscopy_tools.richardson_lucy import iterate_richardson_lucy
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 256, 512])
+    parser.add_argument('--spread', type=float, default=20)
+    parser.add_argument('--noise', type=float, default=0.005)
+    parser.add_argument('--iterations', type=int, default=50, help='plain iterations of the reference')
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>6} {'skimage [s]':>12} {'fft [s]':>9} {'accelerated':>12} {'accel. [s]':>11} {'misfit':>9}")
+    for size in args.sizes:
+        renderer = PointRenderer((size, size), kernel='disk')
+        renderer.rebuild(rng.integers(0, size, (size // 4, 2)), max(2, size // 40))
+        acquisition = acquire(renderer.image, args.spread, args.noise, rng=rng)
+        image, psf = acquisition.noisy_blurred, acquisition.psf
+
+        _, skimage_time = timed(skimage_richardson_lucy, image, psf, num_iter=args.iterations, clip=False)
+        start = time.perf_counter()
+        for reference in iterate_richardson_lucy(image, psf, num_iter=args.iterations, accelerate=False, clip=False):
+            pass
+        fft_time = time.perf_counter() - start
+
+        # The misfit of a state belongs to the estimate the step started from
+        start = time.perf_counter()
+        for state in iterate_richardson_lucy(image, psf, num_iter=args.iterations + 1, accelerate=True,
+                                             report_every=1, clip=False):
+            if state.misfit <= reference.misfit:
+                break
+        accelerated_time = time.perf_counter() - start
+        print(f"{size:>6} {skimage_time:>12.3f} {fft_time:>9.3f} {state.iteration - 1:>12} "
+              f"{accelerated_time:>11.3f} {state.misfit / reference.misfit:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Import time of every demo, measured with ``python -X importtime``, against a stored baseline.
+
+Each demo module is imported in a fresh interpreter (Agg backend, so no
+window opens) after the launcher, as by ``python -m microscopy_tools <demo>``, and the total import time is taken as the best of
+``--repeats`` runs. The table shows it with the slowest packages the demo
+pulls in, each charged with the own (self) import time of all its modules.
+A demo fails the check when
+
+- it imports one of ``DEFERRED`` at startup - these are loaded by the code
+  paths that need them (a deconvolution method, the file dialog, ...), or
+- its import time exceeds the baseline by more than ``--tolerance``.
+
+The exit status is 1 if any demo fails. Baselines are only comparable on the
+same machine; store one with ``--save-baseline``. ``--imports-only`` skips the
+timing and only checks the deferred imports, which needs no baseline and
+gives the same result on any machine, e.g. in CI. Run from the repository root:
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --imports-only
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict, namedtuple
+
+from microscopy_tools.__main__ import DEMOS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'startup_baseline.json')
+
+ImportTime = namedtuple('ImportTime', ['own', 'cumulative'])
+ImportTime.__doc__ = """Import time of a module in seconds, without and with the modules it imports."""
+
+# Modules no demo may import before its window appears
+DEFERRED = ('skimage.restoration', 'scipy.signal', 'scipy.ndimage', 'tkinter')
+
+
+def import_times(module):
+    """
+    Import a module after the demo launcher in a new interpreter with ``-X importtime``.
+
+    Returns:
+    dict: Imported module name -> ImportTime.
+    """
+    env = dict(os.environ, MPLBACKEND='Agg')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import microscopy_tools.__main__, {module}'],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = ImportTime(int(own) * 1e-6, int(cumulative) * 1e-6)
+    return times
+
+
+def packages(times, n, exclude=()):
+    """The n top-level packages with the largest import times, summed over the own times of their modules."""
+    totals = defaultdict(float)
+    for name, import_time in times.items():
+        # Cumulative times would miss submodules imported later (matplotlib.pyplot after
+        # matplotlib) and count nested imports of other packages twice
+        package = name.split('.')[0]
+        if package not in exclude:
+            totals[package] += import_time.own
+    return sorted(totals.items(), key=lambda item: -item[1])[:n]
+
+
+def measure(module, repeats):
+    """Best total import time of the module over the repeats, with its import times of that run."""
+    best = None
+    for _ in range(repeats):
+        times = import_times(module)
+        if best is None or times[module].cumulative < best[module].cumulative:
+            best = times
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--demos', nargs='+', default=list(DEMOS), choices=list(DEMOS))
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='stored import times to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='store the import times as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='relative slowdown flagged')
+    parser.add_argument('--imports-only', action='store_true',
+                        help='only check that no deferred module is imported, without timing against the baseline')
+    args = parser.parse_args(argv)
+    if args.imports_only:
+        args.repeats, args.save_baseline = 1, False
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    results, failures = {}, []
+    print(f"{'demo':>14} {'import [s]':>11}  slowest packages")
+    for demo in args.demos:
+        module = DEMOS[demo][0]
+        times = measure(module, args.repeats)
+        total = times[module].cumulative
+        results[demo] = total
+        slowest = ', '.join(f'{name} {seconds:.2f}' for name, seconds in packages(times, 4, exclude=(module,)))
+        print(f"{demo:>14} {total:>11.3f}  {slowest}")
+
+        for name in DEFERRED:
+            if name in times:
+                failures.append(f'{demo}: imports {name} at startup ({times[name].cumulative:.3f} s)')
+        if not (args.save_baseline or args.imports_only) and demo in baseline and total > baseline[demo] * (1 + args.tolerance):
+            failures.append(f'{demo}: import time x{total / baseline[demo]:.2f} of the baseline')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump({**baseline, **results}, file, indent=1)
+        print(f'Baseline saved to {args.baseline}')
+    for failure in failures:
+        print(f'REGRESSION {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""Throughput of the tiled convolution and deconvolution with a field-dependent PSF.
+
+For each image size, tile grid and number of worker threads the table shows
+the convolution throughput in megapixels per second and the time of one tiled
+Wiener deconvolution. More tiles follow the PSF variation more closely, but
+every tile pays for its halo; more workers process the tiles in parallel.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_varying_psf --sizes 512 1024 --grids 1 2 4 8 --workers 1 4
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from microscopy_tools.deconvolution import acquire, deconvolve
+from microscopy_tools.varying_psf import VaryingPSFConvolver
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024])
+    parser.add_argument('--grids', type=int, nargs='+', default=[1, 2, 4, 8], help='tiles along each side of the image')
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument('--spread', type=float, default=20)
+    parser.add_argument('--aberration', type=float, default=0.5)
+    parser.add_argument('--duration', type=float, default=1.0, help='seconds spent on the convolution of each configuration')
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>6} {'tiles':>6} {'workers':>8} {'convolution [Mpx/s]':>20} {'wiener [s]':>11}")
+    for size in args.sizes:
+        obj = (rng.random((size, size)) > 0.999).astype(np.float32)
+        for n_tiles in args.grids:
+            for workers in args.workers:
+                convolver = VaryingPSFConvolver(aberration=args.aberration, grid_shape=(n_tiles, n_tiles),
+                                                workers=workers)
+                convolver.convolve(obj, args.spread)  # Warm-up, builds the PSFs and transfer functions
+                runs = 0
+                start = time.perf_counter()
+                while time.perf_counter() - start < args.duration:
+                    convolver.convolve(obj, args.spread)
+                    runs += 1
+                rate = runs * obj.size / (time.perf_counter() - start) / 1e6
+
+                acquisition = acquire(obj, args.spread, 0.005, convolver=convolver, rng=rng)
+                start = time.perf_counter()
+                deconvolve(obj, acquisition, 'Wiener', 0.1)
+                wiener_time = time.perf_counter() - start
+                print(f"{size:>6} {f'{n_tiles}x{n_tiles}':>6} {workers:>8} {rate:>20.1f} {wiener_time:>11.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""Benchmark suite of every compute kernel of the demos, with a stored baseline to catch regressions.
+
+Every kernel is set up for a square image of each size, run once to warm up
+its caches and workspaces, then timed over ``--repeats`` runs (the median is
+reported, and the runs stop early after ``--max-time`` seconds). The peak of
+temporary memory above the level before a run is measured with tracemalloc
+in one extra run. Kernels too slow for the large sizes have a maximum size.
+
+The results are written as JSON with ``--output``. ``--save-baseline`` stores
+them as the baseline, later runs are compared with it and every kernel slower
+or using more memory than the baseline by more than ``--tolerance`` is
+flagged; the exit status is 1 if any is. Baselines are only comparable on the
+same machine, which is why none is kept in the repository.
+
+The suite runs headlessly: matplotlib is switched to the Agg backend before
+anything else is imported. Run from the repository root:
+
+    python -m benchmarks.suite --save-baseline
+    python -m benchmarks.suite --sizes 100 256 512 --kernels convolve_fft bin_mean
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import scipy
+
+from microscopy_tools.convolution import PSF_SHAPE, _gaussian_psf, make_convolver
+from microscopy_tools.deconvolution import acquire, deconvolve
+from microscopy_tools.fourier import IncrementalLowPassFilter, LowPassFilter
+from microscopy_tools.misalignment import excitation_intensity, linked_scan
+from microscopy_tools.noise import camera_noise
+from microscopy_tools.rasterise import PointRenderer
+from microscopy_tools.reassignment import PixelReassignment
+from microscopy_tools.sampling import SamplingPyramid, bin_image
+from microscopy_tools.streaming import BATCH_SIZE, lowpass_batch
+from microscopy_tools.varying_psf import VaryingPSFConvolver
+from microscopy_tools.workspace import Workspace, real_dtype
+
+SIZES = [100, 256, 512, 1024, 2048, 4096]
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Parameters of the demos
+SPREAD = 20
+NOISE = 0.005
+BALANCE = 0.1
+PHOTONS = 1000
+PIXEL_SIZE = 8
+
+# Peak memory below this is not flagged, tracemalloc sees small Python allocations too
+MEMORY_SLACK = 2**20
+
+Kernel = namedtuple('Kernel', ['setup', 'max_size'])
+Kernel.__doc__ = """A benchmarked kernel: ``setup(size, rng)`` prepares the inputs of a size x size
+image and returns the function to time, ``max_size`` is the largest size it is run at (None: all)."""
+
+
+def make_object(size, rng):
+    """Random disks as drawn in the deconvolution demo."""
+    renderer = PointRenderer((size, size), kernel='disk')
+    renderer.rebuild(rng.integers(0, size, (max(1, size // 4), 2)), max(2, size // 40))
+    return renderer.image
+
+
+def psf(size, rng):
+    # Uncached builder of the PSF, its size does not depend on the image
+    return lambda: _gaussian_psf(SPREAD, PSF_SHAPE, real_dtype())
+
+
+def convolver_kernel(name):
+    def setup(size, rng):
+        convolver = make_convolver(name)
+        obj = make_object(size, rng)
+        return lambda: convolver.convolve(obj, SPREAD)
+    return setup
+
+
+def noise(size, rng):
+    blurred = make_convolver().convolve(make_object(size, rng), SPREAD)
+    return lambda: camera_noise(blurred, PHOTONS, NOISE, seed=rng)
+
+
+def acquisition(size, rng):
+    obj = make_object(size, rng)
+    convolver = make_convolver()
+    return lambda: acquire(obj, SPREAD, NOISE, convolver=convolver, rng=rng, photons=PHOTONS)
+
+
+def deconvolution_kernel(method):
+    def setup(size, rng):
+        obj = make_object(size, rng)
+        acquired = acquire(obj, SPREAD, NOISE, convolver=make_convolver(), rng=rng)
+        return lambda: deconvolve(obj, acquired, method, BALANCE)
+    return setup
+
+
+def varying_psf(size, rng):
+    convolver = VaryingPSFConvolver()
+    obj = make_object(size, rng)
+    return lambda: convolver.convolve(obj, SPREAD)
+
+
+def reassignment(size, rng):
+    scanner = PixelReassignment(4, n_detectors=3)
+    obj = make_object(size, rng)
+    return lambda: scanner.reconstruct(obj)
+
+
+def lowpass_spectrum(size, rng):
+    # Loading a new image in the Fourier demo
+    image = rng.random((size, size), dtype=np.float32)
+    return lambda: IncrementalLowPassFilter(image)
+
+
+def lowpass_full(size, rng):
+    lowpass = LowPassFilter(rng.random((size, size), dtype=np.float32))
+    percentages = iter(np.tile([10, 40], 10**6))
+    return lambda: lowpass.filter(next(percentages))
+
+
+def lowpass_step(size, rng):
+    # Small moves of the cut-off slider, updated by the annulus
+    lowpass = IncrementalLowPassFilter(rng.random((size, size), dtype=np.float32))
+    percentages = iter(np.tile([10, 11], 10**6))
+    return lambda: lowpass.filter(next(percentages))
+
+
+def lowpass_frames(size, rng):
+    # One batch of a streamed sequence
+    frames = rng.random((BATCH_SIZE, size, size), dtype=np.float32)
+    return lambda: lowpass_batch(frames, 10)
+
+
+def binning_kernel(mode):
+    def setup(size, rng):
+        workspace = Workspace()
+        image = rng.random((size, size), dtype=workspace.dtype)
+        return lambda: bin_image(image, PIXEL_SIZE, mode=mode, workspace=workspace)
+    return setup
+
+
+def sampling_pyramid(size, rng):
+    # Rebuilt whenever a point is added in the pixel sampling demo
+    image = rng.random((size, size), dtype=np.float32)
+    return lambda: SamplingPyramid(image, max_pixel_size=size // 2)
+
+
+def pyramid_level(size, rng):
+    # A pixel size and grid offset not shown before, without the cache of the levels
+    pyramid = SamplingPyramid(rng.random((size, size), dtype=np.float32), max_pixel_size=PIXEL_SIZE)
+    return lambda: pyramid._bin(PIXEL_SIZE, PIXEL_SIZE // 2, 'mean')
+
+
+def gaussian_stamp(size, rng):
+    # Moving the point size slider of the pixel sampling demo
+    renderer = PointRenderer((size, size), kernel='gaussian')
+    points = rng.integers(0, size, (max(1, size // 10), 2))
+    radius = max(1, size // 50)
+    return lambda: renderer.rebuild(points, radius)
+
+
+def misalignment(size, rng):
+    # Intensity model for every pair of size positions, and an uncached linked scan of size samples
+    positions = np.linspace(0, 1, size)
+
+    def run():
+        profile = excitation_intensity(positions, 0.5, 0.05)
+        np.outer(profile, profile)
+        linked_scan.__wrapped__(0.8, 0.05, 0.5, start=0.0, stop=1.0, samples=size)
+    return run
+
+
+KERNELS = {
+    'psf': Kernel(psf, 100),
+    'convolve_fft': Kernel(convolver_kernel('fft'), None),
+    'convolve_direct': Kernel(convolver_kernel('direct'), 256),
+    'noise': Kernel(noise, None),
+    'acquire': Kernel(acquisition, None),
+    'deconvolve_wiener': Kernel(deconvolution_kernel('Wiener'), None),
+    'deconvolve_inverse': Kernel(deconvolution_kernel('Inverse'), None),
+    'deconvolve_iterative': Kernel(deconvolution_kernel('Iterative'), 2048),
+    'deconvolve_unsupervised': Kernel(deconvolution_kernel('Unsupervised Wiener'), 512),
+    'varying_psf': Kernel(varying_psf, 2048),
+    'reassignment': Kernel(reassignment, 1024),
+    'lowpass_spectrum': Kernel(lowpass_spectrum, None),
+    'lowpass_full': Kernel(lowpass_full, None),
+    'lowpass_step': Kernel(lowpass_step, None),
+    'lowpass_batch': Kernel(lowpass_frames, 2048),
+    'bin_mean': Kernel(binning_kernel('mean'), None),
+    'bin_max': Kernel(binning_kernel('max'), None),
+    'sampling_pyramid': Kernel(sampling_pyramid, None),
+    'pyramid_level': Kernel(pyramid_level, None),
+    'gaussian_stamp': Kernel(gaussian_stamp, None),
+    'misalignment': Kernel(misalignment, None),
+}
+
+
+def measure(run, repeats, max_time):
+    """Median time of the runs and the peak temporary memory (bytes above the level before one run)."""
+    run()  # Warm-up: caches, FFT plans and workspace buffers
+    times = []
+    total = time.perf_counter()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+        if time.perf_counter() - total > max_time:
+            break
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    run()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return float(np.median(times)), peak
+
+
+def run_suite(kernels, sizes, repeats, max_time, seed=0):
+    """
+    Measure the kernels at the sizes.
+
+    Returns:
+    dict: 'kernel@size' -> {'time': median seconds, 'peak': bytes}.
+    """
+    results = {}
+    for name in kernels:
+        kernel = KERNELS[name]
+        for size in sizes:
+            if kernel.max_size is not None and size > kernel.max_size:
+                continue
+            rng = np.random.default_rng(seed)
+            elapsed, peak = measure(kernel.setup(size, rng), repeats, max_time)
+            results[f'{name}@{size}'] = {'time': elapsed, 'peak': peak}
+            print(f"{name:>24} {size:>6} {elapsed * 1e3:>11.2f} {peak / 2**20:>10.1f}", flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Results worse than the baseline by more than the tolerance.
+
+    Returns:
+    list: (key, quantity, ratio) of every regression.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        reference = baseline[key]
+        if result['time'] > reference['time'] * (1 + tolerance):
+            regressions.append((key, 'time', result['time'] / reference['time']))
+        if result['peak'] > max(reference['peak'] * (1 + tolerance), MEMORY_SLACK):
+            regressions.append((key, 'peak', result['peak'] / max(reference['peak'], 1)))
+    return regressions
+
+
+def metadata():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+            'precision': np.dtype(real_dtype()).name, 'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--kernels', nargs='+', default=list(KERNELS), choices=list(KERNELS))
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--max-time', type=float, default=2.0, help='seconds of timed runs per kernel and size')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='stored results to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='relative slowdown or memory growth flagged')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    print(f"{'kernel':>24} {'size':>6} {'time [ms]':>11} {'peak [MB]':>10}")
+    results = run_suite(args.kernels, args.sizes, args.repeats, args.max_time)
+    report = {'meta': metadata(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=1)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)['results']
+        # Kernels and sizes not run this time keep their stored results
+        with open(args.baseline, 'w') as file:
+            json.dump({'meta': report['meta'], 'results': {**baseline, **results}}, file, indent=1)
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, store one with --save-baseline')
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline['meta'].get('machine') != report['meta']['machine'] or baseline['meta'].get('cpus') != os.cpu_count():
+        print('Warning: the baseline was recorded on a different machine')
+    regressions = compare(results, baseline['results'], args.tolerance)
+    for key, quantity, ratio in regressions:
+        print(f'REGRESSION {key}: {quantity} x{ratio:.2f} of the baseline')
+    if not regressions:
+        print(f'No regressions against {args.baseline} (tolerance {args.tolerance:.0%})')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
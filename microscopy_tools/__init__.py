@@ -0,0 +1 @@
+"""Shared compute kernels for the microscopy visualization scripts."""
@@ -0,0 +1,47 @@
+"""Launcher of the demos, run from the repository root:
+
+    python -m microscopy_tools deconvolution
+    python -m microscopy_tools fourier --image my_image.tif
+
+Only the chosen demo is imported. The demos themselves import their heavy
+dependencies (skimage.restoration, scipy.signal, tkinter) when a code path
+first needs them, so the window appears as soon as matplotlib is loaded;
+``python -m benchmarks.bench_startup`` measures the import times.
+"""
+import argparse
+import importlib
+
+# Demo name -> (module with a main() function, description)
+DEMOS = {
+    'deconvolution': ('De_convolution_microscope_animation', 'blur, noise and deconvolution of drawn objects'),
+    'fourier': ('Fourier_frequency_reduction_animation', 'low-pass filtering of an image in the Fourier domain'),
+    'sampling': ('Pixel_sampling_animation', 'pixel size and binning of drawn fluorophores'),
+    'misalignment': ('Misaligned_excitation_detection_animation',
+                     'detected intensity with misaligned excitation and detection'),
+}
+
+
+def load(demo):
+    """The module of a demo, imported on demand."""
+    return importlib.import_module(DEMOS[demo][0])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m microscopy_tools', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog='demos:\n' + '\n'.join(f'  {name:<14} {description}'
+                                                                   for name, (_, description) in DEMOS.items()))
+    parser.add_argument('demo', choices=list(DEMOS), metavar='demo', help='one of: ' + ', '.join(DEMOS))
+    parser.add_argument('--image', help='image shown first by the fourier demo')
+    args = parser.parse_args(argv)
+
+    if args.image and args.demo != 'fourier':
+        parser.error('--image is only used by the fourier demo')
+    module = load(args.demo)
+    if args.image:
+        return module.main(args.image)
+    return module.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""Cache of computed results with a memory budget and a disk spill.
+
+Flicking between deconvolution methods or returning a slider to an earlier
+value asks for results that were already computed. ``ResultCache`` keeps them,
+keyed by ``make_key`` - a hash of the input arrays and of all parameters.
+
+The entries are kept in memory in least-recently-used order up to a byte
+budget. Views are stored as copies, so that an entry does not keep a larger
+array alive, while read-only arrays (PSFs, noise fields, ... shared through
+the lru caches of their producers) are stored as they are and not charged to
+the budget. Entries pushed out of memory are spilled to a temporary directory with
+``np.save`` and read back memory-mapped; the directory has its own budget,
+beyond which the least recently used files are deleted. ``stats`` reports the
+hits, misses, spills and evictions (``report`` as text) for tuning the budgets, which default to
+the environment variables ``MICROSCOPY_CACHE_MB`` and ``MICROSCOPY_CACHE_DISK_MB``.
+"""
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+CACHE_BYTES = int(float(os.environ.get('MICROSCOPY_CACHE_MB', 256)) * 2**20)
+DISK_BYTES = int(float(os.environ.get('MICROSCOPY_CACHE_DISK_MB', 1024)) * 2**20)
+
+CacheStats = namedtuple('CacheStats', ['hits', 'disk_hits', 'misses', 'spills', 'evictions',
+                                       'entries', 'disk_entries', 'nbytes', 'disk_nbytes'])
+CacheStats.__doc__ = """Counters of a ResultCache: hits in memory and on disk, misses, entries spilled to
+disk and deleted from it, and the current number of entries and bytes in memory and on disk."""
+
+# An array of a spilled entry, saved with np.save
+_Spilled = namedtuple('_Spilled', ['path'])
+
+
+def make_key(*arrays, **params):
+    """
+    Key of a result computed from arrays and parameters.
+
+    The arrays are hashed by content, shape and dtype, the parameters by their
+    repr - which must therefore identify their value (numbers, strings, tuples).
+
+    Returns:
+    str: Hex digest.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(repr((array.shape, array.dtype.str)).encode())
+        digest.update(array.view(np.uint8).data if array.size else b'')
+    digest.update(repr(sorted(params.items())).encode())
+    return digest.hexdigest()
+
+
+def _owned(value):
+    """The value, or a copy of it if it is a writeable view that could keep a larger base array alive."""
+    if isinstance(value, np.ndarray) and value.base is not None and value.flags.writeable:
+        return value.copy()
+    return value
+
+
+def _nbytes(values, shared=False):
+    """Bytes of the arrays among the values; read-only (shared) arrays only count if ``shared``."""
+    return sum(value.nbytes for value in values
+               if isinstance(value, np.ndarray) and (shared or value.flags.writeable))
+
+
+class ResultCache:
+    """
+    LRU cache of tuples of arrays, in memory up to a byte budget and spilled to disk beyond it.
+
+    The values are tuples whose items are numpy arrays or other small objects,
+    e.g. None; only the arrays are written to disk and count towards the budgets,
+    the memory budget leaving out read-only arrays, which are shared with other caches.
+    Safe to use from several threads.
+
+    Parameters:
+    max_bytes (int): Memory budget of the arrays (default: ``CACHE_BYTES``).
+    max_disk_bytes (int): Disk budget, 0 to drop entries instead of spilling them (default: ``DISK_BYTES``).
+    spill_dir (str): Directory of the spilled entries, a temporary one removed with the cache by default.
+    """
+
+    def __init__(self, max_bytes=None, max_disk_bytes=None, spill_dir=None):
+        self.max_bytes = CACHE_BYTES if max_bytes is None else max_bytes
+        self.max_disk_bytes = DISK_BYTES if max_disk_bytes is None else max_disk_bytes
+        self._spill_dir = spill_dir
+        self._memory = OrderedDict()  # key -> values
+        self._disk = OrderedDict()  # key -> (values with file names instead of arrays, nbytes)
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.disk_nbytes = 0
+        self.hits = self.disk_hits = self.misses = self.spills = self.evictions = 0
+
+    @property
+    def spill_dir(self):
+        """Directory of the spilled entries, created on first use."""
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix='microscopy-cache-')
+            weakref.finalize(self, shutil.rmtree, self._spill_dir, ignore_errors=True)
+        return self._spill_dir
+
+    def get(self, key):
+        """The cached values of the key (spilled arrays memory-mapped read-only), or None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            if key in self._disk:
+                self._disk.move_to_end(key)
+                self.disk_hits += 1
+                stored, nbytes = self._disk[key]
+                return tuple(np.load(item.path, mmap_mode='r') if isinstance(item, _Spilled) else item
+                             for item in stored)
+            self.misses += 1
+            return None
+
+    def put(self, key, values):
+        """Store a tuple of values under the key, spilling the least recently used entries over the budget."""
+        values = tuple(_owned(value) for value in values)
+        nbytes = _nbytes(values)
+        with self._lock:
+            self._discard(key)
+            if nbytes > self.max_bytes:
+                self._spill(key, values)
+                return
+            self._memory[key] = values
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                old_key, old_values = self._memory.popitem(last=False)
+                self.nbytes -= _nbytes(old_values)
+                self._spill(old_key, old_values)
+
+    def _spill(self, key, values):
+        # Every array is written to the files of the entry, shared ones included
+        nbytes = _nbytes(values, shared=True)
+        if nbytes > self.max_disk_bytes:
+            self.evictions += 1
+            return
+        stored = []
+        for index, value in enumerate(values):
+            if isinstance(value, np.ndarray):
+                path = os.path.join(self.spill_dir, f'{key}_{index}.npy')
+                np.save(path, value)
+                value = _Spilled(path)
+            stored.append(value)
+        self._disk[key] = (tuple(stored), nbytes)
+        self.disk_nbytes += nbytes
+        self.spills += 1
+        while self.disk_nbytes > self.max_disk_bytes:
+            self._delete(next(iter(self._disk)))
+            self.evictions += 1
+
+    def _delete(self, key):
+        stored, nbytes = self._disk.pop(key)
+        self.disk_nbytes -= nbytes
+        for item in stored:
+            if isinstance(item, _Spilled):
+                # A file still memory-mapped by a caller cannot be removed on Windows
+                with contextlib.suppress(OSError):
+                    os.remove(item.path)
+
+    def _discard(self, key):
+        if key in self._memory:
+            self.nbytes -= _nbytes(self._memory.pop(key))
+        if key in self._disk:
+            self._delete(key)
+
+    def clear(self):
+        """Remove all entries, keeping the counters."""
+        with self._lock:
+            for key in list(self._disk):
+                self._delete(key)
+            self._memory.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._memory) + len(self._disk)
+
+    def __contains__(self, key):
+        return key in self._memory or key in self._disk
+
+    def stats(self):
+        """Current ``CacheStats``."""
+        with self._lock:
+            return CacheStats(self.hits, self.disk_hits, self.misses, self.spills, self.evictions,
+                              len(self._memory), len(self._disk), self.nbytes, self.disk_nbytes)
+
+    def report(self):
+        """One line summary of ``stats``."""
+        stats = self.stats()
+        return (f'cache: {stats.hits} hits ({stats.disk_hits} from disk), {stats.misses} misses, '
+                f'{stats.spills} spilled, {stats.evictions} evicted; '
+                f'{stats.entries} entries / {stats.nbytes / 2**20:.1f} MB in memory, '
+                f'{stats.disk_entries} entries / {stats.disk_nbytes / 2**20:.1f} MB on disk')
+
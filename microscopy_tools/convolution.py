@@ -0,0 +1,132 @@
+"""Convolution backends used to simulate the microscope blur.
+
+Two interchangeable backends are provided. Both take the object image and the
+PSF spread and return the blurred image with the same shape as the object
+(equivalent to ``convolve2d(image, psf, mode='same')``):
+
+- ``DirectConvolver`` - the original spatial-domain ``scipy.signal.convolve2d``.
+- ``FFTConvolver`` - real-input FFTs (rfft2/irfft2) on fast padded sizes, with
+  the PSF frequency response cached so that it is computed only once per
+  (spread, shape).
+
+Both compute in the precision of ``microscopy_tools.workspace`` (float32 and
+complex64 FFTs by default). ``microscopy_tools.varying_psf.VaryingPSFConvolver``
+has the same interface for a PSF that varies across the field of view.
+"""
+import functools
+
+import numpy as np
+from scipy import fft
+
+from .workspace import real_dtype
+
+# The PSF is sampled on a fixed grid, independent of the image size
+PSF_SHAPE = (100, 100)
+PSF_EXTENT = 10
+
+
+@functools.lru_cache(maxsize=32)
+def _gaussian_psf(spread, shape, dtype=np.float64):
+    x = np.linspace(-PSF_EXTENT, PSF_EXTENT, shape[1])
+    y = np.linspace(-PSF_EXTENT, PSF_EXTENT, shape[0])
+    x, y = np.meshgrid(x, y)
+    psf = np.exp(-(x**2 + y**2) / spread)
+    psf /= psf.sum()  # Normalize PSF so that it sums to 1
+    psf = psf.astype(dtype, copy=False)
+    psf.flags.writeable = False  # Shared between callers through the cache
+    return psf
+
+
+def gaussian_psf(spread, shape=PSF_SHAPE, dtype=np.float64):
+    """
+    Gaussian PSF normalised to sum to 1.
+
+    Parameters:
+    spread (float): Spread of the Gaussian (the PSF spread slider value).
+    shape (tuple): Shape of the sampled PSF.
+    dtype: Floating point type of the PSF.
+
+    Returns:
+    numpy array: Read-only PSF, cached per (spread, shape, dtype).
+    """
+    return _gaussian_psf(float(spread), tuple(shape), np.dtype(dtype))
+
+
+def fast_shape(image_shape, psf_shape):
+    """Padded FFT shape for a linear (non-circular) convolution."""
+    return tuple(fft.next_fast_len(n + m - 1, real=True) for n, m in zip(image_shape, psf_shape))
+
+
+def fit_psf(psf, shape):
+    """Centre crop of the PSF to at most ``shape`` (the skimage methods need a PSF not larger than the image)."""
+    if all(m <= n for m, n in zip(psf.shape, shape)):
+        return psf
+    crop = tuple(slice((m - min(m, n)) // 2, (m - min(m, n)) // 2 + min(m, n)) for m, n in zip(psf.shape, shape))
+    return psf[crop] / psf[crop].sum()
+
+
+@functools.lru_cache(maxsize=16)
+def _gaussian_otf(spread, psf_shape, padded_shape, dtype=np.float64):
+    otf = fft.rfft2(_gaussian_psf(spread, psf_shape, dtype), s=padded_shape)
+    otf.flags.writeable = False
+    return otf
+
+
+class DirectConvolver:
+    """Spatial-domain convolution, O(N^2 * M^2)."""
+
+    name = 'direct'
+
+    def __init__(self, psf_shape=PSF_SHAPE, precision=None):
+        self.psf_shape = tuple(psf_shape)
+        self.dtype = real_dtype(precision)
+
+    def psf(self, spread):
+        return gaussian_psf(spread, self.psf_shape, self.dtype)
+
+    def convolve(self, image, spread):
+        from scipy.signal import convolve2d  # scipy.signal is slow to import, only this backend needs it
+
+        return convolve2d(image.astype(self.dtype, copy=False), self.psf(spread), mode='same')
+
+
+class FFTConvolver:
+    """FFT convolution with the PSF frequency response cached per (spread, shape, precision)."""
+
+    name = 'fft'
+
+    def __init__(self, psf_shape=PSF_SHAPE, precision=None):
+        self.psf_shape = tuple(psf_shape)
+        self.dtype = real_dtype(precision)
+
+    def psf(self, spread):
+        return gaussian_psf(spread, self.psf_shape, self.dtype)
+
+    def transfer_function(self, spread, image_shape):
+        """rfft2 of the PSF zero-padded to the fast shape for ``image_shape``."""
+        padded_shape = fast_shape(image_shape, self.psf_shape)
+        return _gaussian_otf(float(spread), self.psf_shape, padded_shape, self.dtype)
+
+    def convolve(self, image, spread):
+        padded_shape = fast_shape(image.shape, self.psf_shape)
+        otf = self.transfer_function(spread, image.shape)
+        spectrum = fft.rfft2(image.astype(self.dtype, copy=False), s=padded_shape)
+        spectrum *= otf
+        full = fft.irfft2(spectrum, s=padded_shape, overwrite_x=True)
+        # Crop the centred part, matching convolve2d(..., mode='same')
+        row0, col0 = ((m - 1) // 2 for m in self.psf_shape)
+        return full[row0:row0 + image.shape[0], col0:col0 + image.shape[1]]
+
+
+CONVOLVERS = {
+    DirectConvolver.name: DirectConvolver,
+    FFTConvolver.name: FFTConvolver,
+}
+
+
+def make_convolver(name='fft', psf_shape=PSF_SHAPE, precision=None):
+    """Create a convolution backend by name ('fft' or 'direct') computing in the given precision."""
+    try:
+        return CONVOLVERS[name](psf_shape, precision)
+    except KeyError:
+        raise ValueError(f"Unknown convolution backend {name!r}, choose from {sorted(CONVOLVERS)}") from None
@@ -0,0 +1,216 @@
+"""Convolution/deconvolution pipeline of the microscope demo, free of any GUI state.
+
+The pipeline has two steps:
+
+- ``acquire`` - builds the PSF, blurs the object and adds noise, i.e. what the
+  microscope records. The noise is seeded (see microscopy_tools.noise).
+- ``deconvolve`` - reconstructs the object with one of ``METHODS``.
+
+``run_pipeline`` chains both, and ``rmse``/``psnr`` score a result against the object.
+``iterate_pipeline`` is the same as a generator that also yields the
+intermediate estimates of the 'Iterative' (Richardson-Lucy) method, and can
+reuse earlier results from a ``cache.ResultCache``.
+
+An acquisition with a field-dependent PSF (a ``varying_psf.PSFGrid``, from the
+``VaryingPSFConvolver`` backend) is deconvolved tile by tile.
+"""
+from collections import namedtuple
+
+import numpy as np
+from scipy.fft import rfftn, irfftn
+
+from .cache import make_key
+from .convolution import make_convolver
+from .noise import DEFAULT_SEED, camera_noise
+from .profiling import timed_iter, timer
+from .richardson_lucy import iterate_richardson_lucy
+from .varying_psf import PSFGrid
+
+METHODS = ('Wiener', 'Unsupervised Wiener', 'Inverse', 'Iterative')
+
+# Methods that use the Wiener balance parameter
+BALANCED_METHODS = ('Wiener',)
+
+# Slow methods, and their iteration limits for a quick preview while a slider is dragged
+PREVIEW_METHODS = ('Unsupervised Wiener', 'Iterative')
+PREVIEW_RL_ITERATIONS = 5
+PREVIEW_UNSUPERVISED_PARAMS = {'max_num_iter': 20, 'min_num_iter': 5}
+
+# Accelerated Richardson-Lucy fits the data as well as 50 plain iterations (the
+# skimage default) in 10-30 iterations (benchmarks/bench_richardson_lucy.py).
+# It stops earlier once the relative change of the estimate is below RL_TOLERANCE.
+RL_ITERATIONS = 20
+RL_TOLERANCE = 1e-3
+# Intermediate estimates shown while the iterations run
+RL_REPORT_EVERY = 3
+
+Acquisition = namedtuple('Acquisition', ['psf', 'blurred', 'noise', 'noisy_blurred'])
+
+
+def acquire(obj, spread, noise, convolver=None, rng=None, photons=None):
+    """
+    Simulate imaging of an object: convolution with the PSF plus camera noise.
+
+    Parameters:
+    obj (numpy array): The object image.
+    spread (float): Spread of the Gaussian PSF.
+    noise (float): Standard deviation of the additive Gaussian (read) noise.
+    convolver: Convolution backend (see microscopy_tools.convolution), FFT in the
+        default precision by default.
+    rng (int or numpy Generator): Source of the noise (see microscopy_tools.noise). An int
+        seed, DEFAULT_SEED by default, rescales the cached noise field of the seed; a
+        Generator draws new noise.
+    photons (float): Expected photons at the brightest pixel of the blurred image, for
+        Poisson shot noise; None for the Gaussian noise only.
+
+    Returns:
+    Acquisition: The PSF, blurred image, noise component and noisy blurred image.
+    """
+    if convolver is None:
+        convolver = make_convolver()
+    if rng is None:
+        rng = DEFAULT_SEED
+    with timer('psf'):
+        psf = convolver.psf(spread)
+    with timer('convolve'):
+        blurred = convolver.convolve(obj, spread)
+    with timer('noise'):
+        # In the precision of the blurred image, without float64 temporaries
+        noise_component = camera_noise(blurred, photons, noise, seed=rng)
+    return Acquisition(psf, blurred, noise_component, blurred + noise_component)
+
+
+def deconvolve(obj, acquisition, method, balance, preview=False):
+    """
+    Reconstruct the object from a simulated acquisition.
+
+    Parameters:
+    obj (numpy array): The object image (used by the 'Inverse' method, which
+        demonstrates how the noise is amplified by dividing by the PSF spectrum).
+    acquisition (Acquisition): Result of ``acquire``.
+    method (str): One of ``METHODS``.
+    balance (float): Regularisation of the 'Wiener' method.
+    preview (bool): Run the iterative methods with few iterations only.
+
+    Returns:
+    numpy array: The deconvolved image.
+    """
+    psf = acquisition.psf
+    noisy_blurred = acquisition.noisy_blurred
+    if isinstance(psf, PSFGrid):
+        return _deconvolve_tiles(obj, acquisition, method, balance, preview)
+    if method == 'Wiener':
+        from skimage.restoration import wiener  # skimage.restoration is slow to import, only load it when used
+
+        return wiener(noisy_blurred, psf, balance)
+    elif method == 'Inverse':
+        # n-dimensional transforms, also used for the blocks of 3D volumes. They run in
+        # double precision: the PSF spectrum underflows to zero in complex64.
+        f_psf = rfftn(psf.astype(np.float64), s=noisy_blurred.shape)
+        f_blurred = rfftn(obj.astype(np.float64)) * f_psf
+        f_noise = rfftn(acquisition.noise.astype(np.float64))
+        # Frequencies the PSF does not transmit at all are left out
+        transmitted = f_psf != 0
+        f_deconvolved = np.divide(f_blurred + f_noise, f_psf, out=np.zeros_like(f_psf), where=transmitted)
+        deconvolved = irfftn(f_deconvolved, s=noisy_blurred.shape).astype(noisy_blurred.dtype, copy=False)
+        if not np.isfinite(deconvolved).all():
+            raise FloatingPointError('The inverse filter overflowed, the PSF spectrum is too close to zero')
+        return deconvolved
+    elif method == 'Iterative':
+        for state in _iterate_richardson_lucy(acquisition, preview):
+            pass
+        return state.estimate
+    elif method == 'Unsupervised Wiener':
+        from skimage.restoration import unsupervised_wiener
+
+        user_params = PREVIEW_UNSUPERVISED_PARAMS if preview else None
+        deconvolved, chains = unsupervised_wiener(noisy_blurred, psf, user_params=user_params)
+        return deconvolved
+    raise ValueError(f"Unknown deconvolution method {method!r}, choose from {METHODS}")
+
+
+def _deconvolve_tiles(obj, acquisition, method, balance, preview):
+    """Deconvolve every tile of a field-dependent acquisition with its PSF, blended by the tile windows."""
+    def deconvolve_tile(region, psf):
+        tile = Acquisition(psf, *(None if image is None else image[region] for image in acquisition[1:]))
+        return deconvolve(None if obj is None else obj[region], tile, method, balance, preview=preview)
+
+    return acquisition.psf.blend(deconvolve_tile, acquisition.noisy_blurred.shape)
+
+
+def _iterate_richardson_lucy(acquisition, preview, report_every=None):
+    num_iter = PREVIEW_RL_ITERATIONS if preview else RL_ITERATIONS
+    return iterate_richardson_lucy(acquisition.noisy_blurred, acquisition.psf, num_iter=num_iter,
+                                   accelerate=True, tol=RL_TOLERANCE, report_every=report_every)
+
+
+def run_pipeline(obj, spread, noise, balance, method, convolver=None, rng=None, preview=False, photons=None):
+    """Run ``acquire`` followed by ``deconvolve``, returns (acquisition, deconvolved)."""
+    acquisition = acquire(obj, spread, noise, convolver=convolver, rng=rng, photons=photons)
+    with timer('deconvolve'):
+        return acquisition, deconvolve(obj, acquisition, method, balance, preview=preview)
+
+
+def _pipeline_key(obj, spread, noise, balance, method, convolver, rng, preview, photons):
+    """Cache key of everything a pipeline result depends on."""
+    return make_key(obj, spread=float(spread), noise=float(noise), method=method, preview=preview,
+                    balance=float(balance) if method in BALANCED_METHODS else None,
+                    seed=DEFAULT_SEED if rng is None else int(rng), photons=photons and float(photons),
+                    convolver=(type(convolver).__name__, sorted(vars(convolver).items())))
+
+
+def iterate_pipeline(obj, spread, noise, balance, method, convolver=None, rng=None, preview=False,
+                     photons=None, report_every=RL_REPORT_EVERY, cache=None):
+    """
+    Generator version of ``run_pipeline`` for showing the progress.
+
+    With a ``cache.ResultCache`` the final result is stored, and a result cached
+    for the same object and parameters is yielded at once instead of being
+    recomputed. Only seeded noise is cached (rng None or an int), a Generator
+    draws new noise every time.
+
+    Yields:
+    tuple: (acquisition, deconvolved, state). For the 'Iterative' method every
+    ``report_every`` iterations with the ``RLState`` of the iteration (the last
+    one is the result), for the other methods and field-dependent PSFs once with state None.
+    """
+    if convolver is None:
+        convolver = make_convolver()
+    key = None
+    if cache is not None and not isinstance(rng, np.random.Generator):
+        key = _pipeline_key(obj, spread, noise, balance, method, convolver, rng, preview, photons)
+        cached = cache.get(key)
+        if cached is not None:
+            *acquisition, deconvolved, state = cached
+            yield Acquisition(*acquisition), deconvolved, state and state._replace(estimate=deconvolved)
+            return
+
+    acquisition = acquire(obj, spread, noise, convolver=convolver, rng=rng, photons=photons)
+    if method == 'Iterative' and not isinstance(acquisition.psf, PSFGrid):
+        for state in timed_iter('deconvolve', _iterate_richardson_lucy(acquisition, preview, report_every)):
+            yield acquisition, state.estimate, state
+        deconvolved = state.estimate
+    else:
+        state = None
+        with timer('deconvolve'):
+            deconvolved = deconvolve(obj, acquisition, method, balance, preview=preview)
+        yield acquisition, deconvolved, state
+    if key is not None:
+        # The estimate of the state is the deconvolved image, stored once
+        cache.put(key, (*acquisition, deconvolved, state and state._replace(estimate=None)))
+
+
+def rmse(estimate, reference):
+    """Root-mean-square error of an estimate against the reference image."""
+    return float(np.sqrt(np.mean((estimate - reference) ** 2)))
+
+
+def psnr(estimate, reference):
+    """Peak signal-to-noise ratio in dB, with the peak taken as the reference's dynamic range."""
+    data_range = np.max(reference) - np.min(reference)
+    error = rmse(estimate, reference)
+    if error == 0:
+        return np.inf
+    if data_range == 0 or not np.isfinite(error):
+        return -np.inf
+    return float(20 * np.log10(data_range / error))
@@ -0,0 +1,207 @@
+"""Low-pass filtering of an image in the Fourier domain (reduction of the objective NA).
+
+``LowPassFilter`` computes everything that does not depend on the cut-off once
+per image: the real-input spectrum (rfft2), the centred log-magnitude shown in
+the figure and the (squared) radial frequency distance maps. Changing the cut-off then
+costs one masked multiply and one inverse real FFT.
+
+The spectrum is complex64 in the default float32 precision, and the masks and
+masked arrays are written into a per-filter ``Workspace`` instead of new arrays.
+"""
+import numpy as np
+from scipy import fft
+
+from .workspace import Workspace, real_dtype
+
+# Largest number of spectrum rows for which the incremental update beats a full
+# inverse FFT, by image side (square images), measured with benchmarks/bench_lowpass.py.
+# Other sizes are interpolated in the number of pixels (log scale).
+CROSSOVER_ROWS = {256: 9, 512: 20, 1024: 49, 2048: 73, 4096: 97}
+
+
+def cutoff_radius(shape, percentage):
+    """Radius of the kept frequencies, as a percentage of the largest circle fitting the spectrum."""
+    center_x, center_y = shape[0] // 2, shape[1] // 2
+    return int(min(center_x, center_y) * (percentage / 100))
+
+
+def squared_frequency_distance(shape, centred=True):
+    """
+    Squared distance of every Fourier coefficient from the zero frequency, in frequency samples.
+
+    Integers, so comparing with a squared integer radius is exact.
+
+    Parameters:
+    shape (tuple): Shape of the image.
+    centred (bool): True - layout of fftshift(fft2(image)); False - layout of rfft2(image).
+    """
+    height, width = shape
+    if centred:
+        ky = np.arange(height) - height // 2
+        kx = np.arange(width) - width // 2
+    else:
+        ky = np.fft.fftfreq(height, 1 / height).round().astype(np.int64)
+        kx = np.arange(width // 2 + 1)
+    return (ky[:, None]**2 + kx[None, :]**2).astype(np.int32)
+
+
+def centred_magnitude(half_spectrum, width):
+    """
+    |fftshift(fft2(image))| rebuilt from rfft2(image) using the Hermitian symmetry of real input.
+
+    Parameters:
+    half_spectrum (numpy array): rfft2 of the image.
+    width (int): Width of the image (not recoverable from the half spectrum alone).
+    """
+    height = half_spectrum.shape[0]
+    half_magnitude = np.abs(half_spectrum)
+    full = np.empty((height, width), dtype=half_magnitude.dtype)
+    n_half = half_spectrum.shape[1]
+    full[:, :n_half] = half_magnitude
+    # F[k, l] = conj(F[-k, -l]) for the columns missing from the half spectrum
+    rows = -np.arange(height) % height
+    cols = width - np.arange(n_half, width)
+    full[:, n_half:] = half_magnitude[rows][:, cols]
+    return np.fft.fftshift(full)
+
+
+class LowPassFilter:
+    """
+    Cached spectrum of one image for filtering with changing cut-offs.
+
+    Parameters:
+    image (numpy array): 2D greyscale image.
+    precision (str): Precision of the computation (see microscopy_tools.workspace).
+    """
+
+    def __init__(self, image, precision=None):
+        self.image = image = np.asarray(image, dtype=real_dtype(precision))
+        self.shape = image.shape
+        self.workspace = Workspace(precision)
+        self.spectrum = fft.rfft2(image, workers=-1)
+        with np.errstate(divide='ignore'):
+            self.log_magnitude = np.log(centred_magnitude(self.spectrum, self.shape[1]))
+        self._distance2 = squared_frequency_distance(self.shape, centred=False)
+        self._display_distance2 = squared_frequency_distance(self.shape, centred=True)
+
+    def filter(self, percentage):
+        """
+        Low-pass filter the image.
+
+        Parameters:
+        percentage (float): Radius of the kept frequencies in percent (see ``cutoff_radius``).
+
+        Returns:
+        tuple: Centred log-magnitude of the masked spectrum (0 outside the mask) and the
+        magnitude of the filtered image, overwritten by the next call.
+        """
+        radius2 = cutoff_radius(self.shape, percentage)**2
+        image_filtered = fft.irfft2(self._masked_spectrum(radius2), s=self.shape, workers=-1, overwrite_x=True)
+        return self._masked_log_magnitude(radius2), np.abs(image_filtered, out=image_filtered)
+
+    def _masked_spectrum(self, radius2):
+        mask = np.less_equal(self._distance2, radius2, out=self.workspace.buffer('mask', self._distance2.shape, bool))
+        masked = self.workspace.buffer('masked_spectrum', self.spectrum.shape, self.spectrum.dtype)
+        return np.multiply(self.spectrum, mask, out=masked)
+
+    def _masked_log_magnitude(self, radius2):
+        """Centred log-magnitude inside the cut-off, 0 outside (-inf of empty frequencies stays inside only)."""
+        mask = np.less_equal(self._display_distance2, radius2,
+                             out=self.workspace.buffer('display_mask', self.shape, bool))
+        masked_log_magnitude = self.workspace.buffer('masked_log_magnitude', self.shape, self.log_magnitude.dtype)
+        masked_log_magnitude.fill(0)
+        np.copyto(masked_log_magnitude, self.log_magnitude, where=mask)
+        return masked_log_magnitude
+
+
+class IncrementalLowPassFilter(LowPassFilter):
+    """
+    Low-pass filter updating the filtered image by the annulus between the old and new cut-off.
+
+    The rfft2 coefficients are sorted by frequency radius once. When the cut-off
+    moves, only the coefficients of the annulus between the old and the new
+    radius are transformed (a partial inverse DFT) and added to or subtracted
+    from the current filtered image. A ring of radius r touches about 2r + 1
+    rows of the spectrum and the partial transform costs O(rows * H * W), so
+    large jumps (more than ``max_rows`` rows) fall back to a full inverse FFT,
+    as does every ``resync_every``-th update to stop round-off from accumulating.
+
+    Parameters:
+    image (numpy array): 2D greyscale image.
+    max_rows (int): Largest number of spectrum rows updated incrementally, from
+        ``CROSSOVER_ROWS`` by default.
+    resync_every (int): Number of incremental updates between full reconstructions.
+    precision (str): Precision of the computation (see microscopy_tools.workspace).
+    """
+
+    def __init__(self, image, max_rows=None, resync_every=64, precision=None):
+        super().__init__(image, precision)
+        height, width = self.shape
+        if max_rows is None:
+            sides = np.array(list(CROSSOVER_ROWS))
+            max_rows = int(np.interp(np.log2(height * width), np.log2(sides**2), list(CROSSOVER_ROWS.values())))
+        self.max_rows = max_rows
+        self.resync_every = resync_every
+        self._n_half = self.spectrum.shape[1]
+
+        flat_distance2 = self._distance2.ravel()
+        self._order = np.argsort(flat_distance2, kind='stable')
+        self._sorted_distance2 = flat_distance2[self._order]
+
+        # Weights of the half spectrum columns: the missing conjugate columns count twice
+        self._column_weights = np.full(self._n_half, 2, dtype=self.image.dtype)
+        self._column_weights[0] = 1
+        if width % 2 == 0:
+            self._column_weights[-1] = 1
+        self._row_frequencies = np.fft.fftfreq(height, 1 / height)
+        self._y = np.arange(height)
+
+        self._radius2 = None
+        self._filtered = None
+        self._updates = 0
+
+    def annulus(self, radius2_from, radius2_to):
+        """Flat rfft2 indices of the coefficients with radius2_from < distance^2 <= radius2_to."""
+        start = np.searchsorted(self._sorted_distance2, radius2_from, side='right')
+        stop = np.searchsorted(self._sorted_distance2, radius2_to, side='right')
+        return self._order[start:stop]
+
+    def partial_inverse(self, indices):
+        """
+        Inverse real FFT of the spectrum restricted to the given coefficients.
+
+        The rows of the coefficients are inverse transformed along x, then
+        combined along y by a matrix product with the inverse DFT basis of those rows.
+        """
+        height, width = self.shape
+        rows, cols = np.divmod(indices, self._n_half)
+        unique_rows, row_positions = np.unique(rows, return_inverse=True)
+        row_spectra = np.zeros((len(unique_rows), width), dtype=self.spectrum.dtype)
+        row_spectra[row_positions, cols] = self.spectrum.ravel()[indices] * self._column_weights[cols]
+        row_signals = fft.ifft(row_spectra, axis=1, workers=-1)
+        basis = np.exp(2j * np.pi * np.outer(self._y, self._row_frequencies[unique_rows]) / height) / height
+        partial = self.workspace.buffer('partial_inverse', self.shape, self.spectrum.dtype)
+        return np.matmul(basis.astype(self.spectrum.dtype, copy=False), row_signals, out=partial).real
+
+    def filter(self, percentage):
+        radius2 = cutoff_radius(self.shape, percentage)**2
+        if self._filtered is not None and radius2 != self._radius2:
+            low, high = sorted((self._radius2, radius2))
+            indices = self.annulus(low, high)
+            n_rows = len(np.unique(indices // self._n_half))
+            if n_rows <= self.max_rows and self._updates < self.resync_every:
+                contribution = self.partial_inverse(indices)
+                if radius2 > self._radius2:
+                    self._filtered += contribution
+                else:
+                    self._filtered -= contribution
+                self._updates += 1
+            else:
+                self._filtered = None
+        if self._filtered is None:
+            self._filtered = fft.irfft2(self._masked_spectrum(radius2), s=self.shape, workers=-1, overwrite_x=True)
+            self._updates = 0
+        self._radius2 = radius2
+
+        image_filtered = self.workspace.buffer('filtered_magnitude', self.shape)
+        return self._masked_log_magnitude(radius2), np.abs(self._filtered, out=image_filtered)
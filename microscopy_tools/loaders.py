@@ -0,0 +1,210 @@
+"""Image loading shared by the scripts, for everything from a JPEG to multi-GB microscope stacks.
+
+``open_image`` does not decode the file. It returns an ``ImageSource`` that is
+backed by a memory map whenever the data is stored uncompressed (.npy, raw
+binary, uncompressed TIFF), so that picking one plane or channel only reads
+that plane, and a strided display view only touches the pixels it shows.
+Compressed TIFFs are decoded page by page on request; other formats (JPEG,
+PNG, ...) are read with skimage.
+
+Data stays in its native dtype; ``to_float`` converts a plane to float32 when
+the computation needs it.
+
+Axes are described by a string with one letter per dimension: Y and X are the
+image axes, S the samples of a pixel (RGB), C the channels and any other letter
+a plane axis (Z, T, ...), as in tifffile.
+"""
+import math
+from pathlib import Path
+
+import numpy as np
+
+# Weights of skimage.color.rgb2gray
+RGB_WEIGHTS = np.array([0.2125, 0.7154, 0.0721], dtype=np.float32)
+
+RAW_SUFFIXES = ('.raw', '.bin', '.dat')
+TIFF_SUFFIXES = ('.tif', '.tiff', '.btf', '.tf8')
+
+
+def guess_axes(shape):
+    """Axes of an array without metadata: RGB(A) if the last dimension has 3 or 4 entries, planes first."""
+    if len(shape) < 2:
+        raise ValueError(f"Expected at least a 2D image, got shape {shape}")
+    if len(shape) >= 3 and shape[-1] in (3, 4):
+        return 'Q' * (len(shape) - 3) + 'YXS'
+    return 'Q' * (len(shape) - 2) + 'YX'
+
+
+class ImageSource:
+    """
+    Lazily read image data with named axes.
+
+    Parameters:
+    data: Array-like supporting numpy indexing (ndarray or np.memmap), or None for page-wise TIFFs.
+    axes (str): Axes of the data, see the module docstring.
+    shape (tuple): Shape of the data.
+    dtype: Data type of the data.
+    read_page (callable): For page-wise TIFFs, returns the decoded page with the given index.
+    page_ndim (int): For page-wise TIFFs, the number of trailing axes stored in a page
+        (Y, X and any S or C axis of the page); the other axes enumerate the pages.
+    """
+
+    def __init__(self, data, axes, shape=None, dtype=None, read_page=None, path=None, page_ndim=2):
+        self.data = data
+        self.shape = tuple(data.shape if shape is None else shape)
+        self.dtype = np.dtype(data.dtype if dtype is None else dtype)
+        if len(axes) != len(self.shape):
+            raise ValueError(f"Axes {axes!r} do not match the data shape {self.shape}")
+        self.axes = axes.upper()
+        self.path = path
+        self._read_page = read_page
+        self._page_ndim = page_ndim
+        self.plane_axes = [i for i, axis in enumerate(self.axes) if axis not in 'YXSC']
+
+    @property
+    def memory_mapped(self):
+        return isinstance(self.data, np.memmap)
+
+    @property
+    def n_planes(self):
+        return math.prod(self.shape[i] for i in self.plane_axes)
+
+    @property
+    def n_channels(self):
+        if 'C' in self.axes:
+            return self.shape[self.axes.index('C')]
+        if 'S' in self.axes:
+            return self.shape[self.axes.index('S')]
+        return 1
+
+    def _index(self, index, channel):
+        """Indices of the non-image axes for a plane number and channel."""
+        if not 0 <= index < self.n_planes:
+            raise IndexError(f"Plane {index} out of range, the image has {self.n_planes} planes")
+        plane_index = np.unravel_index(index, [self.shape[i] for i in self.plane_axes]) if self.plane_axes else ()
+        key = [slice(None)] * len(self.shape)
+        for axis, i in zip(self.plane_axes, plane_index):
+            key[axis] = int(i)
+        if 'C' in self.axes:
+            key[self.axes.index('C')] = 0 if channel is None else channel
+        return key
+
+    def _read(self, key, step=1):
+        key = list(key)
+        for axis in (self.axes.index('Y'), self.axes.index('X')):
+            key[axis] = slice(None, None, step)
+        if self._read_page is None:
+            plane = self.data[tuple(key)]
+        else:
+            # Page-wise TIFF: pages hold the trailing axes, the others enumerate pages
+            n_page_axes = len(self.shape) - self._page_ndim
+            page = np.ravel_multi_index(key[:n_page_axes], self.shape[:n_page_axes]) if n_page_axes else 0
+            plane = self._read_page(int(page))[tuple(key[n_page_axes:])]
+        return plane
+
+    def plane(self, index=0, channel=None, step=1):
+        """
+        A single 2D plane in the native dtype.
+
+        Parameters:
+        index (int): Number of the plane, counted over all plane axes (Z, T, ...).
+        channel (int): Channel (C axis) or sample (S axis) to take. For RGB(A) data
+            None gives the greyscale (luminance) image as float32.
+        step (int): Take every step-th pixel; a strided view for memory-mapped data.
+        """
+        plane = self._read(self._index(index, channel), step)
+        if 'S' in self.axes:
+            # Samples last, as for RGB images (planar TIFFs store them first)
+            plane = np.moveaxis(plane, [axis for axis in self.axes if axis in 'YXS'].index('S'), -1)
+            if channel is not None:
+                plane = plane[..., channel]
+            elif plane.shape[-1] in (3, 4):
+                plane = rgb_to_grey(plane)
+            else:
+                plane = plane[..., 0]
+        return plane
+
+    def display(self, index=0, channel=None, max_size=1024):
+        """Plane subsampled by striding so that its larger side is at most ``max_size`` pixels."""
+        height = self.shape[self.axes.index('Y')]
+        width = self.shape[self.axes.index('X')]
+        step = max(1, math.ceil(max(height, width) / max_size))
+        return self.plane(index, channel, step=step)
+
+
+def rgb_to_grey(rgb):
+    """Luminance of RGB(A) pixels (alpha ignored) as float32, integers scaled to [0, 1]."""
+    grey = rgb[..., :3] @ RGB_WEIGHTS
+    if np.issubdtype(rgb.dtype, np.integer):
+        grey /= np.iinfo(rgb.dtype).max
+    return grey
+
+
+def to_float(image, dtype=np.float32):
+    """
+    Convert an image to floats rescaled to [0, 1] (min-max of the image).
+
+    Parameters:
+    image (numpy array): Image in any dtype (read from a memory map if needed).
+    dtype: Floating point type of the result, float32 by default.
+    """
+    image = np.array(image, dtype=dtype)  # Always a copy, the input may be a read-only memory map
+    low, high = np.min(image), np.max(image)
+    image -= low
+    if high > low:
+        image /= high - low
+    return image
+
+
+def open_image(path, axes=None, shape=None, dtype=None, offset=0):
+    """
+    Open an image file without decoding it.
+
+    Parameters:
+    path (str): .npy, raw binary (.raw, .bin, .dat), TIFF, or any format skimage can read.
+    axes (str): Override the axes found in the metadata or guessed from the shape.
+    shape (tuple), dtype, offset (int): Layout of raw binary files (required for them).
+
+    Returns:
+    ImageSource: The lazily read image.
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+
+    if suffix == '.npy':
+        data = np.load(path, mmap_mode='r')
+        return ImageSource(data, axes or guess_axes(data.shape), path=path)
+
+    if suffix in RAW_SUFFIXES:
+        if shape is None or dtype is None:
+            raise ValueError(f"{path}: raw files need the shape and dtype of the data")
+        data = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=tuple(shape))
+        return ImageSource(data, axes or guess_axes(data.shape), path=path)
+
+    if suffix in TIFF_SUFFIXES:
+        import tifffile  # Installed with scikit-image
+
+        with tifffile.TiffFile(path) as tif:
+            series = tif.series[0]
+            series_axes, series_shape, series_dtype = series.axes, series.shape, series.dtype
+            # A page holds the trailing axes of the series, e.g. CYX of a ZCYX stack
+            page_ndim = min(len(series.pages[0].shape), len(series_shape))
+        # tifffile uses Q for unknown axes and I for image sequences, both are planes here
+        axes = axes or series_axes
+        try:
+            data = tifffile.memmap(path, mode='r')
+            return ImageSource(data, axes, path=path)
+        except ValueError:
+            pass  # Compressed or non-contiguous, decode page by page
+
+        def read_page(page, path=path):
+            with tifffile.TiffFile(path) as tif:
+                return tif.series[0].pages[page].asarray()
+
+        return ImageSource(None, axes, shape=series_shape, dtype=series_dtype, read_page=read_page, path=path,
+                           page_ndim=page_ndim)
+
+    from skimage.io import imread
+
+    data = imread(path)
+    return ImageSource(data, axes or guess_axes(data.shape), path=path)
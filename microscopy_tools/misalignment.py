@@ -0,0 +1,141 @@
+"""Detected fluorescence for misaligned excitation and detection spots (1D).
+
+Excitation and detection PSFs are Gaussians of the same sigma. A fluorophore
+at position f is excited with exp(-(f - e)^2 / 2 sigma^2) and its emission is
+collected with exp(-(f - d)^2 / 2 sigma^2), e and d being the excitation and
+detection positions. All functions broadcast over their arguments, so whole
+trajectories, grids of positions or several sigmas are evaluated in one call.
+
+When the excitation and detection are moved together at a fixed distance (a
+linked scan), the detected intensity peaks with the fluorophore halfway
+between them - the principle of pixel reassignment. ``linked_scan`` samples
+that curve once per (distance, sigma) and ``LinkedScan`` looks it up.
+"""
+import functools
+
+import numpy as np
+
+# Sampling of the precomputed curves, fine compared with the sigma of the demo
+SCAN_SAMPLES = 2001
+MAP_SAMPLES = 256
+
+
+def excitation_intensity(excitation, fluorophore, sigma):
+    """Fluorescence emitted by a fluorophore excited by a Gaussian spot (1 at the centre)."""
+    excitation, fluorophore, sigma = np.broadcast_arrays(excitation, fluorophore, sigma)
+    return np.exp(-((fluorophore - excitation) ** 2) / (2 * sigma ** 2))
+
+
+def detected_intensity(excitation, detection, fluorophore, sigma):
+    """
+    Intensity detected from a fluorophore.
+
+    Parameters:
+    excitation, detection (float or numpy array): Positions of the excitation and detection spots.
+    fluorophore (float or numpy array): Position of the fluorophore.
+    sigma (float or numpy array): Sigma of the excitation and detection PSFs.
+
+    Returns:
+    numpy array: Detected intensity, broadcast over the inputs.
+    """
+    return excitation_intensity(excitation, fluorophore, sigma) * excitation_intensity(detection, fluorophore, sigma)
+
+
+@functools.lru_cache(maxsize=32)
+def linked_scan(distance, sigma, fluorophore, start=0.0, stop=1.0, samples=SCAN_SAMPLES):
+    """
+    Detected intensity of a linked scan, sampled once per (distance, sigma, fluorophore).
+
+    Parameters:
+    distance (float): Detection position minus excitation position.
+    sigma (float): Sigma of the PSFs.
+    fluorophore (float): Position of the fluorophore.
+    start, stop (float): Range of the excitation position.
+    samples (int): Number of samples of the curve.
+
+    Returns:
+    tuple: Read-only excitation positions and detected intensities.
+    """
+    excitation = np.linspace(start, stop, samples)
+    intensity = detected_intensity(excitation, excitation + distance, fluorophore, sigma)
+    excitation.flags.writeable = False
+    intensity.flags.writeable = False
+    return excitation, intensity
+
+
+class LinkedScan:
+    """
+    Lookup of the detected intensity of a linked scan by excitation position.
+
+    Parameters:
+    distance (float): Detection position minus excitation position.
+    sigma (float): Sigma of the PSFs.
+    fluorophore (float): Position of the fluorophore.
+    start, stop (float): Range of the excitation position (the slider range).
+    """
+
+    def __init__(self, distance, sigma, fluorophore, start=0.0, stop=1.0):
+        self.distance = distance
+        self.excitation, self.intensity = linked_scan(float(distance), float(sigma), float(fluorophore),
+                                                      float(start), float(stop))
+        # The maximum is reached with the fluorophore halfway between the spots
+        self.peak_position = fluorophore - distance / 2
+
+    def __call__(self, excitation):
+        return np.interp(excitation, self.excitation, self.intensity)
+
+
+@functools.lru_cache(maxsize=8)
+def intensity_map(fluorophore, sigma, start=0.0, stop=1.0, samples=MAP_SAMPLES):
+    """
+    Detected intensity for every pair of positions, as an image [detection, excitation].
+
+    The detected intensity is separable, so the map is the outer product of
+    the excitation and detection profiles. Cached and read-only.
+    """
+    positions = np.linspace(start, stop, samples)
+    profile = excitation_intensity(positions, fluorophore, sigma)
+    intensity = np.outer(profile, profile)
+    intensity.flags.writeable = False
+    return intensity
+
+
+class IntensityHistory:
+    """
+    Fixed-size history of values in a NumPy ring buffer.
+
+    Appending is O(1). ``data`` returns the values oldest first together with
+    their x coordinates, spread over [0, 1] as in the original plot; the x axes
+    are precomputed for every length.
+
+    Parameters:
+    max_length (int): Number of values kept.
+    """
+
+    def __init__(self, max_length):
+        self.max_length = max_length
+        self._values = np.empty(max_length)
+        self._ordered = np.empty(max_length)
+        self._x = [np.linspace(0, 1, n) for n in range(max_length + 1)]
+        self._start = 0
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def append(self, value):
+        end = (self._start + self._length) % self.max_length
+        self._values[end] = value
+        if self._length < self.max_length:
+            self._length += 1
+        else:
+            self._start = (self._start + 1) % self.max_length
+
+    def data(self):
+        """x coordinates and values, oldest first (the values are a reused buffer)."""
+        n = self._length
+        first = self._values[self._start:self._start + n]
+        ordered = self._ordered[:n]
+        ordered[:len(first)] = first
+        ordered[len(first):] = self._values[:n - len(first)]
+        return self._x[n], ordered
@@ -0,0 +1,156 @@
+"""Reproducible noise for the simulated acquisitions.
+
+All noise comes from PCG64 ``numpy.random.Generator`` streams with explicit
+seeds. Two kinds of source are accepted wherever a ``seed`` is asked for:
+
+- an int seed - the same seed always gives the same noise. The unit-variance
+  Gaussian field of a seed is cached per shape (``unit_noise``), so the noise
+  pattern does not flicker between updates, and a new noise level only
+  rescales the cached field instead of sampling a new one.
+- a ``numpy.random.Generator`` - new noise on every call, reproducible through
+  the seed of the generator.
+
+Large frames are generated in chunks of rows on a thread pool, every chunk
+from its own stream spawned from the seed (``SeedSequence.spawn``; numpy's
+generators release the GIL while filling arrays). The chunks depend only on
+the shape, so the result does not depend on the number of threads.
+
+Besides additive Gaussian noise there is the camera model: Poisson shot noise
+of the detected photons plus Gaussian read noise (``camera_noise``).
+"""
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_SEED = 0
+
+# Elements generated by one stream (one task of the thread pool)
+CHUNK_SIZE = 2**18
+
+# Independent streams of a seed
+GAUSSIAN_STREAM = 0
+SHOT_STREAM = 1
+
+
+def _row_chunks(shape):
+    """Slices of rows with about CHUNK_SIZE elements each."""
+    rows = shape[0] if shape else 1
+    row_size = max(1, int(np.prod(shape[1:], dtype=np.int64)))
+    step = max(1, CHUNK_SIZE // row_size)
+    return [slice(start, min(start + step, rows)) for start in range(0, rows, step)]
+
+
+def _generators(seed, stream, n):
+    """n independent PCG64 generators for the chunks of one stream of the seed."""
+    if isinstance(seed, np.random.Generator):
+        return seed.spawn(n)
+    children = np.random.SeedSequence(seed, spawn_key=(stream,)).spawn(n)
+    return [np.random.Generator(np.random.PCG64(child)) for child in children]
+
+
+def _fill(out, func, seed, stream, workers=None):
+    """Call ``func(generator, rows)`` to fill ``out[rows]`` for every chunk of rows, on a thread pool for large arrays."""
+    chunks = _row_chunks(out.shape)
+    generators = _generators(seed, stream, len(chunks))
+    workers = min(len(chunks), workers or os.cpu_count() or 1)
+    if workers == 1:
+        list(map(func, generators, chunks))
+    else:
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(func, generators, chunks))
+    return out
+
+
+def standard_normal(shape, dtype=np.float32, seed=DEFAULT_SEED, workers=None):
+    """
+    Gaussian noise with zero mean and unit variance.
+
+    Parameters:
+    shape (tuple): Shape of the noise field.
+    dtype: float32 or float64, generated directly in this precision.
+    seed (int or numpy Generator): Source of the noise (see the module docstring).
+    workers (int): Threads generating the chunks (default: all cores).
+
+    Returns:
+    numpy array: The noise field.
+    """
+    out = np.empty(shape, dtype=dtype)
+    return _fill(out, lambda generator, rows: generator.standard_normal(out=out[rows], dtype=dtype),
+                 seed, GAUSSIAN_STREAM, workers)
+
+
+@functools.lru_cache(maxsize=8)
+def _unit_noise(shape, dtype, seed):
+    field = standard_normal(shape, dtype, seed)
+    field.flags.writeable = False  # Shared between callers through the cache
+    return field
+
+
+def unit_noise(shape, dtype=np.float32, seed=DEFAULT_SEED):
+    """``standard_normal`` of an int seed, read-only and cached per (shape, dtype, seed)."""
+    return _unit_noise(tuple(shape), np.dtype(dtype), int(seed))
+
+
+def gaussian_noise(shape, sigma, dtype=np.float32, seed=DEFAULT_SEED):
+    """
+    Additive Gaussian noise with standard deviation sigma.
+
+    For an int seed this is the cached ``unit_noise`` field scaled by sigma, so
+    changing sigma does not sample new noise.
+    """
+    if isinstance(seed, np.random.Generator):
+        field = standard_normal(shape, dtype, seed)
+        field *= sigma
+        return field
+    return np.multiply(unit_noise(shape, dtype, seed), sigma, dtype=dtype)
+
+
+def shot_noise(signal, photons, seed=DEFAULT_SEED, workers=None):
+    """
+    Poisson (shot) noise of the photons detected from a signal.
+
+    Parameters:
+    signal (numpy array): Noise-free image, e.g. the blurred object.
+    photons (float): Expected number of photons at the brightest pixel of the signal.
+    seed (int or numpy Generator): Source of the noise, an int seed gives the same
+        noise for the same signal.
+    workers (int): Threads generating the chunks (default: all cores).
+
+    Returns:
+    numpy array: The noise in the units and precision of the signal (detected photons, rescaled, minus the signal).
+    """
+    peak = np.max(signal)
+    out = np.zeros(signal.shape, dtype=np.result_type(signal.dtype, np.float32))
+    if peak <= 0:
+        return out
+    gain = photons / peak  # Photons per unit of the signal
+
+    def sample(generator, rows):
+        expected = np.maximum(signal[rows], 0) * gain
+        np.divide(generator.poisson(expected), gain, out=out[rows], casting='unsafe')
+        out[rows] -= signal[rows]
+
+    return _fill(out, sample, seed, SHOT_STREAM, workers)
+
+
+def camera_noise(signal, photons, read_noise, seed=DEFAULT_SEED, workers=None):
+    """
+    Noise of a camera: Poisson shot noise of the signal plus Gaussian read noise.
+
+    Parameters:
+    signal (numpy array): Noise-free image.
+    photons (float): Expected photons at the brightest pixel, None or 0 for read noise only.
+    read_noise (float): Standard deviation of the read noise, in units of the signal.
+    seed (int or numpy Generator): Source of the noise.
+    workers (int): Threads generating the chunks of the shot noise.
+
+    Returns:
+    numpy array: The noise component, to be added to the signal.
+    """
+    dtype = np.result_type(signal.dtype, np.float32)
+    noise = gaussian_noise(signal.shape, read_noise, dtype, seed)
+    if photons:
+        noise += shot_noise(signal, photons, seed, workers)
+    return noise
@@ -0,0 +1,207 @@
+"""Named timers around the stages of the demos, switched on by environment variables.
+
+The stages (PSF build, convolution, noise, deconvolution, normalisation,
+drawing, ...) are wrapped in ``with timer('name'):``. Profiling is off unless
+one of these environment variables is set:
+
+- ``MICROSCOPY_PROFILE=1`` - time the stages and print p50/p95/p99 latencies of
+  the last ``ROLLING_SAMPLES`` runs of every stage at exit, followed by the
+  reports registered with ``add_report`` (e.g. the statistics of a result cache).
+  ``MICROSCOPY_PROFILE=overlay`` also shows the frame rate and the stage
+  times in the corner of the figure (see ``rendering.Renderer``).
+- ``MICROSCOPY_PROFILE_TRACE=trace.json`` - write every timed stage as a JSON
+  trace at exit (Chrome trace event format, opens in chrome://tracing or Perfetto).
+- ``MICROSCOPY_PROFILE_CPROFILE=run.prof`` - run cProfile on the main (GUI)
+  thread and write its statistics at exit (``python -m pstats run.prof``).
+
+When it is off, ``timer`` returns a shared do-nothing context manager, so the
+instrumentation costs one function call per stage.
+"""
+import atexit
+import cProfile
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+_options = {option.strip() for option in os.environ.get('MICROSCOPY_PROFILE', '').split(',')} - {'', '0'}
+TRACE_PATH = os.environ.get('MICROSCOPY_PROFILE_TRACE')
+CPROFILE_PATH = os.environ.get('MICROSCOPY_PROFILE_CPROFILE')
+ENABLED = bool(_options or TRACE_PATH or CPROFILE_PATH)
+OVERLAY = 'overlay' in _options
+
+# Runs of a stage kept for its percentiles
+ROLLING_SAMPLES = 1000
+# Bound of the trace, the oldest events are dropped
+MAX_TRACE_EVENTS = 200000
+# Stage whose rate is reported as frames per second
+FRAME_STAGE = 'draw'
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        self.profiler.record(self.name, self.start, end - self.start)
+        return False
+
+
+class Profiler:
+    """
+    Rolling latencies of named stages and an optional trace of every run.
+
+    Safe to use from the GUI and the worker threads at once.
+
+    Parameters:
+    rolling (int): Runs of every stage kept for the percentiles.
+    trace (bool): Keep every run (up to MAX_TRACE_EVENTS) for ``dump_trace``.
+    """
+
+    def __init__(self, rolling=ROLLING_SAMPLES, trace=False):
+        self.rolling = rolling
+        self._samples = {}  # name -> deque of (end time, duration)
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._trace = deque(maxlen=MAX_TRACE_EVENTS) if trace else None
+        self._origin = time.perf_counter()
+
+    def timer(self, name):
+        """Context manager timing one run of the stage ``name``."""
+        return _Timer(self, name)
+
+    def record(self, name, start, duration):
+        """Add one run of a stage, started at ``start`` (perf_counter) and lasting ``duration`` seconds."""
+        with self._lock:
+            if name not in self._samples:
+                self._samples[name] = deque(maxlen=self.rolling)
+                self._counts[name] = 0
+            self._samples[name].append((start + duration, duration))
+            self._counts[name] += 1
+        if self._trace is not None:
+            self._trace.append((name, start - self._origin, duration, threading.get_ident()))
+
+    def stats(self):
+        """
+        Latencies of the recent runs of every stage.
+
+        Returns:
+        dict: name -> {'count': runs in total, 'mean', 'p50', 'p95', 'p99': milliseconds over the recent runs}.
+        """
+        with self._lock:
+            samples = {name: np.array([duration for _, duration in runs]) for name, runs in self._samples.items()}
+            counts = dict(self._counts)
+        result = {}
+        for name, durations in samples.items():
+            p50, p95, p99 = np.percentile(durations, [50, 95, 99]) * 1e3
+            result[name] = {'count': counts[name], 'mean': float(durations.mean() * 1e3),
+                            'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+        return result
+
+    def fps(self, window=2.0):
+        """Rate of the ``FRAME_STAGE`` runs that ended in the last ``window`` seconds."""
+        with self._lock:
+            ends = [end for end, _ in self._samples.get(FRAME_STAGE, ())]
+        now = time.perf_counter()
+        recent = [end for end in ends if now - end <= window]
+        if len(recent) < 2:
+            return 0.0
+        return (len(recent) - 1) / (recent[-1] - recent[0]) if recent[-1] > recent[0] else 0.0
+
+    def summary(self, percentiles=('p50', 'p95', 'p99')):
+        """Table of the stage latencies in milliseconds."""
+        lines = [f"{'stage':<12} {'runs':>6} " + ' '.join(f'{p + " [ms]":>9}' for p in percentiles)]
+        for name, stage in sorted(self.stats().items()):
+            lines.append(f"{name:<12} {stage['count']:>6} " + ' '.join(f'{stage[p]:>9.2f}' for p in percentiles))
+        return '\n'.join(lines)
+
+    def overlay_text(self):
+        """Frame rate and the median/p95 of every stage, for drawing on the figure."""
+        lines = [f'{self.fps():.1f} fps']
+        for name, stage in sorted(self.stats().items()):
+            lines.append(f"{name:<11}{stage['p50']:7.1f}{stage['p95']:7.1f} ms")
+        return '\n'.join(lines)
+
+    def dump_trace(self, path):
+        """Write the recorded runs as Chrome trace events, with the stage statistics."""
+        pid = os.getpid()
+        events = [{'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6, 'pid': pid, 'tid': thread}
+                  for name, start, duration, thread in list(self._trace or ())]
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'stages': self.stats()}, file)
+
+
+profiler = Profiler(trace=bool(TRACE_PATH)) if ENABLED else None
+# Callables returning extra sections of the exit report
+_reports = []
+
+
+def add_report(report):
+    """Print ``report()``, a text, after the stage latencies at exit; nothing happens if profiling is off."""
+    if profiler is not None:
+        _reports.append(report)
+
+
+def timer(name):
+    """Time the stage ``name`` with the global profiler, or do nothing if profiling is off."""
+    if profiler is None:
+        return _NULL_TIMER
+    return profiler.timer(name)
+
+
+def timed_iter(name, iterator):
+    """The items of an iterator, timing the production of every item as a run of ``name``."""
+    if profiler is None:
+        return iterator
+    return _timed_iter(name, iter(iterator))
+
+
+def _timed_iter(name, iterator):
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        profiler.record(name, start, time.perf_counter() - start)
+        yield item
+
+
+def _report(profile):
+    if profile is not None:
+        profile.disable()
+        profile.dump_stats(CPROFILE_PATH)
+    if TRACE_PATH:
+        profiler.dump_trace(TRACE_PATH)
+    if profiler.stats():
+        print(profiler.summary())
+    for report in _reports:
+        print(report())
+
+
+if ENABLED:
+    _profile = None
+    if CPROFILE_PATH:
+        _profile = cProfile.Profile()
+        _profile.enable()
+    atexit.register(_report, _profile)
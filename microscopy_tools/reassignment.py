@@ -0,0 +1,184 @@
+"""Pixel reassignment (image scanning microscopy, as in AiryScan or OPRA).
+
+The object is scanned with a Gaussian excitation spot and the emission is
+recorded by an N x N array of detector elements. The element at offset d
+(in pixels of the object, already scaled by the magnification) sees the
+effective PSF
+
+    h_d(x) = h_exc(x) * h_det(x - d),
+
+which for Gaussians is a narrower Gaussian centred at ``factor * d`` with
+factor = sigma_exc^2 / (sigma_exc^2 + sigma_det^2) - halfway between the
+spots for equal sigmas, as in the misalignment demo. Shifting every detector
+image back by ``factor * d`` and summing gives the reassigned image, which is
+as bright as the open-pinhole confocal image but sharper.
+
+Everything runs in the Fourier domain. The effective PSFs are known in closed
+form, so a detector image costs one multiply and one inverse FFT, and a shift
+is a phase ramp - the product of a column and a row vector. The detector
+elements are processed in batches (one batched FFT per batch) on a thread pool.
+"""
+import math
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import fft
+
+from .workspace import real_dtype
+
+Reassignment = namedtuple('Reassignment', ['pinhole', 'confocal', 'reassigned'])
+Reassignment.__doc__ = """Images of one scan: closed pinhole (element nearest the centre), open pinhole (sum of all elements), reassigned."""
+
+
+def detector_offsets(n_detectors, pitch):
+    """(dy, dx) offsets of the elements of an n_detectors x n_detectors array, centred on zero."""
+    positions = (np.arange(n_detectors) - (n_detectors - 1) / 2) * pitch
+    dy, dx = np.meshgrid(positions, positions, indexing='ij')
+    return np.column_stack([dy.ravel(), dx.ravel()])
+
+
+class PixelReassignment:
+    """
+    Simulation of a scan with a detector array and its reassignment.
+
+    Parameters:
+    sigma_excitation (float): Sigma of the excitation PSF in pixels.
+    sigma_detection (float): Sigma of the detection PSF in pixels, the same as the excitation by default.
+    n_detectors (int): Number of detector elements along each side of the array.
+    pitch (float): Distance of neighbouring detector elements in pixels.
+    workers (int): Threads processing batches of detector elements (default: all cores).
+    batch_size (int): Detector elements per batched FFT (default: the elements split evenly between the workers).
+    precision (str): Precision of the computation (see microscopy_tools.workspace).
+    """
+
+    def __init__(self, sigma_excitation, sigma_detection=None, n_detectors=5, pitch=1.0,
+                 workers=None, batch_size=None, precision=None):
+        self.sigma_excitation = sigma_excitation
+        self.sigma_detection = sigma_excitation if sigma_detection is None else sigma_detection
+        self.offsets = detector_offsets(n_detectors, pitch)
+        self.n_elements = len(self.offsets)
+        # Closed pinhole reference: the element nearest the optical axis (one of the
+        # four middle elements of an even array, which has none on the axis)
+        self.central = int(np.argmin((self.offsets**2).sum(axis=1)))
+        self.dtype = real_dtype(precision)
+
+        variance_sum = self.sigma_excitation**2 + self.sigma_detection**2
+        self.factor = self.sigma_excitation**2 / variance_sum
+        self.sigma_effective = self.sigma_excitation * self.sigma_detection / math.sqrt(variance_sum)
+        # Peak of h_exc * h_det(. - d) relative to d = 0, the signal of the outer elements drops
+        self.amplitudes = np.exp(-(self.offsets**2).sum(axis=1) / (2 * variance_sum)).astype(self.dtype)
+        self.shifts = self.factor * self.offsets
+
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size or max(1, math.ceil(self.n_elements / self.workers))
+        self._padding = math.ceil(4 * self.sigma_effective + np.abs(self.shifts).max()) + 1
+        self._frequencies = {}
+
+    def padded_shape(self, shape):
+        """FFT shape leaving room for the PSF and the shifts, so nothing wraps around."""
+        return tuple(fft.next_fast_len(n + self._padding, real=True) for n in shape)
+
+    def _frequency_grid(self, padded_shape):
+        """Frequencies (cycles per pixel) of the rfft2 layout and the effective OTF, cached per shape."""
+        if padded_shape not in self._frequencies:
+            ky = fft.fftfreq(padded_shape[0]).astype(self.dtype)
+            kx = fft.rfftfreq(padded_shape[1]).astype(self.dtype)
+            otf = np.exp(-2 * np.pi**2 * self.sigma_effective**2 * (ky[:, None]**2 + kx[None, :]**2))
+            self._frequencies[padded_shape] = ky, kx, otf.astype(self.dtype)
+        return self._frequencies[padded_shape]
+
+    def _phase_ramps(self, elements, padded_shape, sign):
+        """exp(sign * 2 pi i k . shift) of the given elements, shape (len(elements), ky, kx)."""
+        ky, kx, _ = self._frequency_grid(padded_shape)
+        shifts = self.shifts[elements]
+        ramp_y = np.exp(sign * 2j * np.pi * np.outer(shifts[:, 0], ky))
+        ramp_x = np.exp(sign * 2j * np.pi * np.outer(shifts[:, 1], kx))
+        return ramp_y[:, :, None].astype(np.result_type(self.dtype, np.complex64)) * ramp_x[:, None, :]
+
+    def _batches(self):
+        return [np.arange(start, min(start + self.batch_size, self.n_elements))
+                for start in range(0, self.n_elements, self.batch_size)]
+
+    def _scan_batch(self, spectrum, shape, elements, noise, rng):
+        padded_shape = self.padded_shape(shape)
+        otf = self._frequency_grid(padded_shape)[2]
+        # Detector image d is obj correlated with h_d, i.e. obj * h shifted by -factor * d
+        spectra = self._phase_ramps(elements, padded_shape, +1)
+        spectra *= spectrum * otf
+        spectra *= self.amplitudes[elements, None, None]
+        images = fft.irfft2(spectra, s=padded_shape, workers=1, overwrite_x=True)[:, :shape[0], :shape[1]]
+        if noise:
+            images += noise * rng.standard_normal(images.shape, dtype=self.dtype)
+        return images
+
+    def _reassign_batch(self, images, elements):
+        padded_shape = self.padded_shape(images.shape[1:])
+        spectra = fft.rfft2(images, s=padded_shape, workers=1)
+        spectra *= self._phase_ramps(elements, padded_shape, -1)
+        return spectra.sum(axis=0)
+
+    def _map(self, func, *iterables):
+        if self.workers == 1:
+            return list(map(func, *iterables))
+        with ThreadPoolExecutor(self.workers) as pool:
+            return list(pool.map(func, *iterables))
+
+    def _spawn(self, rng, n):
+        if rng is None:
+            rng = np.random.default_rng()
+        return rng.spawn(n)
+
+    def scan(self, obj, noise=0.0, rng=None):
+        """
+        Record the detector images of a scan of the object.
+
+        Parameters:
+        obj (numpy array): 2D object image.
+        noise (float): Standard deviation of the additive noise of every element.
+        rng (numpy Generator): Source of the noise, independent streams are spawned for the batches.
+
+        Returns:
+        numpy array: Detector images, shape (n_elements, height, width).
+        """
+        obj = np.asarray(obj, dtype=self.dtype)
+        spectrum = fft.rfft2(obj, s=self.padded_shape(obj.shape), workers=-1)
+        batches = self._batches()
+        images = self._map(lambda elements, rng: self._scan_batch(spectrum, obj.shape, elements, noise, rng),
+                           batches, self._spawn(rng, len(batches)))
+        return np.concatenate(images)
+
+    def reassign(self, detector_images):
+        """Shift every detector image by -factor * offset and sum them."""
+        shape = detector_images.shape[1:]
+        spectra = self._map(lambda elements: self._reassign_batch(detector_images[elements], elements), self._batches())
+        return fft.irfft2(sum(spectra), s=self.padded_shape(shape), workers=-1)[:shape[0], :shape[1]]
+
+    def reconstruct(self, obj, noise=0.0, rng=None):
+        """
+        Scan the object and reassign, without keeping all detector images in memory.
+
+        Parameters:
+        obj (numpy array): 2D object image.
+        noise (float): Standard deviation of the additive noise of every element.
+        rng (numpy Generator): Source of the noise.
+
+        Returns:
+        Reassignment: Closed pinhole, open pinhole and reassigned images.
+        """
+        obj = np.asarray(obj, dtype=self.dtype)
+        padded_shape = self.padded_shape(obj.shape)
+        spectrum = fft.rfft2(obj, s=padded_shape, workers=-1)
+
+        def process(elements, rng):
+            images = self._scan_batch(spectrum, obj.shape, elements, noise, rng)
+            pinhole = images[elements.tolist().index(self.central)].copy() if self.central in elements else None
+            return pinhole, images.sum(axis=0), self._reassign_batch(images, elements)
+
+        batches = self._batches()
+        results = self._map(process, batches, self._spawn(rng, len(batches)))
+        pinhole = next(result[0] for result in results if result[0] is not None)
+        confocal = sum(result[1] for result in results)
+        reassigned = fft.irfft2(sum(result[2] for result in results), s=padded_shape, workers=-1)
+        return Reassignment(pinhole, confocal, reassigned[:obj.shape[0], :obj.shape[1]])
@@ -0,0 +1,148 @@
+"""Rendering helpers shared by the visualization scripts.
+
+Calling ``ax.imshow`` on every update stacks a new AxesImage on the axes, so
+memory and redraw time grow with every interaction. Instead each image is
+created once as an ``ImagePanel`` and updated in place with set_data/set_clim.
+
+``Renderer`` redraws the changed artists with blitting: the background of every
+managed axes is cached on each full draw, and an update only restores the
+background of the changed axes, redraws their artists and blits those axes.
+When blitting is not possible (no cached background yet, a backend without
+blitting, or an axes whose limits changed) it falls back to ``draw_idle``.
+Refreshes are timed as the 'draw' stage of ``microscopy_tools.profiling``, and
+with ``MICROSCOPY_PROFILE=overlay`` the frame rate and the stage times are
+shown in the first axes of the figure.
+"""
+import time
+
+import numpy as np
+
+from . import profiling
+
+# Seconds between updates of the profiling overlay
+OVERLAY_INTERVAL = 0.5
+
+
+class ImagePanel:
+    """
+    An image artist that is created once and updated in place.
+
+    Parameters:
+    ax (Axes): Axes to draw the image in.
+    data (numpy array): Initial image.
+    **imshow_kwargs: Passed to ``ax.imshow``, e.g. cmap or origin.
+    """
+
+    def __init__(self, ax, data, **imshow_kwargs):
+        imshow_kwargs.setdefault('cmap', 'gray')
+        self.ax = ax
+        self.artist = ax.imshow(data, **imshow_kwargs)
+        self.shape = np.shape(data)
+        self.needs_full_draw = False
+
+    def update(self, data, clim=None, extent=None, autoscale=True):
+        """
+        Replace the image data.
+
+        Parameters:
+        data (numpy array): The new image.
+        clim (tuple): Colour limits, the data range by default (like a new imshow).
+        extent (tuple): Image extent; by default reset to the pixel grid when the shape changes.
+        autoscale (bool): If False and no clim is given, keep the current colour limits.
+        """
+        self.artist.set_data(data)
+        if clim is not None:
+            self.artist.set_clim(*clim)
+        elif autoscale:
+            self.artist.autoscale()  # Finite data range, as imshow does
+
+        if extent is None and np.shape(data) != self.shape:
+            height, width = np.shape(data)[:2]
+            if self.artist.origin == 'lower':
+                extent = (-0.5, width - 0.5, -0.5, height - 0.5)
+            else:
+                extent = (-0.5, width - 0.5, height - 0.5, -0.5)
+            self.ax.set_xlim(extent[0], extent[1])
+            self.ax.set_ylim(extent[2], extent[3])
+            # New axes limits invalidate the cached background
+            self.needs_full_draw = True
+        if extent is not None:
+            self.artist.set_extent(extent)
+        self.shape = np.shape(data)
+
+
+class Renderer:
+    """
+    Blitting redraw of the artists that change during the interaction.
+
+    Parameters:
+    fig (Figure): The figure of the script.
+    blit (bool): Use blitting when the backend supports it, otherwise always ``draw_idle``.
+    """
+
+    def __init__(self, fig, blit=True):
+        self.fig = fig
+        self.canvas = fig.canvas
+        self.blit = blit and self.canvas.supports_blit
+        self._artists = {}  # axes -> its animated artists
+        self._backgrounds = {}
+        self.cid = self.canvas.mpl_connect('draw_event', self._on_draw)
+        self.overlay = None
+        if profiling.OVERLAY and fig.axes:
+            ax = fig.axes[0]
+            self.overlay = ax.text(0.01, 0.99, '', transform=ax.transAxes, va='top', fontsize=7, family='monospace',
+                                   color='lime', bbox=dict(facecolor='black', alpha=0.6), zorder=10)
+            self.add_artist(self.overlay)
+            self._overlay_updated = 0.0
+
+    def image(self, ax, data, **imshow_kwargs):
+        """Create a managed ``ImagePanel`` on ``ax``."""
+        panel = ImagePanel(ax, data, **imshow_kwargs)
+        self.add_artist(panel.artist)
+        return panel
+
+    def add_artist(self, artist):
+        """Manage an existing artist (line, scatter, text, ...) of one of the figure's axes."""
+        if self.blit:
+            # Animated artists are skipped by full draws and drawn by _on_draw on top of the background
+            artist.set_animated(True)
+        self._artists.setdefault(artist.axes, []).append(artist)
+
+    def _on_draw(self, event):
+        if not self.blit:
+            return
+        self._backgrounds = {ax: self.canvas.copy_from_bbox(ax.bbox) for ax in self._artists}
+        for artists in self._artists.values():
+            for artist in artists:
+                self.fig.draw_artist(artist)
+
+    def refresh(self, *items):
+        """
+        Redraw the axes of the given artists or panels.
+
+        Parameters:
+        *items: Changed artists or ImagePanels, all managed axes if none are given.
+        """
+        with profiling.timer('draw'):
+            self._refresh(items)
+
+    def _refresh(self, items):
+        if self.overlay is not None and items and time.perf_counter() - self._overlay_updated > OVERLAY_INTERVAL:
+            self.overlay.set_text(profiling.profiler.overlay_text())
+            self._overlay_updated = time.perf_counter()
+            items += (self.overlay,)
+        panels = [item for item in items if isinstance(item, ImagePanel)]
+        full_draw = any(panel.needs_full_draw for panel in panels)
+        for panel in panels:
+            panel.needs_full_draw = False
+        axes = {item.ax if isinstance(item, ImagePanel) else item.axes for item in items} or set(self._artists)
+        if not self.blit or full_draw or not axes <= self._backgrounds.keys():
+            self.canvas.draw_idle()
+            return
+
+        for ax in axes:
+            self.canvas.restore_region(self._backgrounds[ax])
+            for artist in self._artists[ax]:
+                self.fig.draw_artist(artist)
+            self.canvas.blit(ax.bbox)
+        self.canvas.flush_events()
@@ -0,0 +1,152 @@
+"""Richardson-Lucy deconvolution with FFT convolutions, acceleration and early stopping.
+
+Every iteration of ``skimage.restoration.richardson_lucy`` performs two
+spatial convolutions. Here the transfer functions of the PSF and of its mirror
+are computed once (and cached per PSF and image shape), so that an iteration
+costs two forward and two inverse real FFTs. The convolutions are linear
+('same' mode, zero boundary), so the plain iteration gives the skimage result.
+
+On top of that:
+
+- Biggs-Andrews acceleration: the next iteration starts from the current
+  estimate extrapolated along the last step, by a factor computed from the
+  correlation of the last two steps (D.S.C. Biggs and M. Andrews, Applied
+  Optics 36, 1997). It typically reaches the same quality in a fraction of
+  the iterations. Noisy data can make the extrapolation overshoot; then the
+  misfit of the reblurred estimate grows and the acceleration restarts.
+- Early stopping once the relative change of the estimate drops below a tolerance.
+- ``iterate_richardson_lucy`` is a generator yielding the estimate every few
+  iterations, to show the convergence while it runs.
+"""
+import functools
+from collections import namedtuple
+
+import numpy as np
+from scipy import fft
+
+# Small regularization parameter used to avoid 0 divisions, as in skimage
+EPSILON = 1e-12
+
+RLState = namedtuple('RLState', ['iteration', 'estimate', 'change', 'misfit', 'converged'])
+RLState.__doc__ = """Progress of Richardson-Lucy: iterations done, current estimate, relative change of the
+last step, L2 misfit of the reblurred estimate the last step started from, stopped early."""
+
+
+@functools.lru_cache(maxsize=16)
+def _transfer_functions(psf_bytes, psf_shape, dtype, padded_shape):
+    psf = np.frombuffer(psf_bytes, dtype=dtype).reshape(psf_shape)
+    otf = fft.rfftn(psf, s=padded_shape)
+    otf_mirror = fft.rfftn(np.flip(psf), s=padded_shape)
+    return otf, otf_mirror
+
+
+class _Convolver:
+    """'same' mode FFT convolutions with a PSF and its mirror, on a fixed image shape."""
+
+    def __init__(self, psf, image_shape):
+        self.image_shape = image_shape
+        self.padded_shape = tuple(fft.next_fast_len(n + m - 1, real=True) for n, m in zip(image_shape, psf.shape))
+        psf = np.ascontiguousarray(psf)
+        self.otf, self.otf_mirror = _transfer_functions(psf.tobytes(), psf.shape, psf.dtype, self.padded_shape)
+        self.crop = tuple(slice((m - 1) // 2, (m - 1) // 2 + n) for n, m in zip(image_shape, psf.shape))
+
+    def _apply(self, image, otf):
+        spectrum = fft.rfftn(image, s=self.padded_shape, workers=-1)
+        spectrum *= otf
+        return fft.irfftn(spectrum, s=self.padded_shape, workers=-1, overwrite_x=True)[self.crop]
+
+    def convolve(self, image):
+        return self._apply(image, self.otf)
+
+    def correlate(self, image):
+        return self._apply(image, self.otf_mirror)
+
+
+def iterate_richardson_lucy(image, psf, num_iter=50, accelerate=True, tol=None, report_every=None,
+                            clip=True, filter_epsilon=None):
+    """
+    Richardson-Lucy deconvolution as a generator of intermediate results.
+
+    Parameters:
+    image (numpy array): The blurred image (any number of dimensions).
+    psf (numpy array): The PSF.
+    num_iter (int): Maximum number of iterations.
+    accelerate (bool): Use the Biggs-Andrews vector extrapolation.
+    tol (float): Stop when the relative change of the estimate (L2 norm) drops below tol; never if None.
+    report_every (int): Yield the estimate every report_every iterations; only the final one if None.
+    clip (bool): Clip the yielded estimates to [-1, 1], as skimage does.
+    filter_epsilon (float): Values of the reblurred estimate below it give zero ratios, as in skimage.
+
+    Yields:
+    RLState: The progress; the estimate is a new array each time. The last state is the final result.
+    """
+    float_type = np.result_type(image.dtype, np.float32)
+    image = np.asarray(image, dtype=float_type)
+    psf = np.asarray(psf, dtype=float_type)
+    convolver = _Convolver(psf, image.shape)
+
+    def update(estimate):
+        """One multiplicative Richardson-Lucy update, and the misfit of the reblurred estimate."""
+        reblurred = convolver.convolve(estimate)
+        reblurred += EPSILON
+        misfit = float(np.linalg.norm(reblurred - image))
+        if filter_epsilon:
+            ratio = np.where(reblurred < filter_epsilon, 0, image / reblurred)
+        else:
+            ratio = np.divide(image, reblurred, out=reblurred)
+        return estimate * convolver.correlate(ratio), misfit
+
+    def state(iteration, converged):
+        result = estimate.copy()
+        if clip:
+            np.clip(result, -1, 1, out=result)
+        return RLState(iteration, result, change, misfit, converged)
+
+    estimate = np.full(image.shape, 0.5, dtype=float_type)
+    prediction = estimate
+    previous_step = None
+    misfit = np.inf
+    for iteration in range(1, num_iter + 1):
+        previous_misfit = misfit
+        new_estimate, misfit = update(prediction)
+        norm = np.linalg.norm(estimate)
+        change = float(np.linalg.norm(new_estimate - estimate) / norm) if norm else np.inf
+
+        if accelerate:
+            step = new_estimate - prediction
+            alpha = 0.0
+            if misfit > previous_misfit:
+                previous_step = None  # The extrapolation overshot the data, restart from a plain step
+            if previous_step is not None:
+                denominator = np.vdot(previous_step, previous_step)
+                if denominator > 0:
+                    alpha = float(np.clip(np.vdot(step, previous_step) / denominator, 0, 1))
+            prediction = new_estimate + alpha * (new_estimate - estimate)
+            # Extrapolation must not change the sign of a pixel (a multiplicative update cannot undo it)
+            np.copyto(prediction, new_estimate, where=(prediction * new_estimate) < 0)
+            previous_step = step
+        else:
+            prediction = new_estimate
+        estimate = new_estimate
+
+        converged = tol is not None and change < tol
+        if converged or iteration == num_iter:
+            yield state(iteration, converged)
+            return
+        if report_every and iteration % report_every == 0:
+            yield state(iteration, False)
+
+
+def richardson_lucy(image, psf, num_iter=50, accelerate=False, tol=None, clip=True, filter_epsilon=None):
+    """
+    Richardson-Lucy deconvolution, see ``iterate_richardson_lucy``.
+
+    With the defaults this is ``skimage.restoration.richardson_lucy`` computed with FFTs.
+
+    Returns:
+    numpy array: The deconvolved image.
+    """
+    for result in iterate_richardson_lucy(image, psf, num_iter, accelerate, tol, clip=clip,
+                                          filter_epsilon=filter_epsilon):
+        pass
+    return result.estimate
@@ -0,0 +1,220 @@
+"""Pixel sampling (camera binning) of an image.
+
+``bin_image`` reduces blocks of pixel_size x pixel_size pixels with reshapes
+instead of Python loops. Pixel sizes that do not divide the image are handled
+by padding the image with its edge values. The binned image is not upsampled
+back; it is displayed with ``imshow(..., extent=binned_extent(...))`` so that
+matplotlib draws every binned pixel as a pixel_size wide block.
+
+With a ``Workspace`` (microscopy_tools.workspace) the padded image and the
+result are written into reused buffers, so moving the slider back and forth
+does not allocate new images.
+
+``SamplingPyramid`` serves the binned images of one image for every pixel
+size and grid offset from a summed-area table, caching each level, and
+``spectral_energy_lost`` measures how much of the image a pixel size cannot
+represent (its energy above the Nyquist frequency).
+"""
+import numpy as np
+from scipy import fft
+
+from .workspace import real_dtype
+
+BINNING_MODES = ('mean', 'sum', 'max')
+
+
+def bin_image(image, pixel_size, mode='mean', workspace=None):
+    """
+    Bin an image into blocks of pixel_size x pixel_size pixels.
+
+    Parameters:
+    image (numpy array): The input 2D image.
+    pixel_size (int): Size of the new pixel in pixels of the input image.
+    mode (str): 'mean' (averaging), 'sum' (camera binning, signal adds up) or 'max'.
+    workspace (Workspace): Buffers for the padded and binned image; the result is
+        overwritten by the next call with the same workspace.
+
+    Returns:
+    numpy array: The binned image of shape ceil(shape / pixel_size).
+    """
+    if mode not in BINNING_MODES:
+        raise ValueError(f"Unknown binning mode {mode!r}, choose from {BINNING_MODES}")
+    pixel_size = int(pixel_size)
+    if pixel_size <= 1:
+        return image
+    height, width = image.shape
+    pad_y = -height % pixel_size
+    pad_x = -width % pixel_size
+    if pad_y or pad_x:
+        if workspace is None:
+            image = np.pad(image, ((0, pad_y), (0, pad_x)), mode='edge')
+        else:
+            padded = workspace.buffer('bin_padded', (height + pad_y, width + pad_x), image.dtype)
+            padded[:height, :width] = image
+            padded[height:, :width] = image[-1]
+            padded[:, width:] = padded[:, width - 1:width]
+            image = padded
+    blocks = image.reshape(image.shape[0] // pixel_size, pixel_size, image.shape[1] // pixel_size, pixel_size)
+    out = None
+    if workspace is not None:
+        out = workspace.buffer('binned', (blocks.shape[0], blocks.shape[2]), image.dtype)
+    return getattr(blocks, mode)(axis=(1, 3), out=out)
+
+
+def binned_extent(binned_shape, pixel_size, offset=0):
+    """
+    imshow extent (left, right, bottom, top) placing a binned image over the original pixel grid.
+
+    ``offset`` is the shift of the sampling grid of a ``SamplingPyramid`` level,
+    whose first binned pixel starts ``offset`` pixels before the image.
+    """
+    start = -0.5 - offset
+    return (start, start + binned_shape[1] * pixel_size, start, start + binned_shape[0] * pixel_size)
+
+
+def _first_lost(n, k):
+    """Smallest pixel size whose Nyquist frequency 1/(2p) is below k/n cycles per pixel, for the indices k >= 0."""
+    # k/n > 1/(2p) <=> p > n/(2k), in integers; the zero frequency is never lost
+    return np.where(k > 0, n // np.maximum(2 * k, 1) + 1, np.iinfo(np.int64).max)
+
+
+def spectral_energy_lost(image, pixel_sizes):
+    """
+    Fraction of the spectral energy of an image above the Nyquist frequency of each pixel size.
+
+    Pixels of size p sample the image at 1/p, so the frequencies above 1 / (2p)
+    cycles per pixel along either axis cannot be represented (they alias). The
+    power spectrum (without the mean) is computed once, every coefficient is
+    binned by the smallest pixel size that loses it, and a cumulative sum of
+    the bins gives the metric of all pixel sizes in one pass.
+
+    Parameters:
+    image (numpy array): 2D image.
+    pixel_sizes (array_like): Pixel sizes (int) in pixels of the image.
+
+    Returns:
+    numpy array: Fraction of the energy lost for each pixel size, 0 for an empty image.
+    """
+    image = np.asarray(image, dtype=np.float64)
+    height, width = image.shape
+    pixel_sizes = np.asarray(pixel_sizes, dtype=np.int64)
+    power = np.abs(fft.rfft2(image - image.mean(), workers=-1))**2
+    # rfft2 keeps the non-negative x frequencies, the negative ones are the conjugates of columns 1..(W-1)//2
+    power[:, 1:(width + 1) // 2] *= 2
+    n_bins = int(pixel_sizes.max(initial=1)) + 2
+    rows = np.arange(height)
+    first_lost = np.minimum(_first_lost(height, np.minimum(rows, height - rows))[:, None],
+                            _first_lost(width, np.arange(width // 2 + 1))[None, :])
+    lost = np.cumsum(np.bincount(np.minimum(first_lost, n_bins - 1).ravel(), weights=power.ravel(),
+                                 minlength=n_bins))
+    total = power.sum()
+    if total <= 0:
+        return np.zeros(pixel_sizes.shape)
+    return lost[pixel_sizes] / total
+
+
+def _extended_prefix(prefix, first, last, index, length):
+    """
+    Prefix sums of an axis padded with its edge values, at any (also negative) index.
+
+    ``prefix`` holds the prefix sums of the axis (leading 0) along axis 0, and
+    ``first``/``last`` the edge values they are extended with.
+    """
+    inside = np.clip(index, 0, length)
+    before = np.minimum(index, 0).reshape((-1,) + (1,) * (prefix.ndim - 1))
+    after = np.maximum(index - length, 0).reshape(before.shape)
+    return prefix[inside] + before * first + after * last
+
+
+class SamplingPyramid:
+    """
+    Binned images of one image for every pixel size and grid offset, from a summed-area table.
+
+    The summed-area table (integral image) of the image is computed once. The
+    sum of any block is then four lookups of the table, so a level costs
+    O(binned pixels) whatever the pixel size, and the sampling grid can start at
+    any ``offset`` - the phase of the grid, which changes what the binned image
+    shows of details near the pixel size (aliasing). Blocks beyond the image
+    see it padded with its edge values, as in ``bin_image``; the table is
+    extended over the padding analytically instead of being padded. 'max'
+    binning has no summed-area form, its levels reduce blocks of the padded image.
+
+    Every level is cached read-only, so returning to a pixel size or offset
+    swaps in a stored array; build a new pyramid when the image changes.
+    ``energy_lost`` of all pixel sizes is computed with the table.
+
+    Parameters:
+    image (numpy array): 2D image.
+    max_pixel_size (int): Largest pixel size (default: the larger side of the image).
+    precision (str): Precision of the levels (see microscopy_tools.workspace).
+    """
+
+    def __init__(self, image, max_pixel_size=None, precision=None):
+        self.dtype = real_dtype(precision)
+        self.image = image = np.asarray(image, dtype=self.dtype)
+        self.shape = image.shape
+        self.max_pixel_size = int(max_pixel_size or max(self.shape))
+        # Block sums are differences of large partial sums, which float64 keeps exact enough
+        self._integral = np.zeros((self.shape[0] + 1, self.shape[1] + 1))
+        np.cumsum(np.cumsum(image, axis=0, dtype=np.float64), axis=1, out=self._integral[1:, 1:])
+        # Prefix sums of the first and last column and the first and last row, for the padding
+        self._column_prefix = np.zeros((self.shape[0] + 1, 2))
+        np.cumsum(image[:, [0, -1]], axis=0, dtype=np.float64, out=self._column_prefix[1:])
+        self._row_prefix = np.zeros((2, self.shape[1] + 1))
+        np.cumsum(image[[0, -1]], axis=1, dtype=np.float64, out=self._row_prefix[:, 1:])
+        self._levels = {}
+        self._energy_lost = spectral_energy_lost(image, np.arange(1, self.max_pixel_size + 1))
+
+    def energy_lost(self, pixel_size):
+        """Fraction of the spectral energy above the Nyquist frequency of the pixel size (see ``spectral_energy_lost``)."""
+        return float(self._energy_lost[int(pixel_size) - 1])
+
+    def level(self, pixel_size, offset=0, mode='mean'):
+        """
+        The image binned into blocks of pixel_size x pixel_size pixels.
+
+        Parameters:
+        pixel_size (int): Size of the new pixel, 1 to ``max_pixel_size``.
+        offset (int): Shift of the sampling grid in pixels of the image, taken modulo the pixel
+            size; the first block starts ``offset`` pixels before the image (see ``binned_extent``).
+        mode (str): 'mean', 'sum' or 'max', as in ``bin_image``.
+
+        Returns:
+        numpy array: Read-only binned image of shape ceil((shape + offset) / pixel_size);
+        equal to ``bin_image`` for offset 0.
+        """
+        if mode not in BINNING_MODES:
+            raise ValueError(f"Unknown binning mode {mode!r}, choose from {BINNING_MODES}")
+        pixel_size = int(pixel_size)
+        if not 1 <= pixel_size <= self.max_pixel_size:
+            raise ValueError(f"Pixel size {pixel_size} outside 1..{self.max_pixel_size}")
+        key = (pixel_size, int(offset) % pixel_size, mode)
+        if key not in self._levels:
+            level = self._bin(*key)
+            level.flags.writeable = False
+            self._levels[key] = level
+        return self._levels[key]
+
+    def _table(self, rows, cols):
+        """Summed-area table of the edge-padded image at the given row and column edges (image coordinates)."""
+        height, width = self.shape
+        # Extended over the rows: sums above every row edge, left of the column edges 0..width
+        row_sums = _extended_prefix(self._integral, self._row_prefix[0], self._row_prefix[1], rows, height)
+        # Then over the columns, the padding repeats the first and last column summed above every row edge
+        corners = self.image[[0, -1]][:, [0, -1]].astype(np.float64)
+        edge_columns = _extended_prefix(self._column_prefix, corners[0], corners[1], rows, height)
+        return _extended_prefix(row_sums.T, edge_columns[:, 0], edge_columns[:, 1], cols, width).T
+
+    def _bin(self, pixel_size, offset, mode):
+        n_rows = -(-(self.shape[0] + offset) // pixel_size)
+        n_cols = -(-(self.shape[1] + offset) // pixel_size)
+        rows = pixel_size * np.arange(n_rows + 1) - offset
+        cols = pixel_size * np.arange(n_cols + 1) - offset
+        if mode == 'max':
+            padded = np.pad(self.image, ((offset, rows[-1] - self.shape[0]), (offset, cols[-1] - self.shape[1])),
+                            mode='edge')
+            return padded.reshape(n_rows, pixel_size, n_cols, pixel_size).max(axis=(1, 3))
+        sums = np.diff(np.diff(self._table(rows, cols), axis=0), axis=1)
+        if mode == 'mean':
+            sums /= pixel_size**2
+        return sums.astype(self.dtype)
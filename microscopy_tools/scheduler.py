@@ -0,0 +1,125 @@
+"""Background computation for slider-driven updates.
+
+Slider callbacks fire for every intermediate value of a drag. ``LatestJobScheduler``
+runs the computations on one worker thread and only ever keeps the latest
+request: a job submitted while another is waiting replaces it, so intermediate
+slider values are coalesced. Results are handed back on the GUI thread through
+a canvas timer. A result older than the one already shown is discarded, and so
+is the result of a superseded job (a newer one was submitted), unless the job
+was submitted with ``show_stale``: quick previews during a drag are still
+shown while newer ones are computed, so the figure keeps following the slider.
+
+A job may also be a generator function. Each yielded value is posted to the
+figure as an intermediate result, and the generator is abandoned as soon as a
+newer job is submitted, which cancels long iterative computations mid-way.
+
+Without a GUI event loop (e.g. the Agg backend) there are no timers, so the
+jobs run synchronously in ``submit``.
+"""
+import inspect
+import queue
+import threading
+
+from matplotlib.backend_bases import TimerBase
+
+
+class LatestJobScheduler:
+    """
+    Runs the latest submitted job on a worker thread.
+
+    Parameters:
+    canvas (FigureCanvas): Canvas whose timer delivers results on the GUI thread.
+    interval (int): Polling interval of the result timer in milliseconds.
+    """
+
+    def __init__(self, canvas, interval=20):
+        self._timer = canvas.new_timer(interval=interval)
+        self._timer.add_callback(self.poll)
+        # Plain TimerBase means there is no event loop to deliver results
+        self.synchronous = type(self._timer) is TimerBase
+        self._condition = threading.Condition()
+        self._next_job = None
+        self._generation = 0  # Id of the latest submitted job
+        self._shown = 0  # Id of the job whose result was posted last
+        self._busy = False
+        self._results = queue.SimpleQueue()
+        self._worker = None
+
+    def submit(self, func, *args, on_result, show_stale=False, **kwargs):
+        """
+        Schedule ``func(*args, **kwargs)``, replacing any job that has not started yet.
+
+        Parameters:
+        func (callable): The computation, or a generator function yielding intermediate results.
+        on_result (callable): Called with every result on the GUI thread.
+        show_stale (bool): Still show the results once a newer job has been submitted
+            (if no newer result is shown yet), e.g. for previews.
+        """
+        with self._condition:
+            self._generation += 1
+            job = (self._generation, func, args, kwargs, on_result, show_stale)
+            if self.synchronous:
+                self._run(job)
+                self.poll()
+                return
+            self._next_job = job
+            self._condition.notify()
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._work, name='LatestJobScheduler', daemon=True)
+            self._worker.start()
+        self._timer.start()
+
+    def is_stale(self, generation):
+        """True if a newer job than ``generation`` has been submitted."""
+        return generation != self._generation
+
+    @property
+    def idle(self):
+        return self._next_job is None and not self._busy and self._results.empty()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while self._next_job is None:
+                    self._condition.wait()
+                job, self._next_job = self._next_job, None
+                self._busy = True
+            try:
+                self._run(job)
+            finally:
+                self._busy = False
+
+    def _run(self, job):
+        generation, func, args, kwargs, on_result, show_stale = job
+        try:
+            if inspect.isgeneratorfunction(func):
+                for result in func(*args, **kwargs):
+                    stale = self.is_stale(generation)
+                    if not stale or show_stale:
+                        self._results.put((generation, on_result, result, show_stale))
+                    if stale:
+                        break
+            else:
+                result = func(*args, **kwargs)
+                if show_stale or not self.is_stale(generation):
+                    self._results.put((generation, on_result, result, show_stale))
+        except Exception as error:  # Re-raised on the GUI thread
+            self._results.put((generation, None, error, True))
+
+    def poll(self):
+        """Post finished results to the figure; called by the timer on the GUI thread."""
+        while True:
+            try:
+                generation, on_result, result, show_stale = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if generation < self._shown:
+                continue  # A newer result is already shown
+            if self.is_stale(generation) and not show_stale:
+                continue  # Superseded while it waited to be posted
+            self._shown = generation
+            if on_result is None:
+                raise result
+            on_result(result)
+        if self.idle and not self.synchronous:
+            self._timer.stop()
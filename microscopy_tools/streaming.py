@@ -0,0 +1,394 @@
+"""Streaming low-pass filtering of image sequences (time-lapses, z-stacks, folders of micrographs).
+
+The filter of the Fourier demo is run over every frame of a sequence in a
+pipeline of threads connected by bounded queues:
+
+- a reader thread reads the frames ahead of the consumer, in batches of
+  ``batch_size`` frames of equal shape,
+- a thread pool filters the batches, each with one stacked rfft2 over the last
+  two axes, the mask of the cut-off and one inverse transform (scipy.fft
+  releases the GIL, so the batches run in parallel),
+- the consumer takes the filtered frames in order; ``write_sequence`` hands
+  them to a writer thread through another bounded queue.
+
+At most ``prefetch`` batches are read or filtered ahead and at most
+``prefetch`` frames wait for the writer, so the memory use does not depend on
+the length of the sequence. ``Player`` paces a stream at a frame rate for the
+GUI and drops the frames that are late instead of falling behind.
+
+Run from the repository root:
+
+    python -m microscopy_tools.streaming timelapse.tif --percentage 10 --out filtered.tif
+"""
+import argparse
+import functools
+import os
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from scipy import fft
+
+from .fourier import cutoff_radius, squared_frequency_distance
+from .loaders import TIFF_SUFFIXES, open_image
+from .profiling import timer
+from .workspace import real_dtype
+
+# Frames filtered by one transform
+BATCH_SIZE = 8
+# Batches read or filtered ahead of the consumer, and frames waiting for the writer
+PREFETCH = 4
+
+# Files of a directory read as frames
+IMAGE_SUFFIXES = ('.npy', *TIFF_SUFFIXES, '.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+Frame = namedtuple('Frame', ['index', 'image', 'filtered'])
+Frame.__doc__ = """A frame of a sequence: its index, the image and the low-pass filtered image."""
+
+# End of a stream, put in the queue after the last batch
+_END = object()
+
+
+class FrameSequence:
+    """
+    Frames of an image sequence, read on demand.
+
+    Parameters:
+    path (str): A multi-plane image file (every plane is a frame, see microscopy_tools.loaders)
+        or a directory of image files (one frame per file, sorted by name).
+    precision (str): Precision of the frames (see microscopy_tools.workspace).
+    """
+
+    def __init__(self, path, precision=None):
+        self.path = Path(path)
+        self.dtype = real_dtype(precision)
+        if self.path.is_dir():
+            self.files = sorted(file for file in self.path.iterdir() if file.suffix.lower() in IMAGE_SUFFIXES)
+            if not self.files:
+                raise ValueError(f"{self.path}: no image files ({', '.join(IMAGE_SUFFIXES)})")
+            self.source = None
+        else:
+            self.files = None
+            self.source = open_image(self.path)
+
+    def __len__(self):
+        return len(self.files) if self.files is not None else self.source.n_planes
+
+    def frame(self, index):
+        """Frame ``index`` as a float array in the intensity units of the file (greyscale for RGB)."""
+        if self.files is not None:
+            plane = open_image(self.files[index]).plane(0)
+        else:
+            plane = self.source.plane(index)
+        return np.array(plane, dtype=self.dtype)  # A copy, the plane may be a memory map
+
+
+@functools.lru_cache(maxsize=8)
+def _mask(shape, radius):
+    mask = squared_frequency_distance(shape, centred=False) <= radius**2
+    mask.flags.writeable = False
+    return mask
+
+
+def lowpass_batch(frames, percentage, workers=1):
+    """
+    Low-pass filter a stack of frames, as ``fourier.LowPassFilter.filter`` filters one image.
+
+    Parameters:
+    frames (numpy array): Frames of equal shape, shape (n, height, width).
+    percentage (float): Radius of the kept frequencies in percent (see ``fourier.cutoff_radius``).
+    workers (int): Threads of each transform.
+
+    Returns:
+    numpy array: Magnitude of the filtered frames.
+    """
+    shape = frames.shape[-2:]
+    spectra = fft.rfft2(frames, axes=(-2, -1), workers=workers)
+    spectra *= _mask(shape, cutoff_radius(shape, percentage))
+    filtered = fft.irfft2(spectra, s=shape, axes=(-2, -1), workers=workers, overwrite_x=True)
+    return np.abs(filtered, out=filtered)
+
+
+class FilteredStream:
+    """
+    Low-pass filtered frames of a sequence, produced ahead by background threads.
+
+    Iterating yields every ``Frame`` in order; ``poll`` takes the next batch only
+    if it is ready, for a consumer that must not wait. ``percentage`` can be
+    changed at any time and applies to the batches not yet filtered.
+
+    Parameters:
+    sequence (FrameSequence): Frames to filter (anything with ``len`` and ``frame(index)``).
+    percentage (float): Cut-off of the low-pass filter.
+    batch_size (int): Frames filtered by one transform.
+    workers (int): Threads filtering batches (default: all cores).
+    prefetch (int): Batches read or filtered ahead of the consumer.
+    start (int): Index of the first frame.
+    """
+
+    def __init__(self, sequence, percentage, batch_size=BATCH_SIZE, workers=None, prefetch=PREFETCH, start=0):
+        self.sequence = sequence
+        self.percentage = percentage
+        self.batch_size = batch_size
+        self._pool = ThreadPoolExecutor(workers or os.cpu_count() or 1)
+        self._queue = queue.Queue(maxsize=prefetch)  # (indices, frames, future of the filtered frames)
+        self._skip_to = start
+        self._head = None
+        self._closed = threading.Event()
+        self._reader = threading.Thread(target=self._read, args=(start,), daemon=True)
+        self._reader.start()
+
+    def skip_to(self, index):
+        """Do not read the frames before ``index`` any more (frames already read ahead are still returned)."""
+        self._skip_to = max(self._skip_to, index)
+
+    def _put(self, item):
+        # Waits for room in the queue unless the stream is closed meanwhile
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read(self, index):
+        pending = None  # Frame of a new shape, starting the next batch
+        try:
+            while not self._closed.is_set():
+                indices, frames = [], []
+                if pending is not None:
+                    indices, frames = [pending[0]], [pending[1]]
+                    pending = None
+                else:
+                    index = max(index, self._skip_to)
+                while len(frames) < self.batch_size and index < len(self.sequence):
+                    with timer('read'):
+                        frame = self.sequence.frame(index)
+                    if frames and frame.shape != frames[0].shape:
+                        pending = (index, frame)
+                        index += 1
+                        break
+                    indices.append(index)
+                    frames.append(frame)
+                    index += 1
+                if not frames:
+                    break
+                frames = np.stack(frames)
+                future = self._pool.submit(self._filter, frames, self.percentage)
+                if not self._put((indices, frames, future)):
+                    break
+        except Exception as error:
+            self._put(error)
+        finally:
+            self._put(_END)
+
+    def _filter(self, frames, percentage):
+        with timer('filter'):
+            return lowpass_batch(frames, percentage)
+
+    @staticmethod
+    def _frames(item):
+        if isinstance(item, Exception):
+            raise item
+        indices, frames, future = item
+        filtered = future.result()
+        return [Frame(index, frame, image) for index, frame, image in zip(indices, frames, filtered)]
+
+    def __iter__(self):
+        while True:
+            item = self._head if self._head is not None else self._queue.get()
+            self._head = None
+            if item is _END:
+                self._pool.shutdown(wait=False)
+                return
+            yield from self._frames(item)
+
+    def poll(self):
+        """
+        The frames of the next batch if it is filtered, without waiting.
+
+        Returns:
+        list: Frames of the batch, empty if it is not ready yet, None at the end of the sequence.
+        """
+        if self._head is None:
+            try:
+                self._head = self._queue.get_nowait()
+            except queue.Empty:
+                return []
+        if self._head is _END:
+            self._pool.shutdown(wait=False)
+            return None
+        if not isinstance(self._head, Exception) and not self._head[2].done():
+            return []
+        item, self._head = self._head, None
+        return self._frames(item)
+
+    def close(self):
+        """Stop reading and filtering; the frames not yet taken are discarded."""
+        self._closed.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class Player:
+    """
+    Frames of a stream paced at a target frame rate.
+
+    ``next_frame`` is called by a GUI timer. Frame ``start + fps * elapsed
+    seconds`` is due; when filtering cannot keep up, the frames that are late are
+    dropped, and not read any more, instead of the playback falling behind.
+
+    Parameters:
+    stream (FilteredStream): The frames to play.
+    fps (float): Target frame rate.
+    start (int): Index of the first frame of the stream.
+    clock (callable): Current time in seconds.
+    """
+
+    def __init__(self, stream, fps, start=0, clock=time.perf_counter):
+        self.stream = stream
+        self.fps = fps
+        self.start = start
+        self.clock = clock
+        self.started = None
+        self.last_index = start - 1
+        self.shown = 0
+        self.dropped = 0
+        self.finished = False
+        self._ready = deque()
+
+    def due(self):
+        """Index of the frame due now."""
+        if self.started is None:
+            self.started = self.clock()
+        return self.start + int((self.clock() - self.started) * self.fps)
+
+    def next_frame(self):
+        """
+        The newest due frame not shown yet, or None if there is none ready.
+
+        Older ready frames are dropped, as are frames skipped in the stream.
+        ``finished`` is set when the stream has ended and every frame was taken.
+        """
+        target = self.due()
+        self.stream.skip_to(target)
+        while True:
+            frames = self.stream.poll()
+            if not frames:
+                break
+            self._ready.extend(frames)
+        frame = None
+        while self._ready and self._ready[0].index <= target:
+            frame = self._ready.popleft()
+        if frame is not None:
+            self.dropped += frame.index - self.last_index - 1
+            self.last_index = frame.index
+            self.shown += 1
+        self.finished = frames is None and not self._ready
+        return frame
+
+    def close(self):
+        self.stream.close()
+
+
+def _write_frames(frames, out):
+    """Write frames one by one to a TIFF file (a single series), or to .npy files in a directory."""
+    out = Path(out)
+    if out.suffix.lower() in TIFF_SUFFIXES:
+        import tifffile  # Installed with scikit-image
+
+        shape = None
+        with tifffile.TiffWriter(out, bigtiff=True) as tif:
+            for frame in frames:
+                # Readers only see the first series, so every frame must extend it
+                if shape is None:
+                    shape = frame.filtered.shape
+                elif frame.filtered.shape != shape:
+                    raise ValueError(f"Frame {frame.index} has shape {frame.filtered.shape}, not {shape}: "
+                                     f"frames of different sizes can only be written to a directory")
+                tif.write(frame.filtered, contiguous=True)
+        return
+    out.mkdir(parents=True, exist_ok=True)
+    for frame in frames:
+        np.save(out / f'frame_{frame.index:06d}.npy', frame.filtered)
+
+
+def write_sequence(frames, out, queue_size=PREFETCH):
+    """
+    Write filtered frames incrementally while the next ones are computed.
+
+    Parameters:
+    frames (iterable): Frames, e.g. a ``FilteredStream``.
+    out (str): A TIFF file (.tif/.tiff, one page per frame in a single series, all frames of one shape)
+        or a directory (one .npy file per frame).
+    queue_size (int): Frames waiting for the writer thread at most.
+
+    Returns:
+    int: Number of frames written.
+    """
+    pending = queue.Queue(maxsize=queue_size)
+    errors = []
+    received_all = threading.Event()
+
+    def received():
+        while (frame := pending.get()) is not _END:
+            yield frame
+        received_all.set()
+
+    def write():
+        try:
+            with timer('write'):
+                _write_frames(received(), out)
+        except Exception as error:
+            errors.append(error)
+            # Unblock the producer, which stops at its next frame
+            while not received_all.is_set() and pending.get() is not _END:
+                pass
+
+    writer = threading.Thread(target=write, daemon=True)
+    writer.start()
+    count = 0
+    try:
+        for frame in frames:
+            if errors:
+                break
+            pending.put(frame)
+            count += 1
+    finally:
+        pending.put(_END)
+        writer.join()
+    if errors:
+        raise errors[0]
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sequence', help='multi-plane image file (TIFF, .npy, ...) or directory of images')
+    parser.add_argument('--percentage', type=float, default=10, help='radius of the kept frequencies in percent')
+    parser.add_argument('--out', default='filtered.tif', help='output TIFF file, or directory for .npy frames')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='frames filtered by one transform')
+    parser.add_argument('--workers', type=int, default=None, help='filtering threads (default: all cores)')
+    parser.add_argument('--prefetch', type=int, default=PREFETCH, help='batches read and filtered ahead')
+    args = parser.parse_args(argv)
+
+    sequence = FrameSequence(args.sequence)
+    stream = FilteredStream(sequence, args.percentage, batch_size=args.batch_size, workers=args.workers,
+                            prefetch=args.prefetch)
+    start = time.perf_counter()
+    try:
+        count = write_sequence(stream, args.out, queue_size=args.prefetch)
+    finally:
+        stream.close()
+    elapsed = time.perf_counter() - start
+    if Path(args.out).suffix.lower() in TIFF_SUFFIXES and len(FrameSequence(args.out)) != count:
+        raise RuntimeError(f"{args.out}: {len(FrameSequence(args.out))} frames read back, {count} written")
+    print(f"Filtered {count} frames in {elapsed:.2f} s ({count / elapsed:.1f} frames/s), written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Headless parameter sweep of the convolution/deconvolution pipeline.
+
+Every combination of object, PSF spread, noise level, Wiener balance and
+deconvolution method is run in parallel on a process pool. The images of each
+run are written as .npz files and the error metrics of all runs to metrics.csv.
+
+Example, run from the repository root:
+
+    python -m microscopy_tools.sweep object.npy --spread 10 20 40 --noise 0.001 0.005 --balance 0.05 0.1 --out sweep_results
+"""
+import argparse
+import csv
+import functools
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from .convolution import make_convolver
+from .deconvolution import BALANCED_METHODS, METHODS, rmse, psnr, run_pipeline
+from .loaders import open_image
+from .workspace import PRECISIONS
+
+METRIC_FIELDS = ['object', 'spread', 'noise', 'balance', 'method',
+                 'rmse_image', 'psnr_image', 'rmse_deconvolved', 'psnr_deconvolved', 'file']
+
+
+@functools.lru_cache(maxsize=8)
+def load_object(path):
+    """Load the first plane of an object image (see microscopy_tools.loaders) as a 2D float array."""
+    return np.asarray(open_image(path).plane(0), dtype=float)
+
+
+def build_tasks(objects, spreads, noises, balances, methods, seed=None):
+    """
+    Expand the parameter grid into a list of task dictionaries.
+
+    The balance only affects the 'Wiener' method, so the other methods are run
+    once per (object, spread, noise) with balance set to None. Every
+    (object, spread, noise) point gets its own noise seed spawned from ``seed``,
+    shared by all its methods and balances, so that they deconvolve the same
+    noisy image and their metrics compare the methods rather than the noise.
+    """
+    tasks = []
+    points = list(itertools.product(objects, spreads, noises))
+    for (obj, spread, noise), child in zip(points, np.random.SeedSequence(seed).spawn(len(points))):
+        for method in methods:
+            for balance in (balances if method in BALANCED_METHODS else [None]):
+                tasks.append(dict(object=str(obj), spread=spread, noise=noise, balance=balance, method=method,
+                                  seed=child))
+    return tasks
+
+
+def run_task(task, out_dir, backend='fft', save_images=True, precision='float64'):
+    """Run a single grid point and return its metrics row."""
+    obj = load_object(task['object'])
+    # A fresh copy of the seed: the noise spawns from it, which would advance a SeedSequence
+    # shared with the other tasks of the grid point (e.g. in the same chunk of the pool)
+    seed = np.random.SeedSequence(task['seed'].entropy, spawn_key=task['seed'].spawn_key)
+    acquisition, deconvolved = run_pipeline(
+        obj, task['spread'], task['noise'], task['balance'], task['method'],
+        convolver=make_convolver(backend, precision=precision), rng=np.random.default_rng(seed))
+
+    row = {key: task[key] for key in ('object', 'spread', 'noise', 'balance', 'method')}
+    row.update(rmse_image=rmse(acquisition.noisy_blurred, obj),
+               psnr_image=psnr(acquisition.noisy_blurred, obj),
+               rmse_deconvolved=rmse(deconvolved, obj),
+               psnr_deconvolved=psnr(deconvolved, obj),
+               file='')
+    if save_images:
+        name = (f"{Path(task['object']).stem}_spread{task['spread']:g}_noise{task['noise']:g}"
+                f"_balance{'-' if task['balance'] is None else format(task['balance'], 'g')}"
+                f"_{task['method'].replace(' ', '_')}.npz")
+        np.savez_compressed(Path(out_dir) / name, psf=acquisition.psf, blurred=acquisition.blurred,
+                            noisy_blurred=acquisition.noisy_blurred, deconvolved=deconvolved)
+        row['file'] = name
+    return row
+
+
+def run_sweep(tasks, out_dir, workers=None, backend='fft', save_images=True, precision='float64'):
+    """Run all tasks on a process pool, write metrics.csv and return the metric rows."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    worker = functools.partial(run_task, out_dir=out_dir, backend=backend, save_images=save_images,
+                               precision=precision)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        rows = list(pool.map(worker, tasks, chunksize=max(1, len(tasks) // (4 * (workers or os.cpu_count() or 1)))))
+
+    with open(out_dir / 'metrics.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=METRIC_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('objects', nargs='+', help='object images (.npy, TIFF or other image files)')
+    parser.add_argument('--spread', type=float, nargs='+', default=[20], help='PSF spread values')
+    parser.add_argument('--noise', type=float, nargs='+', default=[0.005], help='noise levels')
+    parser.add_argument('--balance', type=float, nargs='+', default=[0.1], help='Wiener balance values')
+    parser.add_argument('--method', nargs='+', default=list(METHODS), choices=METHODS, help='deconvolution methods')
+    parser.add_argument('--out', default='sweep_results', help='output directory')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: all cores)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the noise')
+    parser.add_argument('--backend', default='fft', choices=['fft', 'direct'], help='convolution backend')
+    parser.add_argument('--precision', default='float64', choices=sorted(PRECISIONS),
+                        help='floating point precision of the simulation (float64 for accurate metrics)')
+    parser.add_argument('--metrics-only', action='store_true', help='do not save the images of each run')
+    args = parser.parse_args(argv)
+
+    tasks = build_tasks(args.objects, args.spread, args.noise, args.balance, args.method, seed=args.seed)
+    print(f"Running {len(tasks)} combinations")
+    rows = run_sweep(tasks, args.out, workers=args.workers, backend=args.backend, save_images=not args.metrics_only,
+                     precision=args.precision)
+
+    # Best method for each acquisition setting
+    rows.sort(key=lambda row: (row['object'], row['spread'], row['noise'],
+                               np.nan_to_num(row['rmse_deconvolved'], nan=np.inf)))
+    for key, group in itertools.groupby(rows, key=lambda row: (row['object'], row['spread'], row['noise'])):
+        best = next(group)
+        balance = '' if best['balance'] is None else f", balance {best['balance']:g}"
+        print(f"{Path(key[0]).name}, spread {key[1]:g}, noise {key[2]:g}: best {best['method']}{balance} "
+              f"(RMSE {best['rmse_deconvolved']:.4g}, PSNR {best['psnr_deconvolved']:.1f} dB)")
+    print(f"Metrics written to {Path(args.out) / 'metrics.csv'}")
+
+
+if __name__ == '__main__':
+    main()
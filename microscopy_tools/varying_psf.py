@@ -0,0 +1,258 @@
+"""Spatially varying (field-dependent) PSFs, convolved and deconvolved tile by tile.
+
+Real objectives blur the edges of the field of view more than the centre. The
+PSF is therefore sampled on a grid of tiles (``PSFGrid``) and interpolated in
+between with bilinear windows w_i, which sum to one at every pixel. Following
+Nagy and O'Leary (SIAM J. Sci. Comput. 19, 1998) the blurred image is
+
+    blurred = sum_i psf_i * (w_i . obj),
+
+so every tile is an ordinary FFT convolution of a windowed piece of the object,
+and the PSF seen by a point is the interpolation of the neighbouring tile PSFs
+(``PSFGrid.psf_at``). Deconvolution is done per tile with the tile's PSF on the
+tile extended by a halo, and the results are blended with the same windows.
+
+The tiles are independent, so they run on a thread pool (the FFTs release the
+GIL). ``VaryingPSFConvolver`` is a convolution backend with the interface of
+``microscopy_tools.convolution``; its ``psf`` is a ``PSFGrid``, which
+``microscopy_tools.deconvolution.deconvolve`` deconvolves tile by tile.
+"""
+import functools
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import fft
+
+from .convolution import PSF_EXTENT, PSF_SHAPE, fast_shape, fit_psf
+from .workspace import real_dtype
+
+GRID_SHAPE = (3, 3)
+
+Tile = namedtuple('Tile', ['index', 'support'])
+Tile.__doc__ = """(row, column) of a tile in the grid and the slices of the image where its window is non-zero."""
+
+
+@functools.lru_cache(maxsize=256)
+def _field_psf(spread, field_y, field_x, aberration, shape, dtype):
+    x = np.linspace(-PSF_EXTENT, PSF_EXTENT, shape[1])
+    y = np.linspace(-PSF_EXTENT, PSF_EXTENT, shape[0])
+    x, y = np.meshgrid(x, y)
+    radius = np.hypot(field_y, field_x)
+    if radius > 0:
+        # Coordinates along and across the direction from the centre of the field
+        radial, tangential = (x * field_x + y * field_y) / radius, (y * field_x - x * field_y) / radius
+    else:
+        radial, tangential = x, y
+    growth = 1 + aberration * radius**2
+    psf = np.exp(-(radial**2 / (spread * growth**2) + tangential**2 / (spread * growth)))
+    psf /= psf.sum()
+    psf = psf.astype(dtype, copy=False)
+    psf.flags.writeable = False  # Shared between callers through the cache
+    return psf
+
+
+def field_dependent_psf(spread, field_y, field_x, aberration, shape=PSF_SHAPE, dtype=np.float64):
+    """
+    Gaussian PSF that widens towards the edges of the field of view.
+
+    At the centre it is ``convolution.gaussian_psf``. Away from it the spread grows
+    with the squared distance from the centre (field curvature), and twice as fast
+    along the radius (astigmatism), so the PSF is stretched radially.
+
+    Parameters:
+    spread (float): Spread of the Gaussian in the centre of the field (the PSF spread slider value).
+    field_y, field_x (float): Position in the field of view, -1 to 1 from edge to edge.
+    aberration (float): Relative growth of the spread at the edge of the field, 0 for a shift-invariant PSF.
+    shape (tuple): Shape of the sampled PSF.
+    dtype: Floating point type of the PSF.
+
+    Returns:
+    numpy array: Read-only PSF normalised to sum to 1.
+    """
+    return _field_psf(float(spread), float(field_y), float(field_x), float(aberration), tuple(shape), np.dtype(dtype))
+
+
+def _placement(start, length, size):
+    """Slices of the image and of a piece placed at ``start`` (possibly outside the image) that overlap."""
+    stop = start + length
+    return slice(max(start, 0), min(stop, size)), slice(max(-start, 0), length - max(stop - size, 0))
+
+
+class PSFGrid:
+    """
+    PSFs sampled at the centres of a grid of equal tiles covering the field of view.
+
+    The grid does not depend on the image size: the tiles of an image of any
+    shape are its rows x columns equal parts.
+
+    Parameters:
+    psfs (numpy array): PSFs of the tiles, shape (rows, columns, height, width), each summing to 1.
+    workers (int): Threads processing the tiles (default: all cores).
+    """
+
+    def __init__(self, psfs, workers=None):
+        self.psfs = np.asarray(psfs)
+        self.grid_shape = self.psfs.shape[:2]
+        self.psf_shape = self.psfs.shape[2:]
+        self.dtype = self.psfs.dtype
+        self.workers = workers or os.cpu_count() or 1
+        self._windows = {}
+        self._transfer_functions = {}
+
+    @property
+    def n_tiles(self):
+        return self.grid_shape[0] * self.grid_shape[1]
+
+    def windows(self, image_shape):
+        """
+        Bilinear interpolation windows of the tiles, cached per image shape.
+
+        Returns:
+        tuple: Row weights (rows, height) and column weights (columns, width); the
+        window of tile (i, j) is their outer product. The windows sum to one at every pixel.
+        """
+        image_shape = tuple(image_shape)
+        if image_shape not in self._windows:
+            weights = []
+            for n_tiles, size in zip(self.grid_shape, image_shape):
+                centres = (np.arange(n_tiles) + 0.5) * size / n_tiles - 0.5
+                # Linear between neighbouring centres, constant beyond the outer ones
+                weights.append(np.array([np.interp(np.arange(size), centres, one_hot)
+                                         for one_hot in np.eye(n_tiles)], dtype=self.dtype))
+            self._windows[image_shape] = tuple(weights)
+        return self._windows[image_shape]
+
+    def tiles(self, image_shape):
+        """The ``Tile`` of every grid position, with the support of its window in an image of ``image_shape``."""
+        weights_y, weights_x = self.windows(image_shape)
+        supports_y, supports_x = ([slice(nonzero[0], nonzero[-1] + 1) for nonzero in map(np.flatnonzero, weights)]
+                                  for weights in (weights_y, weights_x))
+        return [Tile((i, j), (rows, columns)) for i, rows in enumerate(supports_y) for j, columns in enumerate(supports_x)]
+
+    def psf_at(self, y, x, image_shape):
+        """The PSF seen by the pixel (y, x): the window-weighted mean of the tile PSFs."""
+        weights_y, weights_x = self.windows(image_shape)
+        return np.einsum('i,j,ijkl->kl', weights_y[:, y], weights_x[:, x], self.psfs)
+
+    def montage(self):
+        """All tile PSFs side by side in one image, laid out like the tiles."""
+        rows, columns = self.grid_shape
+        height, width = self.psf_shape
+        return self.psfs.transpose(0, 2, 1, 3).reshape(rows * height, columns * width)
+
+    def _transfer_function(self, index, padded_shape):
+        key = index, padded_shape
+        if key not in self._transfer_functions:
+            otf = fft.rfft2(self.psfs[index], s=padded_shape, workers=1)
+            otf.flags.writeable = False
+            self._transfer_functions[key] = otf
+        return self._transfer_functions[key]
+
+    def _map(self, func, tiles):
+        if self.workers == 1:
+            return list(map(func, tiles))
+        with ThreadPoolExecutor(self.workers) as pool:
+            return list(pool.map(func, tiles))
+
+    def convolve(self, image):
+        """
+        Blur an image with the field-dependent PSF.
+
+        With equal tile PSFs this is ``convolve2d(image, psf, mode='same')``.
+
+        Parameters:
+        image (numpy array): 2D image.
+
+        Returns:
+        numpy array: The blurred image, same shape as the image.
+        """
+        image = np.asarray(image, dtype=self.dtype)
+        weights_y, weights_x = self.windows(image.shape)
+        offsets = [(m - 1) // 2 for m in self.psf_shape]
+
+        def convolve_tile(tile):
+            (i, j), (rows, columns) = tile
+            windowed = image[rows, columns] * weights_y[i, rows, None] * weights_x[j, None, columns]
+            padded_shape = fast_shape(windowed.shape, self.psf_shape)
+            spectrum = fft.rfft2(windowed, s=padded_shape, workers=1)
+            spectrum *= self._transfer_function((i, j), padded_shape)
+            full = fft.irfft2(spectrum, s=padded_shape, workers=1, overwrite_x=True)
+            # The full linear convolution, of which the image keeps the part that overlaps it
+            (out_rows, full_rows), (out_columns, full_columns) = (
+                _placement(sl.start - offset, n + m - 1, size)
+                for sl, offset, n, m, size in zip((rows, columns), offsets, windowed.shape, self.psf_shape, image.shape))
+            return (out_rows, out_columns), full[full_rows, full_columns]
+
+        blurred = np.zeros(image.shape, dtype=self.dtype)
+        for region, piece in self._map(convolve_tile, self.tiles(image.shape)):
+            blurred[region] += piece
+        return blurred
+
+    def blend(self, func, image_shape, halo=None):
+        """
+        Apply a shift-invariant operation tile by tile and blend the results with the windows.
+
+        Parameters:
+        func (callable): ``func(region, psf)`` returns the result of the operation on
+            ``region`` (a tuple of slices of the image) with the tile's PSF, cropped to the region if needed.
+        image_shape (tuple): Shape of the image.
+        halo (tuple): Margin around every tile included in the region, half the PSF by default.
+
+        Returns:
+        numpy array: The sum of the windowed results of all tiles.
+        """
+        weights_y, weights_x = self.windows(image_shape)
+        if halo is None:
+            halo = tuple(m // 2 for m in self.psf_shape)
+
+        def process_tile(tile):
+            (i, j), support = tile
+            region = tuple(slice(max(0, sl.start - h), min(n, sl.stop + h))
+                           for sl, h, n in zip(support, halo, image_shape))
+            psf = fit_psf(self.psfs[i, j], [sl.stop - sl.start for sl in region])
+            result = func(region, psf)
+            rows, columns = (slice(sl.start - r.start, sl.stop - r.start) for sl, r in zip(support, region))
+            return support, result[rows, columns] * weights_y[i, support[0], None] * weights_x[j, None, support[1]]
+
+        blended = np.zeros(image_shape, dtype=self.dtype)
+        for support, piece in self._map(process_tile, self.tiles(image_shape)):
+            blended[support] += piece
+        return blended
+
+
+@functools.lru_cache(maxsize=8)
+def psf_grid(spread, aberration, grid_shape=GRID_SHAPE, psf_shape=PSF_SHAPE, dtype=np.float64, workers=None):
+    """
+    ``PSFGrid`` of ``field_dependent_psf`` sampled at the tile centres.
+
+    Cached, so that the transfer functions of the tiles are reused while only the noise or balance changes.
+    """
+    rows, columns = grid_shape
+    field_y, field_x = ((np.arange(n) + 0.5) * 2 / n - 1 for n in grid_shape)
+    psfs = np.empty((rows, columns) + tuple(psf_shape), dtype=dtype)
+    for i in range(rows):
+        for j in range(columns):
+            psfs[i, j] = field_dependent_psf(spread, field_y[i], field_x[j], aberration, psf_shape, dtype)
+    psfs.flags.writeable = False
+    return PSFGrid(psfs, workers)
+
+
+class VaryingPSFConvolver:
+    """Convolution with the field-dependent PSF, tile by tile on a thread pool."""
+
+    name = 'varying'
+
+    def __init__(self, psf_shape=PSF_SHAPE, precision=None, aberration=0.5, grid_shape=GRID_SHAPE, workers=None):
+        self.psf_shape = tuple(psf_shape)
+        self.dtype = real_dtype(precision)
+        self.aberration = aberration
+        self.grid_shape = tuple(grid_shape)
+        self.workers = workers
+
+    def psf(self, spread):
+        return psf_grid(float(spread), float(self.aberration), self.grid_shape, self.psf_shape, self.dtype, self.workers)
+
+    def convolve(self, image, spread):
+        return self.psf(spread).convolve(image)
@@ -0,0 +1,389 @@
+"""3D (z-stack) convolution and deconvolution, processed in blocks.
+
+A 512 x 512 x 100 volume is 100 MB in float32, and the pipeline keeps
+several such volumes (object, blurred, noise, noisy, deconvolved) plus FFT
+buffers. Here nothing is processed as a whole:
+
+- ``convolve_volume`` - overlap-add FFT convolution: every block is
+  convolved with the PSF on its own (one transfer function for all) and
+  the results, overlapping by the PSF size, are summed into the output.
+- ``acquire_volume`` - blur and noise, block by block.
+- ``deconvolve_volume`` - every block is deconvolved with the 2D pipeline's
+  ``deconvolve`` (any of ``VOLUME_METHODS``, which work in n dimensions) together with a halo
+  of neighbouring voxels, and only its interior is kept (overlap-save).
+- ``LazySlices`` - evaluates a z-slice on demand from the slab around it,
+  for display.
+
+The outputs can be memory-mapped .npy files (``out_dir``), so that the peak
+memory is set by the block size (see ``block_memory``) and not by the volume.
+Volumes are indexed [z, y, x].
+
+Run ``python -m microscopy_tools.volume --help`` for the command line tool.
+"""
+import argparse
+import functools
+import itertools
+import math
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from scipy import fft
+
+from .convolution import fit_psf
+from .deconvolution import METHODS, Acquisition, deconvolve
+from .workspace import real_dtype
+
+BLOCK_SHAPE = (32, 256, 256)
+PSF_MODELS = ('gaussian', 'beam')
+
+# Deconvolution methods that work on volumes; skimage's unsupervised Wiener only handles 2D images
+VOLUME_METHODS = tuple(method for method in METHODS if method != 'Unsupervised Wiener')
+
+
+def _normalised(psf, dtype):
+    psf /= psf.sum()
+    psf = psf.astype(dtype, copy=False)
+    psf.flags.writeable = False  # Shared between callers through the cache
+    return psf
+
+
+@functools.lru_cache(maxsize=8)
+def gaussian_psf_3d(sigma_xy, sigma_z, truncate=3.0, dtype=np.float32):
+    """
+    3D Gaussian PSF normalised to sum to 1.
+
+    Parameters:
+    sigma_xy, sigma_z (float): Lateral and axial sigma in voxels.
+    truncate (float): Half-size of the PSF in sigmas.
+    """
+    half_z, half_xy = math.ceil(truncate * sigma_z), math.ceil(truncate * sigma_xy)
+    z, y, x = np.ogrid[-half_z:half_z + 1, -half_xy:half_xy + 1, -half_xy:half_xy + 1]
+    psf = np.exp(-(x**2 + y**2) / (2 * sigma_xy**2) - z**2 / (2 * sigma_z**2))
+    return _normalised(psf, dtype)
+
+
+@functools.lru_cache(maxsize=8)
+def gaussian_beam_psf(waist, rayleigh_range, depth=3.0, truncate=3.0, dtype=np.float32):
+    """
+    Widefield-like PSF of a focused Gaussian beam, normalised to sum to 1.
+
+    The beam radius grows as w(z) = waist * sqrt(1 + (z / rayleigh_range)^2) and
+    every plane carries the same energy, giving the hourglass shape and the
+    slowly decaying out-of-focus light of a widefield PSF (a Born-Wolf PSF
+    without the rings).
+
+    Parameters:
+    waist (float): 1/e^2 beam radius in the focus, in voxels.
+    rayleigh_range (float): Distance from the focus where the beam area doubles, in voxels.
+    depth (float): Half-height of the PSF in Rayleigh ranges.
+    truncate (float): Lateral half-size in sigmas (w / 2) of the widest plane.
+    """
+    half_z = math.ceil(depth * rayleigh_range)
+    widest = waist * math.sqrt(1 + depth**2)
+    half_xy = math.ceil(truncate * widest / 2)
+    z, y, x = np.ogrid[-half_z:half_z + 1, -half_xy:half_xy + 1, -half_xy:half_xy + 1]
+    radius2 = (waist**2) * (1 + (z / rayleigh_range)**2)
+    psf = (waist**2 / radius2) * np.exp(-2 * (x**2 + y**2) / radius2)
+    return _normalised(psf, dtype)
+
+
+def make_psf(model, sigma_xy, sigma_z, dtype=np.float32):
+    """PSF by model name: 'gaussian' with the given sigmas, 'beam' with waist 2 * sigma_xy and Rayleigh range sigma_z."""
+    if model == 'gaussian':
+        return gaussian_psf_3d(float(sigma_xy), float(sigma_z), dtype=np.dtype(dtype))
+    if model == 'beam':
+        return gaussian_beam_psf(2.0 * sigma_xy, float(sigma_z), dtype=np.dtype(dtype))
+    raise ValueError(f"Unknown PSF model {model!r}, choose from {PSF_MODELS}")
+
+
+def blocks(shape, block_shape):
+    """Slices of the blocks tiling a volume, the last block along each axis may be smaller."""
+    ranges = [range(0, n, b) for n, b in zip(shape, block_shape)]
+    for start in itertools.product(*ranges):
+        yield tuple(slice(s, min(s + b, n)) for s, b, n in zip(start, block_shape, shape))
+
+
+def block_memory(block_shape, psf_shape, halo=None, dtype=np.float32):
+    """
+    Estimate of the working memory of one block in bytes.
+
+    The padded block is held as real data, its spectrum (complex) and the
+    inverse transform; deconvolution methods keep a few more copies, counted
+    as a factor of two.
+    """
+    halo = tuple(psf_shape) if halo is None else halo
+    padded = [fft.next_fast_len(b + 2 * h + m - 1, real=True) for b, h, m in zip(block_shape, halo, psf_shape)]
+    voxels = math.prod(padded)
+    itemsize = np.dtype(dtype).itemsize
+    return 2 * voxels * (2 * itemsize + 2 * itemsize)
+
+
+def _allocate(shape, dtype, out_dir, name):
+    """Zeroed output volume, a memory-mapped .npy file in out_dir if given."""
+    if out_dir is None:
+        return np.zeros(shape, dtype=dtype)
+    path = Path(out_dir)
+    path.mkdir(parents=True, exist_ok=True)
+    return np.lib.format.open_memmap(path / f'{name}.npy', mode='w+', dtype=dtype, shape=tuple(shape))
+
+
+def convolve_volume(volume, psf, block_shape=BLOCK_SHAPE, out=None):
+    """
+    Overlap-add FFT convolution, equivalent to ``fftconvolve(volume, psf, mode='same')``.
+
+    Parameters:
+    volume (numpy array): The volume, read block by block (may be a memory map).
+    psf (numpy array): The 3D PSF.
+    block_shape (tuple): Shape of the blocks.
+    out (numpy array): Output volume (may be a memory map), zeroed first; new if None.
+
+    Returns:
+    numpy array: The blurred volume in the dtype of the PSF.
+    """
+    block_shape = tuple(min(b, n) for b, n in zip(block_shape, volume.shape))
+    padded_shape = tuple(fft.next_fast_len(b + m - 1, real=True) for b, m in zip(block_shape, psf.shape))
+    otf = fft.rfftn(psf, s=padded_shape, workers=-1)  # Shared by all blocks
+    if out is None:
+        out = np.zeros(volume.shape, dtype=psf.dtype)
+    else:
+        out[...] = 0
+    offsets = [(m - 1) // 2 for m in psf.shape]  # Start of the 'same' part of the full convolution
+
+    for block in blocks(volume.shape, block_shape):
+        data = np.asarray(volume[block], dtype=psf.dtype)
+        spectrum = fft.rfftn(data, s=padded_shape, workers=-1)
+        spectrum *= otf
+        full = fft.irfftn(spectrum, s=padded_shape, workers=-1, overwrite_x=True)
+        # The full convolution of the block covers [start - offset, start - offset + b + m - 1) of the output
+        target, source = [], []
+        for sl, b, m, offset, n in zip(block, data.shape, psf.shape, offsets, volume.shape):
+            low = sl.start - offset
+            start, stop = max(low, 0), min(low + b + m - 1, n)
+            target.append(slice(start, stop))
+            source.append(slice(start - low, stop - low))
+        out[tuple(target)] += full[tuple(source)]
+    return out
+
+
+def acquire_volume(obj, psf, noise, rng=None, block_shape=BLOCK_SHAPE, out_dir=None):
+    """
+    Simulate imaging of a volume: 3D convolution with the PSF plus Gaussian noise.
+
+    Parameters:
+    obj (numpy array): The object volume.
+    psf (numpy array): The 3D PSF.
+    noise (float): Standard deviation of the additive noise.
+    rng (numpy Generator): Source of the noise, a fresh unseeded generator by default.
+    block_shape (tuple): Shape of the processed blocks.
+    out_dir (str): Directory for memory-mapped outputs (blurred.npy, noise.npy,
+        noisy_blurred.npy); in memory if None.
+
+    Returns:
+    Acquisition: The PSF, blurred volume, noise component and noisy blurred volume.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    blurred = convolve_volume(obj, psf, block_shape, out=_allocate(obj.shape, psf.dtype, out_dir, 'blurred'))
+    noise_component = _allocate(obj.shape, psf.dtype, out_dir, 'noise')
+    noisy_blurred = _allocate(obj.shape, psf.dtype, out_dir, 'noisy_blurred')
+    for block in blocks(obj.shape, block_shape):
+        block_noise = rng.standard_normal(size=noise_component[block].shape, dtype=psf.dtype)
+        block_noise *= noise
+        noise_component[block] = block_noise
+        noisy_blurred[block] = blurred[block] + block_noise
+    return Acquisition(psf, blurred, noise_component, noisy_blurred)
+
+
+def _with_halo(block, halo, shape):
+    """Slices of the block extended by the halo, and of the block within the extended slab."""
+    read = tuple(slice(max(0, sl.start - h), min(n, sl.stop + h)) for sl, h, n in zip(block, halo, shape))
+    interior = tuple(slice(sl.start - r.start, sl.stop - r.start) for sl, r in zip(block, read))
+    return read, interior
+
+
+def deconvolve_block(obj, acquisition, read, method, balance, preview=False):
+    """Deconvolve one slab of a volume acquisition with the 2D pipeline's ``deconvolve``."""
+    if method not in VOLUME_METHODS:
+        raise ValueError(f"Method {method!r} does not work on volumes, choose from {VOLUME_METHODS}")
+    noisy_blurred = np.asarray(acquisition.noisy_blurred[read])
+    psf = fit_psf(acquisition.psf, noisy_blurred.shape)
+    # Only the 'Inverse' method uses the object and the noise
+    needs_truth = method == 'Inverse'
+    block_acquisition = Acquisition(psf, None,
+                                    np.asarray(acquisition.noise[read]) if needs_truth else None,
+                                    noisy_blurred)
+    block_obj = np.asarray(obj[read], dtype=psf.dtype) if needs_truth else None
+    return deconvolve(block_obj, block_acquisition, method, balance, preview=preview)
+
+
+def deconvolve_volume(obj, acquisition, method, balance, block_shape=BLOCK_SHAPE, halo=None,
+                      preview=False, out_dir=None):
+    """
+    Reconstruct a volume block by block (overlap-save).
+
+    Every block is deconvolved together with ``halo`` voxels of its
+    neighbours, so that the circular boundary of the FFT-based methods does
+    not reach its interior, and only the interior is written out.
+
+    Parameters:
+    obj (numpy array): The object volume (used by the 'Inverse' method only).
+    acquisition (Acquisition): Result of ``acquire_volume``.
+    method (str): One of ``VOLUME_METHODS``.
+    balance (float): Regularisation of the 'Wiener' method.
+    block_shape (tuple): Shape of the blocks.
+    halo (tuple): Context voxels on each side of a block, the PSF shape by default.
+    preview (bool): Run the iterative methods with few iterations only.
+    out_dir (str): Directory for the memory-mapped output (deconvolved.npy); in memory if None.
+
+    Returns:
+    numpy array: The deconvolved volume.
+    """
+    shape = acquisition.noisy_blurred.shape
+    halo = tuple(acquisition.psf.shape) if halo is None else tuple(halo)
+    out = _allocate(shape, acquisition.psf.dtype, out_dir, 'deconvolved')
+    for block in blocks(shape, block_shape):
+        read, interior = _with_halo(block, halo, shape)
+        out[block] = deconvolve_block(obj, acquisition, read, method, balance, preview)[interior]
+    return out
+
+
+class LazySlices:
+    """
+    z-slices of a processed volume, computed on demand.
+
+    Slice z is computed from the slab z - halo ... z + halo of the source with
+    ``compute(z_slice)``, which returns the processed slab; the most recently
+    used slices are cached.
+
+    Parameters:
+    compute (callable): Processes the slab given by a slice along z.
+    depth (int): Number of slices.
+    halo (int): Context slices on each side.
+    cache_size (int): Number of cached slices.
+    """
+
+    def __init__(self, compute, depth, halo, cache_size=8):
+        self._compute = compute
+        self.depth = depth
+        self.halo = halo
+        self._slice = functools.lru_cache(maxsize=cache_size)(self._evaluate)
+
+    def _evaluate(self, z):
+        start, stop = max(0, z - self.halo), min(self.depth, z + self.halo + 1)
+        return self._compute(slice(start, stop))[z - start]
+
+    def __len__(self):
+        return self.depth
+
+    def __getitem__(self, z):
+        if not 0 <= z < self.depth:
+            raise IndexError(f"Slice {z} out of range, the volume has {self.depth} slices")
+        return self._slice(int(z))
+
+
+def lazy_deconvolution(obj, acquisition, method, balance, halo=None, preview=False):
+    """``LazySlices`` of the deconvolved volume, each slice computed from the full-size slab around it."""
+    halo_z = acquisition.psf.shape[0] if halo is None else halo
+
+    def compute(z_slice):
+        read = (z_slice, slice(None), slice(None))
+        return deconvolve_block(obj, acquisition, read, method, balance, preview)
+
+    return LazySlices(compute, acquisition.noisy_blurred.shape[0], halo_z)
+
+
+def synthetic_volume(shape, n_beads=200, radius=3, rng=None, dtype=np.float32):
+    """Volume of spherical beads at random positions, for trying the pipeline without data."""
+    rng = np.random.default_rng(rng)
+    volume = np.zeros(shape, dtype=dtype)
+    z, y, x = np.ogrid[-radius:radius + 1, -radius:radius + 1, -radius:radius + 1]
+    bead = (x**2 + y**2 + z**2 <= radius**2)
+    for center in rng.integers(radius, np.array(shape) - radius, size=(n_beads, 3)):
+        region = tuple(slice(c - radius, c + radius + 1) for c in center)
+        volume[region] = np.maximum(volume[region], bead)
+    return volume
+
+
+def load_volume(path):
+    """A z-stack as a [z, y, x] array; memory-mapped when the file is uncompressed (see microscopy_tools.loaders)."""
+    from .loaders import open_image
+
+    source = open_image(path)
+    if source.data is not None and len(source.plane_axes) == 1 and source.axes[-2:] == 'YX':
+        return source.data
+    return np.stack([source.plane(i) for i in range(source.n_planes)])
+
+
+def show(obj, acquisition, deconvolved):
+    """Browse the slices of the object, noisy blurred and deconvolved volumes with a z slider."""
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import Slider
+
+    from .rendering import Renderer
+
+    fig, axes = plt.subplots(1, 3, figsize=(12, 4.5))
+    plt.subplots_adjust(bottom=0.2)
+    display = Renderer(fig)
+    z = len(deconvolved) // 2
+    panels = []
+    for ax, volume, title in zip(axes, (obj, acquisition.noisy_blurred, deconvolved),
+                                 ('Object', 'Noisy blurred', 'Deconvolved')):
+        panels.append(display.image(ax, np.asarray(volume[z]), origin='lower'))
+        ax.set_title(title)
+        ax.set_xticks([])
+        ax.set_yticks([])
+    slider = Slider(plt.axes([0.25, 0.05, 0.5, 0.04]), 'z', 0, len(deconvolved) - 1, valinit=z, valstep=1)
+
+    def update(val):
+        z = int(val)
+        for panel, volume in zip(panels, (obj, acquisition.noisy_blurred, deconvolved)):
+            panel.update(np.asarray(volume[z]))
+        display.refresh(*panels)
+
+    slider.on_changed(update)
+    plt.show()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Blur, add noise to and deconvolve a z-stack block by block, reporting the peak memory.")
+    parser.add_argument('volume', nargs='?', help='z-stack (.npy, TIFF, ...); synthetic beads if omitted')
+    parser.add_argument('--shape', type=int, nargs=3, default=[64, 256, 256], help='shape of the synthetic volume')
+    parser.add_argument('--psf', default='gaussian', choices=PSF_MODELS, help='PSF model')
+    parser.add_argument('--sigma-xy', type=float, default=2.0, help='lateral PSF sigma in voxels')
+    parser.add_argument('--sigma-z', type=float, default=4.0, help='axial PSF sigma (Rayleigh range for beam) in voxels')
+    parser.add_argument('--noise', type=float, default=0.005, help='noise level')
+    parser.add_argument('--balance', type=float, default=0.1, help='Wiener balance')
+    parser.add_argument('--method', default='Wiener', choices=VOLUME_METHODS, help='deconvolution method')
+    parser.add_argument('--block', type=int, nargs=3, default=list(BLOCK_SHAPE), help='block shape (z, y, x)')
+    parser.add_argument('--precision', default=None, help='float32 (default) or float64')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the noise')
+    parser.add_argument('--out', default=None, help='directory for memory-mapped results (in memory if omitted)')
+    parser.add_argument('--show', action='store_true', help='browse the slices, deconvolving them on demand')
+    args = parser.parse_args(argv)
+
+    dtype = real_dtype(args.precision)
+    obj = load_volume(args.volume) if args.volume else synthetic_volume(args.shape, dtype=dtype)
+    psf = make_psf(args.psf, args.sigma_xy, args.sigma_z, dtype)
+    block_shape = tuple(min(b, n) for b, n in zip(args.block, obj.shape))
+    print(f"Volume {obj.shape}, PSF {psf.shape}, blocks {block_shape}, "
+          f"estimated working memory per block {block_memory(block_shape, psf.shape, dtype=dtype) / 2**20:.0f} MB")
+
+    tracemalloc.start()
+    acquisition = acquire_volume(obj, psf, args.noise, np.random.default_rng(args.seed), block_shape, args.out)
+    if args.show:
+        deconvolved = lazy_deconvolution(obj, acquisition, args.method, args.balance)
+        deconvolved[len(deconvolved) // 2]
+    else:
+        deconvolved = deconvolve_volume(obj, acquisition, args.method, args.balance, block_shape, out_dir=args.out)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"Peak memory of the arrays (tracemalloc): {peak / 2**20:.0f} MB")
+
+    if args.show:
+        show(obj, acquisition, deconvolved)
+
+
+if __name__ == '__main__':
+    main()